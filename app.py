@@ -3,21 +3,38 @@
 # Streamlit >= 1.36
 # =========================================================
 
-from datetime import datetime, timedelta
+from datetime import timedelta
+from pathlib import Path
+import uuid
 import pandas as pd
 import streamlit as st
-from streamlit_autorefresh import st_autorefresh
 import plotly.graph_objects as go
 import plotly.express as px
 
 # --- Project Modules ---
-from devices import load_devices, save_devices
-from get_power_data import fetch_and_log_once
-from tuya_api import control_device, get_token
-from tuya_api_mongo import latest_docs, range_docs
-from billing import (
-    daily_monthly_for,
-    aggregate_totals_all_devices
+from fleet import fetch_series
+from export import start_export, get_export, prune_exports, EXPORT_TTL_SECONDS
+from tuya_api_mongo import page_docs, warm_up
+from downsample import downsample, render_mode, CHART_MAX_POINTS
+from fleet_summary import summary_age_seconds, SUMMARY_MAX_AGE_SECONDS
+from ring_buffer import new_live_buffer, update_live_buffer, LIVE_WINDOW_HOURS
+from ring_store import ring_latest
+from timeutil import as_utc, local_date_range, local_datetime, local_now, to_local
+from devices import load_devices, registry
+from get_power_data import refresh_latest
+from group_control import switch_devices, summarize
+from tuya_api import control_device, get_token, PRIORITY_INTERACTIVE
+from data_cache import (
+    cached_latest_reading,
+    cached_latest_many,
+    cached_sparklines,
+    invalidate_latest_reading,
+    cached_range_docs,
+    cached_bucketed_docs,
+    cached_daily_monthly_for,
+    cached_aggregate_totals,
+    cached_fleet_summary,
+    cache_stats,
 )
 
 # ---------------------------------------------------------
@@ -29,6 +46,9 @@ st.set_page_config(
     initial_sidebar_state="collapsed"
 )
 
+# connect to MongoDB once per server process, before the first query
+warm_up()
+
 # ---------------------------------------------------------
 # DARK THEME + SKY BLUE BUTTONS
 # ---------------------------------------------------------
@@ -122,6 +142,10 @@ def go_manual():
     set_route("manual")
 
 
+def go_compare():
+    set_route("compare")
+
+
 def go_device_detail(i, n):
     st.session_state.current_device_id = i
     st.session_state.current_device_name = n
@@ -137,7 +161,7 @@ def render_topbar():
         🌱 Green Power Monitor</h1><br><br>
     """, unsafe_allow_html=True)
 
-    n1, n2, n3, n4, n5 = st.columns([1, 1, 1, 1, 1])
+    n1, n2, n3, n4, n5, n6 = st.columns([1, 1, 1, 1, 1, 1])
     with n1:
         if st.button("🏠 Dashboard"):
             go_home()
@@ -155,6 +179,10 @@ def render_topbar():
             go_manage()
             st.rerun()
     with n5:
+        if st.button("📊 Compare"):
+            go_compare()
+            st.rerun()
+    with n6:
         if st.button("📘 User Manual"):
             go_manual()
             st.rerun()
@@ -162,15 +190,67 @@ def render_topbar():
 
 render_topbar()
 
+# ---------------------------------------------------------
+# SIDEBAR: CACHE STATS
+# ---------------------------------------------------------
+with st.sidebar:
+    st.caption("Data cache")
+    st.json(cache_stats())
+
+# ---------------------------------------------------------
+# DEVICE LISTS: SEARCH / SORT / PAGINATION
+# ---------------------------------------------------------
+def _set_page(key, page):
+    st.session_state[key] = page
+
+
+def device_list_page(devs, key, sort_keys, page_sizes=(12, 24, 48)):
+    """Search box, sort order and pager for a device list; returns the visible slice."""
+    c1, c2, c3 = st.columns([3, 2, 1])
+    with c1:
+        q = st.text_input("🔍 Search", key=f"{key}_q", placeholder="name or id")
+    with c2:
+        sort_by = st.selectbox("Sort by", list(sort_keys), key=f"{key}_sort")
+    with c3:
+        size = st.selectbox("Per page", page_sizes, key=f"{key}_size")
+
+    if q:
+        ql = q.lower()
+        devs = [d for d in devs if ql in d["name"].lower() or ql in d["id"].lower()]
+    devs = sorted(devs, key=sort_keys[sort_by])
+
+    page_key = f"{key}_page"
+    n_pages = max(1, -(-len(devs) // size))
+    page = min(st.session_state.get(page_key, 0), n_pages - 1)
+
+    p1, p2, p3 = st.columns([1, 3, 1])
+    with p1:
+        st.button("◀ Prev", key=f"{key}_prev", disabled=page == 0,
+                  on_click=_set_page, args=(page_key, page - 1))
+    with p2:
+        st.caption(f"Page {page + 1} of {n_pages} · {len(devs)} device(s)")
+    with p3:
+        st.button("Next ▶", key=f"{key}_next", disabled=page >= n_pages - 1,
+                  on_click=_set_page, args=(page_key, page + 1))
+    return devs[page * size:(page + 1) * size]
+
 # ---------------------------------------------------------
 # PAGE: HOME
 # ---------------------------------------------------------
 def page_home():
     st.title("📊 Overview")
 
-    devices = load_devices()
-    total_devices = len(devices)
-    p_now, v_now, t_kwh, t_bdt, m_kwh, m_bdt = aggregate_totals_all_devices(devices)
+    # normally a single read of the summary the collector publishes
+    summary = cached_fleet_summary()
+    if summary and summary_age_seconds(summary) <= SUMMARY_MAX_AGE_SECONDS:
+        total_devices = summary["devices"]
+        p_now, v_now = summary["power_total_W"], summary["voltage_max_V"]
+        t_bdt, m_bdt = summary["today_bdt"], summary["month_bdt"]
+    else:
+        st.caption("Fleet summary unavailable or stale (is data_collector.py running?); computed live.")
+        devices = load_devices()
+        total_devices = len(devices)
+        p_now, v_now, t_kwh, t_bdt, m_kwh, m_bdt = cached_aggregate_totals(devices)
 
     cols = st.columns(5)
     data = [
@@ -191,6 +271,72 @@ def page_home():
 # ---------------------------------------------------------
 # PAGE: MY DEVICES
 # ---------------------------------------------------------
+NEW_GROUP = "➕ New group"
+
+
+def _group_controls(devs):
+    """Switch a named group, or a hand-picked set of devices, in one go."""
+    names = {d["id"]: d["name"] for d in devs}
+    groups = registry.groups()
+    with st.expander("🎛️ Group control"):
+        target = st.radio("Target", ["Group", "Pick devices"], horizontal=True, key="grp_target")
+        if target == "Group":
+            if not groups:
+                st.caption("No groups yet; create one below.")
+            gname = st.selectbox("Group", list(groups), key="grp_name",
+                                 format_func=lambda g: f"{g} ({len(groups[g])})")
+            ids = groups.get(gname, [])
+        else:
+            ids = st.multiselect("Devices", list(names), format_func=lambda i: names[i], key="grp_pick")
+        verify = st.checkbox("Verify switch state afterwards", value=True, key="grp_verify")
+
+        action = None
+        c1, c2 = st.columns(2)
+        with c1:
+            if st.button("TURN ALL ON", key="grp_on", disabled=not ids):
+                action = True
+        with c2:
+            if st.button("TURN ALL OFF", key="grp_off", disabled=not ids):
+                action = False
+        if action is not None:
+            # concurrent and rate limited at interactive priority (group_control)
+            with st.spinner(f"Switching {len(ids)} device(s) {'on' if action else 'off'}…"):
+                results = switch_devices(ids, action, verify=verify)
+            s = summarize(results)
+            msg = f"{s['ok']} of {s['devices']} command(s) accepted"
+            if verify:
+                msg += f", {s['verified']} verified"
+            (st.success if not s["failed"] and not s["unverified"] else st.warning)(msg)
+            res_df = pd.DataFrame(results)
+            res_df.insert(1, "name", res_df["device_id"].map(names))
+            st.dataframe(res_df, use_container_width=True, hide_index=True)
+
+        st.markdown("##### Edit groups")
+        g1, g2 = st.columns([1, 2])
+        with g1:
+            edit = st.selectbox("Group", [NEW_GROUP, *groups], key="grp_edit")
+            new = edit == NEW_GROUP
+            edit_name = st.text_input("Name", key="grp_edit_name") if new else edit
+        with g2:
+            members = st.multiselect("Members", list(names), format_func=lambda i: names[i],
+                                     default=[] if new else [i for i in groups[edit] if i in names],
+                                     key=f"grp_members_{edit}")
+        b1, b2 = st.columns(2)
+        with b1:
+            if st.button("💾 Save group", key="grp_save"):
+                try:
+                    registry.set_group(edit_name, members)
+                except (KeyError, ValueError) as e:
+                    st.warning(str(e))
+                else:
+                    st.success("Group saved.")
+                    st.rerun()
+        with b2:
+            if not new and st.button("🗑 Delete group", key="grp_delete"):
+                registry.delete_group(edit)
+                st.rerun()
+
+
 def page_mydevices():
     st.title("⚡ My Devices")
     devs = load_devices()
@@ -201,15 +347,48 @@ def page_mydevices():
             st.rerun()
         return
 
+    _group_controls(devs)
+
+    # one last-value query for the whole list (needed to sort by power)
+    latest = cached_latest_many([d["id"] for d in devs])
+
+    def power_w(d):
+        return float((latest.get(d["id"]) or {}).get("power") or 0) / 10
+
+    visible = device_list_page(devs, "mydev", {
+        "Name": lambda d: d["name"].lower(),
+        "ID": lambda d: d["id"],
+        "Power (high → low)": lambda d: -power_w(d),
+    })
+    # one batched query for all sparklines on this page
+    spark = cached_sparklines([d["id"] for d in visible])
+
     cols = st.columns(3)
-    for i, d in enumerate(devs):
+    for i, d in enumerate(visible):
         with cols[i % 3]:
             st.markdown(
                 f'<div class="card"><b>{d["name"]}</b><br>'
-                f'<span class="metric-label">{d["id"]}</span></div>',
+                f'<span class="metric-label">{d["id"]}</span><br>'
+                f'<span class="metric-value">{power_w(d):.1f} W</span></div>',
                 unsafe_allow_html=True,
             )
-            if st.button(f"Open {d['name']}", key=f"o{i}"):
+            s_df = spark[spark["device_id"] == d["id"]] if not spark.empty else spark
+            if not s_df.empty:
+                fig = px.line(s_df, x=to_local(s_df["timestamp"]), y=s_df["power"] / 10)
+                fig.update_traces(line=dict(color="#00e6ff", width=1.5), hoverinfo="skip")
+                fig.update_layout(
+                    template="plotly_dark",
+                    height=70,
+                    margin=dict(l=0, r=0, t=0, b=0),
+                    paper_bgcolor="rgba(0,0,0,0)",
+                    plot_bgcolor="rgba(0,0,0,0)",
+                    xaxis=dict(visible=False),
+                    yaxis=dict(visible=False),
+                    showlegend=False,
+                )
+                st.plotly_chart(fig, use_container_width=True, config={"displayModeBar": False},
+                                key=f"spark_{d['id']}")
+            if st.button(f"Open {d['name']}", key=f"o{d['id']}"):
                 go_device_detail(d["id"], d["name"])
                 st.rerun()
 
@@ -225,12 +404,14 @@ def page_add():
     with c1:
         if st.button("Save"):
             if name and dev_id:
-                d = load_devices()
-                d.append({"name": name, "id": dev_id})
-                save_devices(d)
-                st.success("Device added successfully.")
-                go_mydevices()
-                st.rerun()
+                try:
+                    registry.add(dev_id, name)
+                except ValueError as e:
+                    st.warning(str(e))
+                else:
+                    st.success("Device added successfully.")
+                    go_mydevices()
+                    st.rerun()
             else:
                 st.warning("Please enter both fields.")
     with c2:
@@ -248,50 +429,66 @@ def page_manage():
         st.info("No devices found.")
         return
 
-    for i, d in enumerate(devs):
+    visible = device_list_page(devs, "manage", {
+        "Name": lambda d: d["name"].lower(),
+        "ID": lambda d: d["id"],
+    }, page_sizes=(10, 25, 50))
+    for d in visible:
+        did = d["id"]
         c1, c2, c3 = st.columns([3, 3, 1])
         with c1:
-            new_name = st.text_input("Name", value=d["name"], key=f"n{i}")
+            new_name = st.text_input("Name", value=d["name"], key=f"n{did}")
         with c2:
-            new_id = st.text_input("ID", value=d["id"], key=f"id{i}")
+            new_id = st.text_input("ID", value=did, key=f"id{did}")
         with c3:
-            if st.button("💾 Save", key=f"s{i}"):
-                devs[i] = {"name": new_name, "id": new_id}
-                save_devices(devs)
-                st.success("Saved successfully.")
-                st.rerun()
-            if st.button("🗑 Delete", key=f"d{i}"):
-                del devs[i]
-                save_devices(devs)
+            if st.button("💾 Save", key=f"s{did}"):
+                try:
+                    registry.update(did, name=new_name, new_id=new_id)
+                except (KeyError, ValueError) as e:
+                    st.warning(str(e))
+                else:
+                    st.success("Saved successfully.")
+                    st.rerun()
+            if st.button("🗑 Delete", key=f"d{did}"):
+                registry.delete(did)
                 st.warning("Device deleted.")
                 st.rerun()
 
 # ---------------------------------------------------------
 # PAGE: DEVICE DETAILS
 # ---------------------------------------------------------
-def page_device():
-    did = st.session_state.get("current_device_id")
-    dname = st.session_state.get("current_device_name")
-
-    if not did:
-        st.error("No device selected.")
-        if st.button("⬅️ Back"):
-            go_home()
-            st.rerun()
-        return
-
-    st_autorefresh(interval=30000, key=f"r{did}")
-    st.title(f"{dname} – Live Data")
-
-    res = fetch_and_log_once(did, dname)
-    if "error" in res:
-        st.error(res["error"])
+# Streamlit >= 1.37 exposes st.fragment; 1.36 only has the experimental name
+fragment = getattr(st, "fragment", None) or st.experimental_fragment
+
+# Only the live section reruns on this timer; billing and history stay put
+LIVE_REFRESH = "30s"
+
+
+@fragment(run_every=LIVE_REFRESH)
+def _device_live(did, dname):
+    # Live values come from the collector's last-value document; the Tuya API
+    # is only called when the user explicitly asks for a refresh.
+    if st.button("🔄 Force refresh"):
+        res = refresh_latest(did, dname)
+        if "error" in res:
+            st.error(res["error"])
+        invalidate_latest_reading(did)
+
+    row = cached_latest_reading(did)
+    # the collector's ring store is read from shared memory: no query, and usually newer
+    ring_row = ring_latest(did)
+    if ring_row and (not row or ring_row["timestamp"] > as_utc(row["timestamp"])):
+        row = ring_row
+    if not row:
+        st.info("No reading yet. Is data_collector.py running?")
         if st.button("⬅️ Back"):
             go_home()
             st.rerun()
         return
 
-    row = res.get("row", {})
+    ts = as_utc(row["timestamp"])
+    age_s = (pd.Timestamp.now(tz="UTC") - ts).total_seconds()
+    st.caption(f"Last reading {to_local(ts):%Y-%m-%d %H:%M:%S} ({age_s:.0f}s ago)")
 
     v = float(row.get("voltage", 0))
     p = float(row.get("power", 0))
@@ -472,16 +669,23 @@ def page_device():
     # Live Power Chart
     
     st.markdown("⚡ Recent Power")
-    df_recent = latest_docs(did, n=30)
+    # per-session ring buffer: seeded once, then only newer readings are fetched
+    buf_key = f"ring_{did}"
+    if buf_key not in st.session_state:
+        st.session_state[buf_key] = new_live_buffer()
+    buf = update_live_buffer(st.session_state[buf_key], did)
+    df_recent = buf.to_frame()
     if not df_recent.empty:
-        df_recent = df_recent.copy()
+        df_recent["timestamp"] = to_local(df_recent["timestamp"])
         df_recent["power_w"] = df_recent["power"] / 10
+        df_recent = downsample(df_recent, "timestamp", "power_w", CHART_MAX_POINTS)
         fig = px.line(
             df_recent,
             x="timestamp",
             y="power_w",
-            markers=True,
-            title="Live Power Trend"
+            markers=len(df_recent) <= 60,
+            render_mode=render_mode(len(df_recent)),
+            title=f"Live Power Trend (last {LIVE_WINDOW_HOURS:g} h)"
             )
         fig.update_traces(line=dict(color="#00e6ff", width=2.5))
         fig.update_layout(
@@ -497,18 +701,21 @@ def page_device():
     else:
         st.info("No data yet.")
 
-    # Controls
+
+@fragment
+def _device_controls(did):
+    # Controls (clicks rerun only this fragment)
     cA, cB, cC = st.columns([1, 1, 2])
     with cA:
         if st.button("TURN ON"):
             try:
-                st.info(control_device(did, get_token(), "switch_1", True))
+                st.info(control_device(did, get_token(PRIORITY_INTERACTIVE), "switch_1", True))
             except Exception as e:
                 st.error(e)
     with cB:
         if st.button("TURN OFF"):
             try:
-                st.info(control_device(did, get_token(), "switch_1", False))
+                st.info(control_device(did, get_token(PRIORITY_INTERACTIVE), "switch_1", False))
             except Exception as e:
                 st.error(e)
     with cC:
@@ -516,11 +723,13 @@ def page_device():
             go_mydevices()
             st.rerun()
 
+
+def _device_billing(did):
     # -----------------------------------------------------
     # BILLING SECTION — Neon Blue Card Style
     # -----------------------------------------------------
     st.markdown("<h3 style='color:#00e6ff;font-weight:700;'>💰 Bill Estimate</h3>", unsafe_allow_html=True)
-    d_u, d_c, m_u, m_c = daily_monthly_for(did)
+    d_u, d_c, m_u, m_c = cached_daily_monthly_for(did)
 
     st.markdown("""
         <style>
@@ -570,39 +779,47 @@ def page_device():
             """, unsafe_allow_html=True)
 
 
+AGG_BUCKETS = {"1-min": "1min", "5-min": "5min", "15-min": "15min"}
+
+
+@fragment
+def _device_history(did):
     # -----------------------------------------------------
     # HISTORICAL DATA
     # -----------------------------------------------------
+    # Widget changes rerun only this fragment; the range query itself is cached
     st.markdown("### 🕰️ Historical Data")
     c1, c2, c3 = st.columns(3)
     with c1:
-        start_date = st.date_input("Start", value=datetime.now().date() - timedelta(days=1))
+        start_date = st.date_input("Start", value=local_now().date() - timedelta(days=1))
     with c2:
-        end_date = st.date_input("End", value=datetime.now().date())
+        end_date = st.date_input("End", value=local_now().date())
     with c3:
         agg = st.selectbox("Aggregation", ["raw", "1-min", "5-min", "15-min"], index=1)
 
-    start_dt = datetime.combine(start_date, datetime.min.time())
-    end_dt = datetime.combine(end_date, datetime.max.time())
-    df = range_docs(did, start_dt, end_dt)
+    start_dt, end_dt = local_date_range(start_date, end_date)
+    if agg == "raw":
+        df = cached_range_docs(did, start_dt, end_dt)
+    else:
+        # bucketed in MongoDB: one row per bucket crosses the wire
+        df = cached_bucketed_docs(did, start_dt, end_dt, bucket=AGG_BUCKETS[agg])
 
     if not df.empty:
-        
-        df = df.sort_values("timestamp").set_index("timestamp")
+        df["timestamp"] = to_local(df["timestamp"])
+        df = df.set_index("timestamp")
         df["power_w"] = df["power"] / 10
         if agg != "raw":
-            df = df.resample({"1-min": "1T", "5-min": "5T", "15-min": "15T"}[agg]) \
-                   .mean(numeric_only=True).dropna()
-            
-        
+            df = df.dropna(subset=["power_w"])
 
         plot_df = df.reset_index()
+        chart_df = downsample(plot_df, "timestamp", "power_w", CHART_MAX_POINTS)
         fig = px.line(
-            plot_df,
+            chart_df,
             x="timestamp",
             y="power_w",
             title=f"⚡ Power Over Time ({agg})",
-            markers=(agg == "raw")
+            markers=(agg == "raw" and len(chart_df) <= 500),
+            render_mode=render_mode(len(chart_df))
         )
         fig.update_traces(line=dict(color="#00e6ff", width=2.5))
         fig.update_layout(
@@ -615,10 +832,229 @@ def page_device():
             margin=dict(l=20, r=20, t=60, b=40)
         )
         st.plotly_chart(fig, use_container_width=True)
-        st.dataframe(plot_df.tail(200))
+        if len(chart_df) < len(plot_df):
+            st.caption(f"Showing {len(chart_df):,} of {len(plot_df):,} points (LTTB downsampled).")
+        _history_table(did, start_dt, end_dt)
+        _export_controls(did, start_dt, end_dt)
     else:
         st.info("No data in selected range.")
 
+
+# served by Streamlit's static file server (.streamlit/config.toml), which streams
+# the file from disk; st.download_button would hold the whole export in memory.
+# Anyone with the link can download a file, so names carry the full random job
+# id and prune_exports deletes them EXPORT_TTL_SECONDS after they finish.
+EXPORT_DIR = Path("static") / "exports"
+EXPORT_URL = "app/static/exports"
+
+
+def _export_controls(did, start_dt, end_dt):
+    prune_exports(EXPORT_DIR)
+    with st.expander("⬇️ Export readings"):
+        c1, c2, c3 = st.columns([2, 2, 1])
+        with c1:
+            scope = st.radio("Devices", ["This device", "All devices"], horizontal=True, key=f"exp_scope_{did}")
+        with c2:
+            fmt = st.radio("Format", ["csv", "parquet"], horizontal=True, key=f"exp_fmt_{did}",
+                           format_func=lambda f: "CSV (gzip)" if f == "csv" else "Parquet")
+        with c3:
+            if st.button("Start export", key=f"exp_go_{did}"):
+                EXPORT_DIR.mkdir(parents=True, exist_ok=True)
+                ids = [did] if scope == "This device" else registry.ids()
+                name = did if scope == "This device" else "fleet"
+                ext = "csv.gz" if fmt == "csv" else "parquet"
+                job_id = uuid.uuid4().hex
+                out = EXPORT_DIR / f"{name}_{to_local(start_dt):%Y%m%d}_{to_local(end_dt):%Y%m%d}_{job_id}.{ext}"
+                # runs on a worker thread; the script thread only polls progress
+                start_export(job_id, ids, start_dt, end_dt, str(out), fmt)
+                st.session_state["export_job"] = job_id
+        job_id = st.session_state.get("export_job")
+        progress = get_export(job_id) if job_id else None
+        if progress is not None:
+            if progress.done:
+                _export_result(progress)
+            else:
+                _export_status(job_id)
+
+
+@fragment(run_every="3s")
+def _export_status(job_id):
+    # polls only while the job runs; once done, one full rerun renders the result
+    progress = get_export(job_id)
+    if progress is None or progress.done:
+        st.rerun()
+    st.caption(f"Exporting… {progress.rows:,} rows ({progress.rows_per_sec:,.0f} rows/s)")
+
+
+def _export_result(progress):
+    if progress.error:
+        st.error(f"Export failed: {progress.error}")
+        return
+    path = Path(progress.path)
+    st.caption(f"Exported {progress.rows:,} rows at {progress.rows_per_sec:,.0f} rows/s "
+               f"({path.stat().st_size / 1e6:.1f} MB); the file is deleted after "
+               f"{EXPORT_TTL_SECONDS / 60:.0f} min.")
+    st.markdown(f'<a href="{EXPORT_URL}/{path.name}" download="{path.name}">⬇️ Download {path.name}</a>',
+                unsafe_allow_html=True)
+
+
+TABLE_PAGE_SIZE = 200
+
+
+def _history_table(did, start_dt, end_dt):
+    """Raw readings, one keyset page at a time (only TABLE_PAGE_SIZE rows are fetched)."""
+    st.markdown("#### 📄 Readings")
+    c1, c2, c3 = st.columns([2, 2, 2])
+    with c1:
+        order = st.selectbox("Order", ["Newest first", "Oldest first"], key=f"tbl_order_{did}")
+    with c2:
+        jump_date = st.date_input("Jump to date", value=None, key=f"tbl_jd_{did}")
+    with c3:
+        jump_time = st.time_input("Time", value=None, key=f"tbl_jt_{did}")
+    descending = order == "Newest first"
+
+    state_key = f"tbl_{did}"
+    sig = (start_dt, end_dt, descending, jump_date, jump_time)
+    state = st.session_state.get(state_key)
+    if state is None or state["sig"] != sig:
+        state = {"sig": sig, "after": None, "before": None}
+        if jump_date is not None:
+            jump_dt = local_datetime(jump_date, jump_time)
+            state["after"] = (jump_dt, None)  # inclusive start
+        st.session_state[state_key] = state
+
+    page = page_docs(did, start_dt, end_dt, limit=TABLE_PAGE_SIZE,
+                     after=state["after"], before=state["before"], descending=descending)
+
+    def go(after=None, before=None):
+        state["after"], state["before"] = after, before
+
+    p1, p2, p3 = st.columns([1, 3, 1])
+    with p1:
+        st.button("◀ Prev", key=f"tbl_prev_{did}", disabled=not page["has_prev"],
+                  on_click=go, kwargs={"before": page["first"]})
+    with p2:
+        if page["first"] is not None:
+            first, last = to_local(page["rows"]["timestamp"].iloc[[0, -1]])
+            st.caption(f"{len(page['rows'])} rows · {first:%Y-%m-%d %H:%M:%S} → {last:%Y-%m-%d %H:%M:%S}")
+    with p3:
+        st.button("Next ▶", key=f"tbl_next_{did}", disabled=not page["has_next"],
+                  on_click=go, kwargs={"after": page["last"]})
+    if page["rows"].empty:
+        st.info("No readings on this page.")
+    else:
+        rows = page["rows"].assign(timestamp=to_local(page["rows"]["timestamp"]))
+        st.dataframe(rows, use_container_width=True)
+
+
+def page_device():
+    did = st.session_state.get("current_device_id")
+    dname = st.session_state.get("current_device_name")
+
+    if not did:
+        st.error("No device selected.")
+        if st.button("⬅️ Back"):
+            go_home()
+            st.rerun()
+        return
+
+    st.title(f"{dname} – Live Data")
+
+    _device_live(did, dname)
+    _device_controls(did)
+    _device_billing(did)
+    _device_history(did)
+
+# ---------------------------------------------------------
+# PAGE: COMPARE DEVICES
+# ---------------------------------------------------------
+def compare_bucket(days: float) -> str:
+    """Rollup resolution for a range: a few hundred points per device at most."""
+    if days <= 1:
+        return "5min"
+    if days <= 7:
+        return "30min"
+    if days <= 62:
+        return "1h"
+    return "1d"
+
+
+def page_compare():
+    st.title("📊 Compare Devices")
+    devs = load_devices()
+    if not devs:
+        st.info("No devices.")
+        return
+
+    names = {d["id"]: d["name"] for d in devs}
+    c1, c2, c3, c4 = st.columns([3, 1, 1, 1])
+    with c1:
+        picked = st.multiselect("Devices", list(names), default=list(names)[:5],
+                                format_func=lambda i: names[i])
+    with c2:
+        start_date = st.date_input("Start", value=local_now().date() - timedelta(days=7), key="cmp_start")
+    with c3:
+        end_date = st.date_input("End", value=local_now().date(), key="cmp_end")
+    with c4:
+        mode = st.radio("Power chart", ["Overlaid", "Stacked"], horizontal=True)
+
+    if not picked:
+        st.info("Pick at least one device.")
+        return
+
+    start_dt, end_dt = local_date_range(start_date, end_date)
+    bucket = compare_bucket((end_dt - start_dt).total_seconds() / 86400)
+
+    # all devices load concurrently, each through the shared cache
+    series = fetch_series(picked, start_dt, end_dt, bucket=bucket,
+                          fields=("power", "energy_kWh"), aggs=("mean", "sum"),
+                          fetch=cached_bucketed_docs)
+    if not series:
+        st.info("No data in selected range.")
+        return
+
+    long_df = pd.concat(
+        [df[["timestamp", "power"]].assign(device=names[did]) for did, df in series.items()],
+        ignore_index=True,
+    )
+    long_df["timestamp"] = to_local(long_df["timestamp"])
+    long_df["power_w"] = long_df["power"] / 10
+    chart = px.area if mode == "Stacked" else px.line
+    fig = chart(long_df, x="timestamp", y="power_w", color="device",
+                title=f"⚡ Power ({bucket} average)")
+    fig.update_layout(
+        template="plotly_dark",
+        paper_bgcolor="rgba(0,10,30,1)",
+        plot_bgcolor="rgba(0,10,30,1)",
+        font=dict(color="#00e6ff"),
+        hovermode="x unified",
+        height=420,
+        margin=dict(l=20, r=20, t=60, b=40)
+    )
+    st.plotly_chart(fig, use_container_width=True)
+
+    ranking = pd.DataFrame({
+        "device": [names[did] for did in series],
+        "kWh": [float(df["energy_kWh_sum"].sum()) for df in series.values()],
+    }).sort_values("kWh", ascending=False, ignore_index=True)
+    total = ranking["kWh"].sum()
+    ranking["share_%"] = (ranking["kWh"] / total * 100).round(1) if total else 0.0
+    ranking.index = ranking.index + 1
+
+    c1, c2 = st.columns([1, 1])
+    with c1:
+        fig_share = px.pie(ranking, names="device", values="kWh", title="🔋 Energy share", hole=0.45)
+        fig_share.update_layout(
+            template="plotly_dark",
+            paper_bgcolor="rgba(0,0,0,0)",
+            font=dict(color="#e6eef6"),
+            height=360,
+        )
+        st.plotly_chart(fig_share, use_container_width=True)
+    with c2:
+        st.markdown("#### 🏆 Ranking by kWh")
+        st.dataframe(ranking.round({"kWh": 3}), use_container_width=True)
+
 # ---------------------------------------------------------
 # PAGE: USER MANUAL
 # ---------------------------------------------------------
@@ -741,6 +1177,8 @@ elif r == "manage":
     page_manage()
 elif r == "device":
     page_device()
+elif r == "compare":
+    page_compare()
 elif r == "manual":
     page_manual()
 else:
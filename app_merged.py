@@ -14,6 +14,7 @@ import streamlit as st
 from pymongo import MongoClient, ASCENDING
 from pymongo.errors import PyMongoError
 from dotenv import load_dotenv
+from tuya_api_mongo import get_client
 
 # ==============================
 # 📦 ENV & CONSTANTS
@@ -96,9 +97,8 @@ def control_device(device_id: str, token: str, command: str, value):
 # ==============================
 @st.cache_resource(show_spinner=False)
 def _get_mongo():
-    if not MONGODB_URI:
-        return None
-    return MongoClient(MONGODB_URI, tls=True)
+    # share the process-wide, tuned client instead of opening a second pool
+    return get_client()
 
 def _get_db(client: MongoClient):
     db = None
@@ -0,0 +1,273 @@
+"""
+archive.py
+----------
+Compressed columnar archive of cold readings: one file per device per UTC
+month, archive/<device_id>/<YYYY-MM>.rda.
+
+File layout:
+    b"RDA1" | uint32 header length | JSON header | block 0 | block 1 | ...
+
+Each block holds up to ARCHIVE_BLOCK_ROWS readings stored column by column,
+every column encoded with numpy and then zlib-compressed:
+- timestamp / ts_key: delta-of-delta at the narrowest integer width that fits
+  (regular sampling turns into runs of zeros)
+- float metrics: XOR with the previous value (Gorilla-style), split into byte
+  planes so the unchanged sign / exponent bytes compress to almost nothing
+- device_name: small integer codes into the header's name list
+
+The header keeps a per-block index (offset, rows, timestamp and per-field
+min / max), so reads only decompress the blocks they overlap.
+
+archive_readings.py moves old months out of MongoDB into these files and
+tuya_api_mongo.range_docs merges them back in transparently.
+"""
+
+import json
+import os
+import struct
+import tempfile
+import zlib
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from timeutil import epoch_ms
+
+ARCHIVE_DIR = Path(os.getenv("ARCHIVE_DIR", "archive"))
+ARCHIVE_BLOCK_ROWS = int(os.getenv("ARCHIVE_BLOCK_ROWS", "8192"))
+ARCHIVE_FIELDS = ("voltage", "current", "power", "energy_kWh")
+COLUMNS = ["timestamp", "device_id", "device_name", *ARCHIVE_FIELDS, "ts_key"]
+
+_MAGIC = b"RDA1"
+_ZLIB_LEVEL = 6
+
+
+# ---------- Column codecs ----------
+def _int_width(a: np.ndarray) -> int:
+    if not len(a):
+        return 1
+    lo, hi = int(a.min()), int(a.max())
+    for w in (1, 2, 4):
+        lim = 1 << (8 * w - 1)
+        if -lim <= lo and hi < lim:
+            return w
+    return 8
+
+def encode_dod(values: np.ndarray) -> bytes:
+    """int64 series -> first value, first delta and the delta-of-deltas."""
+    v = np.asarray(values, dtype=np.int64)
+    t0 = int(v[0]) if len(v) else 0
+    d0 = int(v[1] - v[0]) if len(v) > 1 else 0
+    dod = np.diff(v, n=2) if len(v) > 2 else np.empty(0, np.int64)
+    w = _int_width(dod)
+    return zlib.compress(struct.pack("<qqB", t0, d0, w) + dod.astype(f"<i{w}").tobytes(), _ZLIB_LEVEL)
+
+def decode_dod(buf: bytes, n: int) -> np.ndarray:
+    if not n:
+        return np.empty(0, np.int64)
+    raw = zlib.decompress(buf)
+    t0, d0, w = struct.unpack_from("<qqB", raw)
+    dod = np.frombuffer(raw, dtype=f"<i{w}", offset=17).astype(np.int64)
+    deltas = d0 + np.concatenate(([0], np.cumsum(dod)))
+    return (t0 + np.concatenate(([0], np.cumsum(deltas))))[:n]
+
+def encode_xor(values: np.ndarray) -> bytes:
+    """float64 series -> XOR with the previous value's bits, as 8 byte planes."""
+    bits = np.ascontiguousarray(values, dtype="<f8").view("<u8")
+    x = bits.copy()
+    x[1:] ^= bits[:-1]
+    planes = x.view(np.uint8).reshape(-1, 8).T
+    return zlib.compress(np.ascontiguousarray(planes).tobytes(), _ZLIB_LEVEL)
+
+def decode_xor(buf: bytes, n: int) -> np.ndarray:
+    planes = np.frombuffer(zlib.decompress(buf), dtype=np.uint8).reshape(8, n)
+    x = np.ascontiguousarray(planes.T).view("<u8").ravel()
+    return np.bitwise_xor.accumulate(x).view("<f8")
+
+
+# ---------- Writing ----------
+def month_path(device_id: str, year: int, month: int) -> Path:
+    return ARCHIVE_DIR / device_id / f"{year:04d}-{month:02d}.rda"
+
+def _minmax(a: np.ndarray):
+    finite = a[np.isfinite(a)]
+    return (float(finite.min()), float(finite.max())) if len(finite) else (None, None)
+
+def write_month(device_id: str, year: int, month: int, df: pd.DataFrame) -> Path:
+    """Write one month of readings (range_docs columns) to its archive file, replacing it."""
+    df = df.reindex(columns=COLUMNS).sort_values("timestamp", kind="stable")
+    df = df.drop_duplicates(subset=["ts_key"], keep="first")
+    ts = pd.to_datetime(df["timestamp"], utc=True).dt.as_unit("ms").astype("int64").to_numpy()
+    keys = df["ts_key"].astype("int64").to_numpy()
+    codes, names = pd.factorize(df["device_name"].fillna("").astype(str))
+    values = {f: pd.to_numeric(df[f], errors="coerce").to_numpy(dtype=np.float64) for f in ARCHIVE_FIELDS}
+
+    blocks, chunks, offset = [], [], 0
+    for start in range(0, len(df), ARCHIVE_BLOCK_ROWS):
+        sl = slice(start, start + ARCHIVE_BLOCK_ROWS)
+        parts = {
+            "timestamp": encode_dod(ts[sl]),
+            "ts_key": encode_dod(keys[sl]),
+            "device_name": zlib.compress(codes[sl].astype("<i4").tobytes(), _ZLIB_LEVEL),
+            **{f: encode_xor(values[f][sl]) for f in ARCHIVE_FIELDS},
+        }
+        stats = {f: _minmax(values[f][sl]) for f in ARCHIVE_FIELDS}
+        size = sum(len(p) for p in parts.values())
+        blocks.append({
+            "offset": offset,
+            "rows": len(ts[sl]),
+            "ts_min": int(ts[sl].min()),
+            "ts_max": int(ts[sl].max()),
+            "min": {f: s[0] for f, s in stats.items()},
+            "max": {f: s[1] for f, s in stats.items()},
+            "sizes": {k: len(p) for k, p in parts.items()},
+        })
+        chunks.extend(parts.values())
+        offset += size
+
+    header = json.dumps({
+        "version": 1,
+        "device_id": device_id,
+        "month": f"{year:04d}-{month:02d}",
+        "rows": len(df),
+        "names": [str(n) for n in names],
+        "columns": ["timestamp", "ts_key", "device_name", *ARCHIVE_FIELDS],
+        "blocks": blocks,
+    }).encode("utf-8")
+
+    path = month_path(device_id, year, month)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=path.name, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(_MAGIC + struct.pack("<I", len(header)) + header)
+            for c in chunks:
+                f.write(c)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+    return path
+
+
+# ---------- Reading ----------
+_headers = {}  # path -> ((mtime_ns, size), header)
+
+def read_header(path: Path) -> dict:
+    st = path.stat()
+    stamp = (st.st_mtime_ns, st.st_size)
+    cached = _headers.get(path)
+    if cached and cached[0] == stamp:
+        return cached[1]
+    with open(path, "rb") as f:
+        if f.read(4) != _MAGIC:
+            raise ValueError(f"{path} is not a readings archive")
+        (hlen,) = struct.unpack("<I", f.read(4))
+        header = json.loads(f.read(hlen))
+    header["data_start"] = 8 + hlen
+    _headers[path] = (stamp, header)
+    return header
+
+def _decode_block(f, header: dict, block: dict) -> dict:
+    f.seek(header["data_start"] + block["offset"])
+    n, cols = block["rows"], {}
+    for name in header["columns"]:
+        buf = f.read(block["sizes"][name])
+        if name in ("timestamp", "ts_key"):
+            cols[name] = decode_dod(buf, n)
+        elif name == "device_name":
+            cols[name] = np.frombuffer(zlib.decompress(buf), dtype="<i4")
+        else:
+            cols[name] = decode_xor(buf, n)
+    return cols
+
+def _overlaps(block: dict, lo: int, hi: int, where: dict) -> bool:
+    if block["ts_max"] < lo or block["ts_min"] > hi:
+        return False
+    for f, (vlo, vhi) in where.items():
+        bmin, bmax = block["min"].get(f), block["max"].get(f)
+        if bmin is None or (vlo is not None and bmax < vlo) or (vhi is not None and bmin > vhi):
+            return False
+    return True
+
+def read_month(path: Path, lo: int, hi: int, where: dict = None) -> pd.DataFrame:
+    """Readings of one archive file with lo <= epoch ms <= hi (and ``where`` field bounds)."""
+    where = where or {}
+    header = read_header(path)
+    blocks = [b for b in header["blocks"] if _overlaps(b, lo, hi, where)]
+    if not blocks:
+        return pd.DataFrame()
+    with open(path, "rb") as f:
+        parts = [_decode_block(f, header, b) for b in blocks]
+    cols = {k: np.concatenate([p[k] for p in parts]) for k in parts[0]}
+
+    keep = (cols["timestamp"] >= lo) & (cols["timestamp"] <= hi)
+    for fld, (vlo, vhi) in where.items():
+        if vlo is not None:
+            keep &= cols[fld] >= vlo
+        if vhi is not None:
+            keep &= cols[fld] <= vhi
+    if not keep.any():
+        return pd.DataFrame()
+    names = np.array(header["names"] or [""], dtype=object)
+    df = pd.DataFrame({
+        "timestamp": pd.to_datetime(cols["timestamp"][keep], unit="ms", utc=True),
+        "device_id": header["device_id"],
+        "device_name": names[cols["device_name"][keep]],
+        **{f: cols[f][keep] for f in ARCHIVE_FIELDS},
+        "ts_key": cols["ts_key"][keep],
+    })
+    return df[COLUMNS]
+
+def _months(lo: int, hi: int):
+    start = pd.Timestamp(lo, unit="ms", tz="UTC")
+    end = pd.Timestamp(hi, unit="ms", tz="UTC")
+    y, m = start.year, start.month
+    while (y, m) <= (end.year, end.month):
+        yield y, m
+        y, m = (y + 1, 1) if m == 12 else (y, m + 1)
+
+def iter_archive(device_id: str, start_dt: datetime, end_dt: datetime, where: dict = None):
+    """Archived readings in [start_dt, end_dt], one DataFrame per month file, in time order."""
+    lo, hi = epoch_ms(start_dt), epoch_ms(end_dt)
+    if hi < lo or not (ARCHIVE_DIR / device_id).is_dir():
+        return
+    for y, m in _months(lo, hi):
+        path = month_path(device_id, y, m)
+        if path.exists():
+            df = read_month(path, lo, hi, where)
+            if not df.empty:
+                yield df
+
+def read_archive(device_id: str, start_dt: datetime, end_dt: datetime, where: dict = None) -> pd.DataFrame:
+    """Same columns as tuya_api_mongo.range_docs; empty when nothing is archived there."""
+    frames = list(iter_archive(device_id, start_dt, end_dt, where))
+    if not frames:
+        return pd.DataFrame()
+    return frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+
+def archived_months(device_id: str) -> list:
+    """(year, month) of every archive file of the device, oldest first."""
+    d = ARCHIVE_DIR / device_id
+    if not d.is_dir():
+        return []
+    out = []
+    for p in d.glob("*.rda"):
+        try:
+            y, m = p.stem.split("-")
+            out.append((int(y), int(m)))
+        except ValueError:
+            continue
+    return sorted(out)
+
+def month_bounds(year: int, month: int):
+    """[start, next month start) of a UTC month, as aware datetimes."""
+    start = datetime(year, month, 1, tzinfo=timezone.utc)
+    end = datetime(year + 1, 1, 1, tzinfo=timezone.utc) if month == 12 else \
+        datetime(year, month + 1, 1, tzinfo=timezone.utc)
+    return start, end
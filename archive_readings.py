@@ -0,0 +1,96 @@
+"""
+archive_readings.py
+-------------------
+Moves readings older than ARCHIVE_AFTER_DAYS out of MongoDB into the
+compressed monthly archive files (archive.py).
+
+Only whole UTC months that ended before the cutoff are moved. Each month is
+written (merged with an existing file, so late arrivals are kept), read back
+and checked, and only then deleted from MongoDB; range_docs keeps returning
+the same rows before and after.
+
+Usage:
+    python archive_readings.py                      # every device in devices.json
+    python archive_readings.py <device_id> ... [--days 90] [--dry-run]
+"""
+
+import argparse
+import os
+from datetime import datetime, timedelta, timezone
+
+import pandas as pd
+
+from archive import month_bounds, read_archive, read_header, read_month, write_month
+from devices import registry
+from timeutil import epoch_ms
+from tuya_api_mongo import db_range_docs, delete_range, oldest_timestamp, READING_RESOLUTION_S
+
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "90"))
+
+
+def _with_keys(df: pd.DataFrame) -> pd.DataFrame:
+    # readings stored before ts_key existed get theirs computed, as in tuya_api_mongo.reading_key
+    epoch = pd.to_datetime(df["timestamp"], utc=True).dt.as_unit("s").astype("int64")
+    keys = epoch - epoch % READING_RESOLUTION_S
+    df["ts_key"] = df["ts_key"].fillna(keys) if "ts_key" in df else keys
+    if "device_name" not in df:
+        df["device_name"] = ""
+    return df
+
+
+def archive_month(device_id: str, year: int, month: int, dry_run: bool = False) -> dict:
+    start, end = month_bounds(year, month)
+    df = db_range_docs(device_id, start, end - timedelta(milliseconds=1), compact=False)
+    stats = {"month": f"{year:04d}-{month:02d}", "rows": len(df), "path": None, "bytes": 0, "deleted": 0}
+    if df.empty or dry_run:
+        return stats
+    df = _with_keys(df)
+    existing = read_archive(device_id, start, end - timedelta(milliseconds=1))
+    if not existing.empty:
+        df = pd.concat([existing, df], ignore_index=True)
+    expected = df["ts_key"].nunique()
+
+    path = write_month(device_id, year, month, df)
+    header = read_header(path)
+    stored = read_month(path, epoch_ms(start), epoch_ms(end))
+    if header["rows"] != expected or len(stored) != expected:
+        raise RuntimeError(f"{path}: wrote {header['rows']} / read {len(stored)} rows, expected {expected}")
+    stats["path"], stats["bytes"] = path, path.stat().st_size
+    stats["deleted"] = delete_range(device_id, start, end)
+    return stats
+
+
+def archive_device(device_id: str, cutoff: datetime, dry_run: bool = False) -> list:
+    first = oldest_timestamp(device_id)
+    if first is None:
+        return []
+    y, m = first.year, first.month
+    out = []
+    while month_bounds(y, m)[1] <= cutoff:
+        out.append(archive_month(device_id, y, m, dry_run))
+        y, m = (y + 1, 1) if m == 12 else (y, m + 1)
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Move old readings from MongoDB into the compressed archive.")
+    ap.add_argument("devices", nargs="*", help="device ids (default: all devices)")
+    ap.add_argument("--days", type=int, default=ARCHIVE_AFTER_DAYS, help="archive months older than this")
+    ap.add_argument("--dry-run", action="store_true", help="only report what would be moved")
+    args = ap.parse_args()
+
+    cutoff = datetime.now(timezone.utc) - timedelta(days=args.days)
+    for did in args.devices or registry.ids():
+        for s in archive_device(did, cutoff, args.dry_run):
+            if not s["rows"]:
+                continue
+            if args.dry_run:
+                print(f"[archive] {did} {s['month']}: {s['rows']:,} rows would be archived")
+                continue
+            per_row = s["bytes"] / s["rows"]
+            print(f"[archive] {did} {s['month']}: {s['rows']:,} rows -> {s['path']} "
+                  f"({s['bytes'] / 1e6:.2f} MB, {per_row:.1f} B/row), deleted {s['deleted']:,} from MongoDB")
+
+
+if __name__ == "__main__":
+    main()
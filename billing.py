@@ -1,6 +1,10 @@
 from datetime import datetime
+import numpy as np
 import pandas as pd
-from tuya_api_mongo import range_docs, latest_docs
+from tuya_api_mongo import range_docs, get_latest_many
+from fleet import fleet_timeseries
+from ring_store import ring_bucketed_docs
+from timeutil import epoch_ms, local_day_range, local_month_range, utc_now
 from datetime import timedelta
 
 
@@ -20,39 +24,46 @@ def _tier_cost(units_kwh: float) -> float:
         last_upper = upper
     return round(cost, 2)
 
+def _period_bounds():
+    """Local today and this local month as UTC ranges, computed once per call site."""
+    now = utc_now()
+    return local_day_range(now)[0], local_month_range(now)
+
+# energy_kWh is summed as stored; polled readings from before the collector counted
+# the real sample interval hold ~half the energy (see data_collector.py, "Energy accounting")
+def _day_month_kwh(device_id: str, day_start: datetime, month: tuple):
+    """(today kWh, month kWh) from ONE month read; today is a slice of the epoch index."""
+    mdf = range_docs(device_id, *month)
+    if mdf.empty or "energy_kWh" not in mdf.columns:
+        return 0.0, 0.0
+    energy = mdf["energy_kWh"].to_numpy(dtype=np.float64)
+    today = mdf.index.to_numpy() >= epoch_ms(day_start)
+    return float(np.nansum(energy[today])), float(np.nansum(energy))
+
 def daily_monthly_for(device_id: str):
-    now = datetime.now()
-    # day range
-    day_start = datetime(now.year, now.month, now.day)
-    day_end   = datetime(now.year, now.month, now.day, 23, 59, 59, 999999)
-    ddf = range_docs(device_id, day_start, day_end)
-    d_units = round(float(ddf["energy_kWh"].sum()) if not ddf.empty else 0.0, 3)
+    day_start, month = _period_bounds()
+    d_kwh, m_kwh = _day_month_kwh(device_id, day_start, month)
+    d_units = round(d_kwh, 3)
     d_cost  = _tier_cost(d_units)
-
-    # month range
-    m_start = datetime(now.year, now.month, 1)
-    # naive month-end
-    if now.month == 12:
-        next_month = datetime(now.year + 1, 1, 1)
-    else:
-        next_month = datetime(now.year, now.month + 1, 1)
-    m_end = next_month.replace(hour=0, minute=0, second=0, microsecond=0)
-    mdf = range_docs(device_id, m_start, m_end)
-    m_units = round(float(mdf["energy_kWh"].sum()) if not mdf.empty else 0.0, 3)
+    m_units = round(m_kwh, 3)
     m_cost  = _tier_cost(m_units)
     return d_units, d_cost, m_units, m_cost
 
 
 
-def _latest_power_voltage(device_id: str):
-    df = latest_docs(device_id, n=1)
-    if df.empty:
-        return 0.0, None
-    row = df.iloc[-1]
-    p = float(row.get("power", 0) or 0)
-    v = row.get("voltage", None)
-    v = float(v) if v is not None else None
-    return p, v
+def _latest_power_voltage(device_ids: list):
+    """Instant (power, voltage) per device from the last-value store, one query for all."""
+    latest = get_latest_many(device_ids)
+    out = {}
+    for did in device_ids:
+        row = latest.get(did)
+        if row is None:
+            out[did] = (0.0, None)
+            continue
+        p = float(row.get("power", 0) or 0)
+        v = row.get("voltage", None)
+        out[did] = (p, float(v) if v is not None else None)
+    return out
 
 def aggregate_totals_all_devices(devices: list[str|dict]):
     """Return (total_power_now_W, present_voltage_max_V, today_kwh, today_bill_bdt, month_kwh, month_bill_bdt)"""
@@ -61,39 +72,22 @@ def aggregate_totals_all_devices(devices: list[str|dict]):
     # ---- Instant totals ----
     total_power_now = 0.0
     latest_voltages = []
-    for did in dev_ids:
-        p, v = _latest_power_voltage(did)
+    for p, v in _latest_power_voltage(dev_ids).values():
         total_power_now += p
         if v is not None:
             latest_voltages.append(float(v))
     present_voltage = round(max(latest_voltages), 2) if latest_voltages else 0.0
 
-    # ---- Today (Dhaka local naive) ----
-    now = datetime.now()
-    day_start = datetime(now.year, now.month, now.day)
-    day_end   = datetime(now.year, now.month, now.day, 23, 59, 59, 999999)
-
+    # ---- Today / this month (local calendar, queried as UTC) ----
+    day_start, month = _period_bounds()
     total_kwh_today = 0.0
+    total_kwh_month = 0.0
     for did in dev_ids:
-        ddf = range_docs(did, day_start, day_end)
-        if not ddf.empty and "energy_kWh" in ddf.columns:
-            total_kwh_today += float(ddf["energy_kWh"].sum())
+        d_kwh, m_kwh = _day_month_kwh(did, day_start, month)
+        total_kwh_today += d_kwh
+        total_kwh_month += m_kwh
     total_kwh_today = round(total_kwh_today, 3)
     today_bill_bdt  = _tier_cost(total_kwh_today)
-
-    # ---- This month ----
-    m_start = datetime(now.year, now.month, 1)
-    if now.month == 12:
-        next_month = datetime(now.year + 1, 1, 1)
-    else:
-        next_month = datetime(now.year, now.month + 1, 1)
-    m_end = next_month.replace(hour=0, minute=0, second=0, microsecond=0)
-
-    total_kwh_month = 0.0
-    for did in dev_ids:
-        mdf = range_docs(did, m_start, m_end)
-        if not mdf.empty and "energy_kWh" in mdf.columns:
-            total_kwh_month += float(mdf["energy_kWh"].sum())
     total_kwh_month = round(total_kwh_month, 3)
     month_bill_bdt  = _tier_cost(total_kwh_month)
 
@@ -116,35 +110,21 @@ def aggregate_totals_all_devices(devices: list[str|dict]):
 
 def aggregate_timeseries_24h(devices: list[str|dict], resample_rule="5T") -> pd.DataFrame:
     """Return DataFrame with columns: timestamp, power_sum_W, voltage_avg_V for last 24h."""
-    dev_ids = [d["id"] if isinstance(d, dict) else d for d in devices]
-    end = datetime.now()
+    end = utc_now()
     start = end - timedelta(hours=24)
 
-    frames = []
-    for did in dev_ids:
-        df = range_docs(did, start, end)
-        if df.empty:
-            continue
-        cols = [c for c in ["timestamp", "power", "voltage"] if c in df.columns]
-        if "timestamp" not in cols:
-            continue
-        df = df[cols].sort_values("timestamp").set_index("timestamp")
-        df = df.resample(resample_rule).mean(numeric_only=True)
-        frames.append(df)
-
-    if not frames:
+    # devices are fetched concurrently and aligned on one grid (see fleet.py);
+    # each series comes from the collector's ring store when it covers the day
+    fleet = fleet_timeseries(devices, start, end, bucket=resample_rule,
+                             fields=("power", "voltage"), stats=("sum", "mean"),
+                             fetch=ring_bucketed_docs)
+    if fleet.empty:
         return pd.DataFrame(columns=["timestamp", "power_sum_W", "voltage_avg_V"])
 
-    aligned = pd.concat(frames, axis=1, keys=range(len(frames)))
-    power_cols   = [c for c in aligned.columns if c[1] == "power"]
-    voltage_cols = [c for c in aligned.columns if c[1] == "voltage"]
-
     out = pd.DataFrame({
-        "power_sum_W": aligned[power_cols].sum(axis=1, min_count=1),
-        "voltage_avg_V": aligned[voltage_cols].mean(axis=1)
+        "timestamp": fleet["timestamp"],
+        "power_sum_W": fleet["power_sum"],
+        "voltage_avg_V": fleet["voltage_mean"],
     })
-    out = out.dropna(how="all")
-    out = out.reset_index().rename(columns={"index": "timestamp"})
-    return out
-
-
+    out = out.dropna(subset=["power_sum_W", "voltage_avg_V"], how="all")
+    return out.reset_index(drop=True)
@@ -0,0 +1,226 @@
+"""
+data_cache.py
+-------------
+Process-wide read cache for the Streamlit dashboard.
+
+Streamlit imports this module once per server process, so every browser
+session shares the same cache. Each entry carries its own TTL, chosen from
+how fresh the underlying data is:
+
+- live readings (latest, summary)      -> LIVE_TTL      (seconds)
+- ranges touching today / this month   -> OPEN_TTL
+- ranges that ended before today       -> CLOSED_TTL    (closed days do not change)
+
+The cache is bounded to CACHE_MAX_BYTES of cached values (measured per
+entry, DataFrames with memory_usage(deep=True)) and CACHE_MAX_ENTRIES;
+expired entries go first, then the least recently used. It keeps hit/miss
+counters, see cache_stats().
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+import pandas as pd
+
+from tuya_api_mongo import (
+    range_docs, bucketed_docs, get_latest, get_latest_many, get_summary, sparkline_series,
+)
+from billing import daily_monthly_for, aggregate_totals_all_devices
+from timeutil import as_utc, local_day_range
+
+LIVE_TTL = float(os.getenv("CACHE_LIVE_TTL", "5"))
+OPEN_TTL = float(os.getenv("CACHE_OPEN_TTL", "30"))
+CLOSED_TTL = float(os.getenv("CACHE_CLOSED_TTL", "3600"))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "256"))
+CACHE_MAX_BYTES = int(float(os.getenv("CACHE_MAX_MB", "256")) * 1024 * 1024)
+
+
+def _sizeof(value) -> int:
+    """Approximate bytes held by a cached value."""
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(_sizeof(k) + _sizeof(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(_sizeof(v) for v in value)
+    return sys.getsizeof(value)
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries expire after a per-entry TTL.
+
+    Bounded by the total size of the cached values (``max_bytes``) and by
+    ``max_entries``; a value larger than ``max_bytes`` on its own is not cached.
+    """
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, max_bytes: int = CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._data = OrderedDict()  # key -> (expires_at, value, size)
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] < time.monotonic():
+                return None, False
+            self._data.move_to_end(key)
+            return item[1], True
+
+    def _drop(self, key):
+        self.bytes -= self._data.pop(key)[2]
+
+    def put(self, key, value, ttl: float):
+        size = _sizeof(value)
+        with self._lock:
+            if key in self._data:
+                self._drop(key)
+            if size > self.max_bytes:
+                return
+            self._data[key] = (time.monotonic() + ttl, value, size)
+            self.bytes += size
+            if len(self._data) <= self.max_entries and self.bytes <= self.max_bytes:
+                return
+            now = time.monotonic()
+            for k in [k for k, item in self._data.items() if item[0] < now]:
+                self._drop(k)
+            while len(self._data) > self.max_entries or self.bytes > self.max_bytes:
+                self._drop(next(iter(self._data)))
+                self.evictions += 1
+
+    def get_or_load(self, key, ttl: float, loader):
+        value, found = self.get(key)
+        if found:
+            with self._lock:
+                self.hits += 1
+            return value
+        # one loader per key: concurrent sessions asking for the same
+        # query wait for the first one instead of all hitting Mongo
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            value, found = self.get(key)
+            with self._lock:
+                if found:
+                    self.hits += 1
+                else:
+                    self.misses += 1
+            if not found:
+                value = loader()
+                self.put(key, value, ttl)
+        with self._lock:
+            self._key_locks.pop(key, None)
+        return value
+
+    def invalidate(self, key):
+        with self._lock:
+            if key in self._data:
+                self._drop(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "max_entries": self.max_entries,
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            }
+
+
+_cache = TTLCache()
+
+
+def _copy(value):
+    # callers add columns to the frames they get back; never hand out the cached object
+    return value.copy() if isinstance(value, pd.DataFrame) else value
+
+
+def _range_ttl(end_dt: datetime) -> float:
+    # ranges that ended before the local day started no longer change
+    return CLOSED_TTL if as_utc(end_dt) < local_day_range()[0] else OPEN_TTL
+
+
+# ---------- Cached reads ----------
+def cached_latest_reading(device_id: str):
+    return _cache.get_or_load(("latest_reading", device_id), LIVE_TTL, lambda: get_latest(device_id))
+
+
+def cached_latest_many(device_ids) -> dict:
+    ids = tuple(device_ids)
+    return _cache.get_or_load(("latest_many", ids), LIVE_TTL, lambda: get_latest_many(ids))
+
+
+def cached_sparklines(device_ids, hours: int = 24, bucket: str = "1h") -> pd.DataFrame:
+    """Last ``hours`` of hourly power for a page of devices (one query per page)."""
+    ids = tuple(device_ids)
+
+    def load():
+        end = datetime.now(timezone.utc)
+        return sparkline_series(ids, end - timedelta(hours=hours), end, bucket=bucket)
+
+    return _copy(_cache.get_or_load(("sparklines", ids, hours, bucket), OPEN_TTL * 10, load))
+
+
+def invalidate_latest_reading(device_id: str):
+    _cache.invalidate(("latest_reading", device_id))
+
+
+def cached_fleet_summary():
+    return _cache.get_or_load(("fleet_summary",), LIVE_TTL, get_summary)
+
+
+def cached_range_docs(device_id: str, start_dt: datetime, end_dt: datetime) -> pd.DataFrame:
+    key = ("range_docs", device_id, start_dt, end_dt)
+    ttl = _range_ttl(end_dt)
+    return _copy(_cache.get_or_load(key, ttl, lambda: range_docs(device_id, start_dt, end_dt)))
+
+
+def cached_bucketed_docs(device_id: str, start_dt: datetime, end_dt: datetime,
+                         bucket: str = "5min", aggs=("mean",), fields=None) -> pd.DataFrame:
+    aggs = tuple(aggs)
+    fields = tuple(fields) if fields else None
+    key = ("bucketed_docs", device_id, start_dt, end_dt, bucket, aggs, fields)
+    ttl = _range_ttl(end_dt)
+    kwargs = {"fields": fields} if fields else {}
+    return _copy(_cache.get_or_load(
+        key, ttl, lambda: bucketed_docs(device_id, start_dt, end_dt, bucket, aggs, **kwargs)))
+
+
+def cached_daily_monthly_for(device_id: str):
+    key = ("daily_monthly_for", device_id)
+    return _cache.get_or_load(key, OPEN_TTL, lambda: daily_monthly_for(device_id))
+
+
+def cached_aggregate_totals(devices: list):
+    dev_ids = tuple(d["id"] if isinstance(d, dict) else d for d in devices)
+    key = ("aggregate_totals_all_devices", dev_ids)
+    return _cache.get_or_load(key, OPEN_TTL, lambda: aggregate_totals_all_devices(list(dev_ids)))
+
+
+def cache_stats() -> dict:
+    return _cache.stats()
+
+
+def clear_cache():
+    _cache.clear()
@@ -3,9 +3,27 @@ data_collector.py
 -----------------
 Headless data collector for Tuya smart socket metrics.
 
-- Reads devices from devices.json (via helpers.load_devices)
+- Reads devices from devices.json (via devices.registry)
 - Periodically calls fetch_and_log_once(...) for each device
 - fetch_and_log_once() will insert readings into MongoDB using tuya_api_mongo
+- Keeps a running fleet summary (fleet_summary.FleetSummary) and publishes it
+  every SUMMARY_PUBLISH_SECONDS for the dashboard home page
+- Writes every reading into the shared memory-mapped ring store
+  (ring_store.RingStore), which the dashboard reads for its last-24h views
+- COLLECTOR_MODE=push: readings arrive as status-change events on the push
+  receiver (push_receiver.py) and polling only runs every
+  PUSH_RECONCILE_SECONDS to reconcile what push missed
+
+Energy accounting:
+- Every reading stores energy_kWh = power x the time since the device's
+  previous reading (helpers.sample_seconds, capped at MAX_SAMPLE_SECONDS),
+  in poll and push mode alike, so totals no longer depend on the interval.
+- Polled readings stored by earlier versions counted a fixed 5 s each while
+  the collector polls every INTERVAL_SECONDS (10 s), i.e. about half the real
+  energy. Those readings are not rewritten: months before the upgrade read
+  low by that factor, the month of the upgrade is low only up to the
+  upgrade time, and the first full month after it is the first comparable
+  one (billing.py sums energy_kWh as stored).
 
 Requirements:
 - Same virtualenv / dependencies as your Streamlit app
@@ -17,11 +35,18 @@ Requirements:
     MONGODB_DB
 """
 
+import os
+import threading
 import time
 from datetime import datetime
 
-from helpers import load_devices
+from devices import registry
 from get_power_data import fetch_and_log_once
+from helpers import sample_seconds
+from fleet_summary import FleetSummary, SUMMARY_PUBLISH_SECONDS
+from ring_store import RingStore, seed_from_db
+from push_receiver import start_push_receiver, PUSH_HOST, PUSH_PORT, PUSH_SAMPLE_SECONDS
+from tuya_api_mongo import publish_summary, warm_up, READING_RESOLUTION_S
 from datetime import datetime, timezone
 from zoneinfo import ZoneInfo  # built-in in Python 3.9+
 
@@ -30,18 +55,70 @@ DHAKA_TZ = ZoneInfo("Asia/Dhaka")
 
 # How often to log data (seconds)
 INTERVAL_SECONDS = 10  # change this if you want slower/faster collection
+# "poll": call get_device_status every cycle; "push": ingest status-change events
+COLLECTOR_MODE = os.getenv("COLLECTOR_MODE", "poll").lower()
+# push mode: how often every device is still polled, to catch events push missed
+PUSH_RECONCILE_SECONDS = float(os.getenv("PUSH_RECONCILE_SECONDS", "300"))
+
+
+def sync_ring(ring: RingStore, devices: list):
+    """Drop removed devices from the ring store and fill new ones from MongoDB."""
+    ids = [d["id"] for d in devices if d.get("id")]
+    ring.retain(ids)
+    for did in ids:
+        seed_from_db(ring, did)
 
 
 def main():
-    devices = load_devices()
+    registry.refresh()
+    seen_version = registry.version  # taken first: a reload after it is picked up next cycle
+    devices = registry.all()
     if not devices:
         print("[collector] No devices found in devices.json. Exiting.")
         return
 
     print(f"[collector] Starting data collector for {len(devices)} device(s).")
-    print(f"[collector] Collection interval: {INTERVAL_SECONDS} seconds.")
+    print(f"[collector] Collection interval: {INTERVAL_SECONDS} seconds ({COLLECTOR_MODE} mode).")
     print("[collector] Press Ctrl+C to stop.\n")
 
+    if not warm_up():
+        print("[collector] WARNING: MongoDB is not reachable yet; readings will fail until it is.")
+
+    summary = FleetSummary()
+    # retried every cycle until MongoDB answers
+    seeded = summary.seed(devices)
+    if not seeded:
+        print("[collector] WARNING: could not read the stored totals; the fleet summary starts from zero.")
+    last_publish = 0.0
+
+    try:
+        # push mode writes up to one reading per ts_key slot, so the rings need more room
+        sample_seconds = (min(PUSH_SAMPLE_SECONDS, READING_RESOLUTION_S) if COLLECTOR_MODE == "push"
+                          else INTERVAL_SECONDS)
+        ring = RingStore.open_writer(sample_seconds=sample_seconds)
+        sync_ring(ring, devices)
+    except (OSError, RuntimeError) as e:
+        ring = None
+        print(f"[collector] WARNING: ring store unavailable ({e}); the dashboard will read MongoDB.")
+
+    # the push receiver's flush thread and this loop both feed the summary and the ring store
+    ingest_lock = threading.Lock()
+
+    def on_reading(dev_id, reading):
+        with ingest_lock:
+            summary.add_reading(reading)
+            if ring is not None:
+                ring.append(dev_id, reading)
+
+    push = None
+    if COLLECTOR_MODE == "push":
+        push = start_push_receiver(on_reading)
+        print(f"[collector] Push receiver on http://{PUSH_HOST}:{PUSH_PORT}/events; "
+              f"reconciling by polling every {PUSH_RECONCILE_SECONDS:g} seconds.")
+    poll_every = PUSH_RECONCILE_SECONDS if push else 0.0
+    last_poll = None
+    last_read = {}  # device_id -> monotonic time of its last stored reading (its energy interval)
+
     try:
         while True:
             loop_start_utc = datetime.now(timezone.utc)
@@ -49,10 +126,34 @@ def main():
             print(f"[collector] ==== New cycle at {loop_start_local.isoformat(timespec='seconds')} ====")
 
 
-            # Reload devices each cycle (optional: comment out if you don't want dynamic changes)
-            devices = load_devices()
-
-            for d in devices:
+            # Pick up device changes from the dashboard (one stat() unless devices.json changed).
+            # Compare versions: in push mode the receiver's registry.get() may be the one that reloaded.
+            registry.refresh()
+            if registry.version != seen_version:
+                seen_version = registry.version
+                devices = registry.all()
+                with ingest_lock:
+                    # added / removed devices change the totals: re-read them, under the lock so no reading is counted twice
+                    seeded = summary.seed(devices)
+                    if ring is not None:
+                        try:
+                            sync_ring(ring, devices)
+                        except RuntimeError as e:
+                            print(f"[collector] WARNING: {e}")
+                if push is not None:
+                    push.retain([d["id"] for d in devices if d.get("id")])
+                    last_poll = None  # new devices get their first full status right away
+                print(f"[collector] Device list changed (v{registry.version}): {len(devices)} device(s).")
+            elif not seeded:
+                with ingest_lock:
+                    seeded = summary.seed(devices)
+                if seeded:
+                    print("[collector] Fleet summary seeded from MongoDB.")
+
+            polling = last_poll is None or time.monotonic() - last_poll >= poll_every
+            if polling:
+                last_poll = time.monotonic()
+            for d in devices if polling else ():
                 dev_id = d.get("id")
                 dev_name = d.get("name", "")
 
@@ -61,7 +162,17 @@ def main():
                     continue
 
                 try:
-                    result = fetch_and_log_once(dev_id, dev_name)
+                    if push is not None:
+                        # state only: the push flush thread writes the reading
+                        result = push.reconcile(dev_id, dev_name)
+                    else:
+                        read_at = time.monotonic()
+                        elapsed = read_at - last_read[dev_id] if dev_id in last_read else None
+                        result = fetch_and_log_once(dev_id, dev_name,
+                                                    interval_s=sample_seconds(elapsed, INTERVAL_SECONDS))
+                        if result.get("ok"):
+                            last_read[dev_id] = read_at
+                            on_reading(dev_id, result["row"])
                     now_local = datetime.now(timezone.utc).astimezone(DHAKA_TZ)
                     print(
                         f"[collector] {now_local.isoformat(timespec='seconds')} | "
@@ -74,10 +185,22 @@ def main():
                         f"for device {dev_name or dev_id}: {e}"
                     )
 
+            if ring is not None:
+                with ingest_lock:
+                    ring.touch()  # heartbeat: readers fall back to MongoDB when it goes stale
+
+            if time.monotonic() - last_publish >= SUMMARY_PUBLISH_SECONDS:
+                with ingest_lock:
+                    snapshot = summary.snapshot()
+                if publish_summary(snapshot):
+                    last_publish = time.monotonic()
+
             # Sleep until next cycle
             time.sleep(INTERVAL_SECONDS)
 
     except KeyboardInterrupt:
+        if push is not None:
+            push.stop()
         print("\n[collector] Stopped by user (Ctrl+C). Goodbye.")
 
 
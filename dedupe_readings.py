@@ -0,0 +1,30 @@
+"""
+dedupe_readings.py
+------------------
+One-off migration for readings stored before the unique reading key.
+
+Tags every untagged reading with its ts_key (see tuya_api_mongo.reading_key)
+and deletes the extra copies of readings that were inserted twice (e.g. by
+both data_collector and the dashboard). After this, billing sums no longer
+count those readings twice and replays are rejected by the unique index.
+
+Usage:
+    python dedupe_readings.py               # every device in devices.json
+    python dedupe_readings.py <device_id> ...
+"""
+
+import sys
+
+from devices import registry
+from tuya_api_mongo import backfill_reading_keys
+
+
+def main():
+    device_ids = sys.argv[1:] or registry.ids()
+    for did in device_ids:
+        stats = backfill_reading_keys(did)
+        print(f"[dedupe] {did}: tagged {stats['tagged']:,}, deleted {stats['deleted']:,} duplicate(s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,209 @@
 import json
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
 from pathlib import Path
 
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
 DEVICES_JSON_PATH = Path("devices.json")
 
+
+@contextmanager
+def _file_lock(path: Path):
+    """Exclusive inter-process lock on ``path`` (the app and data_collector both write)."""
+    with open(path, "a+b") as fh:
+        if fcntl is not None:
+            fcntl.flock(fh.fileno(), fcntl.LOCK_EX)
+        else:
+            fh.seek(0)
+            msvcrt.locking(fh.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
+            else:
+                fh.seek(0)
+                msvcrt.locking(fh.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class DeviceRegistry:
+    """Devices indexed by id, backed by devices.json.
+
+    - lookups, add, edit and delete work on an in-memory dict (O(1));
+    - every write holds a lock file and replaces devices.json atomically
+      (temp file + fsync + os.replace), so a crash never leaves a torn file;
+    - refresh() is a single stat() call and only re-reads the file when its
+      mtime/size changed, bumping ``version`` so callers can tell.
+    """
+
+    def __init__(self, path: Path = DEVICES_JSON_PATH):
+        self.path = Path(path)
+        self.lock_path = self.path.with_name(self.path.name + ".lock")
+        self.version = 0
+        self._by_id = {}
+        self._stamp = None
+        self._lock = threading.RLock()
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+            return st.st_mtime_ns, st.st_size
+        except FileNotFoundError:
+            return None
+
+    def _read(self):
+        stamp = self._stat()
+        devs = []
+        if stamp is not None:
+            try:
+                devs = json.loads(self.path.read_text(encoding="utf-8"))
+            except Exception:
+                devs = []
+        self._by_id = {d["id"]: d for d in devs if isinstance(d, dict) and d.get("id")}
+        self._stamp = stamp
+        self.version += 1
+
+    def refresh(self) -> bool:
+        """Reload if devices.json changed on disk; return True when it did."""
+        with self._lock:
+            if self._stat() == self._stamp and self.version:
+                return False
+            self._read()
+            return True
+
+    def _write(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.path.parent, prefix=self.path.name, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(list(self._by_id.values()), f, indent=4)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+        self._stamp = self._stat()
+        self.version += 1
+
+    @contextmanager
+    def _mutate(self):
+        with self._lock, _file_lock(self.lock_path):
+            # pick up the other process's writes before applying ours
+            self.refresh()
+            yield self._by_id
+            self._write()
+
+    # ---------- Reads ----------
+    def all(self) -> list:
+        self.refresh()
+        with self._lock:
+            return [dict(d) for d in self._by_id.values()]
+
+    def ids(self) -> list:
+        self.refresh()
+        with self._lock:
+            return list(self._by_id)
+
+    def get(self, device_id: str):
+        self.refresh()
+        with self._lock:
+            d = self._by_id.get(device_id)
+            return dict(d) if d else None
+
+    def __len__(self):
+        self.refresh()
+        return len(self._by_id)
+
+    # ---------- Groups ----------
+    # a device's "groups" field lists the named groups it belongs to
+    def groups(self) -> dict:
+        """Group name -> device ids, in file order."""
+        self.refresh()
+        out = {}
+        with self._lock:
+            for did, d in self._by_id.items():
+                for g in d.get("groups") or ():
+                    out.setdefault(g, []).append(did)
+        return dict(sorted(out.items()))
+
+    def group(self, name: str) -> list:
+        ids = self.groups().get(name)
+        if ids is None:
+            raise KeyError(f"No device group named {name!r}")
+        return ids
+
+    # ---------- Writes ----------
+    def add(self, device_id: str, name: str, **extra):
+        with self._mutate() as devs:
+            if device_id in devs:
+                raise ValueError(f"Device {device_id} already exists")
+            devs[device_id] = {"name": name, "id": device_id, **extra}
+
+    def update(self, device_id: str, name: str = None, new_id: str = None, **extra):
+        with self._mutate() as devs:
+            if device_id not in devs:
+                raise KeyError(device_id)
+            if new_id and new_id != device_id and new_id in devs:
+                raise ValueError(f"Device {new_id} already exists")
+            d = dict(devs[device_id])
+            d.update(extra)
+            if name is not None:
+                d["name"] = name
+            if new_id and new_id != device_id:
+                d["id"] = new_id
+                # keep the device's position in the file
+                items = [(new_id if k == device_id else k, d if k == device_id else v) for k, v in devs.items()]
+                devs.clear()
+                devs.update(items)
+            else:
+                devs[device_id] = d
+
+    def delete(self, device_id: str):
+        with self._mutate() as devs:
+            devs.pop(device_id, None)
+
+    def set_group(self, name: str, device_ids):
+        """Make ``device_ids`` exactly the members of group ``name`` (empty: delete the group)."""
+        name = name.strip()
+        if not name:
+            raise ValueError("Group name is empty")
+        members = set(device_ids)
+        with self._mutate() as devs:
+            unknown = members - devs.keys()
+            if unknown:
+                raise KeyError(f"Unknown device(s): {', '.join(sorted(unknown))}")
+            for did, d in devs.items():
+                groups = [g for g in d.get("groups") or () if g != name]
+                if did in members:
+                    groups.append(name)
+                if sorted(groups) != sorted(d.get("groups") or ()):
+                    devs[did] = {k: v for k, v in d.items() if k != "groups"}
+                    if groups:
+                        devs[did]["groups"] = sorted(groups)
+
+    def delete_group(self, name: str):
+        self.set_group(name, ())
+
+    def replace_all(self, devs: list):
+        with self._mutate() as by_id:
+            by_id.clear()
+            by_id.update({d["id"]: d for d in devs if d.get("id")})
+
+
+registry = DeviceRegistry()
+
+
 def load_devices():
-    if not DEVICES_JSON_PATH.exists():
-        return []
-    try:
-        return json.loads(DEVICES_JSON_PATH.read_text(encoding="utf-8"))
-    except Exception:
-        return []
+    return registry.all()
 
 def save_devices(devs: list):
-    DEVICES_JSON_PATH.write_text(json.dumps(devs, indent=4), encoding="utf-8")
+    registry.replace_all(devs)
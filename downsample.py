@@ -0,0 +1,100 @@
+"""
+downsample.py
+-------------
+Shape-preserving downsampling for time-series charts.
+
+A browser cannot usefully draw more points than it has pixels, so long
+ranges are reduced to CHART_MAX_POINTS before they are handed to plotly:
+
+- lttb()    Largest-Triangle-Three-Buckets; keeps the visual shape (peaks,
+            dips, slopes) with one point per bucket.
+- minmax()  keeps the min and max of every bucket; cheapest, and guarantees
+            every extreme survives.
+
+Above WEBGL_THRESHOLD points charts should also switch to WebGL traces
+(px.line(..., render_mode="webgl")).
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+CHART_MAX_POINTS = int(os.getenv("CHART_MAX_POINTS", "2000"))
+WEBGL_THRESHOLD = int(os.getenv("CHART_WEBGL_THRESHOLD", "1000"))
+
+
+def lttb(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """Return the indices of the ``n_out`` points LTTB keeps (sorted)."""
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    x = x.astype(np.float64)
+    y = y.astype(np.float64)
+
+    # first and last point are always kept; the rest is split into n_out - 2 buckets
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    starts, ends = edges[:-1], edges[1:]
+
+    # average point of every bucket, computed once for all buckets
+    counts = ends - starts
+    cx, cy = np.cumsum(np.r_[0.0, x]), np.cumsum(np.r_[0.0, y])
+    avg_x = (cx[ends] - cx[starts]) / counts
+    avg_y = (cy[ends] - cy[starts]) / counts
+    # the bucket after the last one is the final point itself
+    avg_x = np.r_[avg_x[1:], x[-1]]
+    avg_y = np.r_[avg_y[1:], y[-1]]
+
+    out = np.empty(n_out, dtype=np.int64)
+    out[0], out[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        s, e = starts[i], ends[i]
+        # twice the triangle area (a, candidate, next bucket average), vectorized over the bucket
+        area = np.abs(
+            (x[a] - avg_x[i]) * (y[s:e] - y[a])
+            - (x[a] - x[s:e]) * (avg_y[i] - y[a])
+        )
+        a = s + int(np.argmax(area))
+        out[i + 1] = a
+    return out
+
+
+def minmax(y: np.ndarray, n_out: int) -> np.ndarray:
+    """Return the indices of each bucket's min and max (about ``n_out`` points, sorted)."""
+    n = len(y)
+    if n_out >= n or n_out < 2:
+        return np.arange(n)
+    n_buckets = max(1, n_out // 2)
+    starts = np.linspace(0, n, n_buckets + 1).astype(np.int64)[:-1]
+    starts = np.unique(starts)
+    y = y.astype(np.float64)
+    # argmin/argmax per bucket without a Python loop: sort inside buckets by value
+    bucket = np.repeat(np.arange(len(starts)), np.diff(np.r_[starts, n]))
+    order = np.lexsort((y, bucket))
+    first = np.r_[starts]
+    last = np.r_[starts[1:], n] - 1
+    idx = np.concatenate([order[first], order[last], [0, n - 1]])
+    return np.unique(idx)
+
+
+def downsample(df: pd.DataFrame, x: str, y: str, n_out: int = CHART_MAX_POINTS,
+               method: str = "lttb") -> pd.DataFrame:
+    """Reduce ``df`` (sorted by ``x``) to about ``n_out`` rows for plotting."""
+    if len(df) <= n_out:
+        return df
+    df = df[df[y].notna()]
+    yv = df[y].to_numpy()
+    if method == "minmax":
+        keep = minmax(yv, n_out)
+    else:
+        xv = df[x].to_numpy()
+        if np.issubdtype(xv.dtype, np.datetime64) or isinstance(df[x].dtype, pd.DatetimeTZDtype):
+            xv = df[x].astype("int64").to_numpy()
+        keep = lttb(xv, yv, n_out)
+    return df.iloc[keep]
+
+
+def render_mode(n_points: int) -> str:
+    return "webgl" if n_points > WEBGL_THRESHOLD else "svg"
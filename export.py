@@ -0,0 +1,242 @@
+"""
+export.py
+---------
+Streaming export of readings to compressed CSV or Parquet.
+
+Rows are read from MongoDB in chunks (cursor batch_size) and written
+incrementally (CSV chunks into a gzip stream / one Parquet row group per
+chunk), so memory stays flat however large the range is.
+
+Usage:
+    python export.py --device <id> [--device <id> ...] --start 2025-01-01 --end 2025-02-01 \
+        --format csv|parquet --out readings.csv.gz
+
+Parquet needs pyarrow (pip install pyarrow); CSV needs nothing extra.
+"""
+
+import argparse
+import gzip
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+
+from archive import iter_archive
+from tuya_api_mongo import get_collection, iter_bucket_frames, METRIC_FIELDS, READINGS_LAYOUT
+
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "50000"))
+EXPORT_COLUMNS = ["timestamp", "device_id", "device_name", *METRIC_FIELDS]
+# finished dashboard exports (job and file) are kept this long
+EXPORT_TTL_SECONDS = float(os.getenv("EXPORT_TTL_SECONDS", "3600"))
+EXPORT_PRUNE_SECONDS = 60
+
+
+def iter_chunks(device_ids, start_dt: datetime, end_dt: datetime, chunk_rows: int = EXPORT_CHUNK_ROWS):
+    """Yield DataFrames of at most ``chunk_rows`` readings, device by device, in time order."""
+    projection = {"_id": 0, **{c: 1 for c in EXPORT_COLUMNS}}
+    for did in device_ids:
+        for df in iter_archive(did, start_dt, end_dt):  # archived months come first
+            for i in range(0, len(df), chunk_rows):
+                yield _frame(df.iloc[i:i + chunk_rows], did)
+        if READINGS_LAYOUT == "bucket":
+            for df in iter_bucket_frames(did, start_dt, end_dt, chunk_rows):
+                yield _frame(df, did)
+            continue
+        coll = get_collection(did, "analytics")
+        if coll is None:
+            continue
+        cur = (coll.find({"timestamp": {"$gte": start_dt, "$lte": end_dt}}, projection)
+               .sort("timestamp", 1)
+               .batch_size(min(chunk_rows, 10000)))
+        buf = []
+        for doc in cur:
+            buf.append(doc)
+            if len(buf) >= chunk_rows:
+                yield _frame(buf, did)
+                buf = []
+        if buf:
+            yield _frame(buf, did)
+
+
+def _frame(docs: list, device_id: str) -> pd.DataFrame:
+    df = pd.DataFrame(docs).reindex(columns=EXPORT_COLUMNS)
+    df["device_id"] = df["device_id"].fillna(device_id)
+    df["timestamp"] = pd.to_datetime(df["timestamp"], utc=True)
+    return df
+
+
+class ExportProgress:
+    """Row / byte counters shared with the UI while an export runs."""
+
+    def __init__(self):
+        self.rows = 0
+        self.started = time.monotonic()
+        self.finished = None
+        self.error = None
+        self.path = None
+
+    @property
+    def done(self):
+        return self.finished is not None
+
+    @property
+    def rows_per_sec(self):
+        elapsed = (self.finished or time.monotonic()) - self.started
+        return self.rows / elapsed if elapsed > 0 else 0.0
+
+
+def export_readings(device_ids, start_dt: datetime, end_dt: datetime, out_path: str, fmt: str = "csv",
+                    chunk_rows: int = EXPORT_CHUNK_ROWS, progress: ExportProgress = None) -> ExportProgress:
+    """Stream the readings of ``device_ids`` in [start_dt, end_dt] to ``out_path``."""
+    progress = progress or ExportProgress()
+    progress.path = out_path
+    try:
+        chunks = iter_chunks(device_ids, start_dt, end_dt, chunk_rows)
+        if fmt == "parquet":
+            _write_parquet(chunks, out_path, progress)
+        elif fmt == "csv":
+            _write_csv_gz(chunks, out_path, progress)
+        else:
+            raise ValueError(f"Unsupported export format: {fmt!r}")
+    except Exception as e:
+        progress.error = e
+    finally:
+        progress.finished = time.monotonic()
+    return progress
+
+
+def _write_csv_gz(chunks, out_path: str, progress: ExportProgress):
+    with gzip.open(out_path, "wt", encoding="utf-8", newline="", compresslevel=6) as f:
+        header = True
+        for df in chunks:
+            df.to_csv(f, header=header, index=False)
+            header = False
+            progress.rows += len(df)
+        if header:  # no rows at all: still write the header
+            pd.DataFrame(columns=EXPORT_COLUMNS).to_csv(f, index=False)
+
+
+def _write_parquet(chunks, out_path: str, progress: ExportProgress):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet export needs pyarrow: pip install pyarrow")
+
+    schema = pa.schema([
+        ("timestamp", pa.timestamp("ms", tz="UTC")),
+        ("device_id", pa.string()),
+        ("device_name", pa.string()),
+        *[(f, pa.float64()) for f in METRIC_FIELDS],
+    ])
+    with pq.ParquetWriter(out_path, schema, compression="zstd") as writer:
+        for df in chunks:
+            df["device_name"] = df["device_name"].astype("string")
+            table = pa.Table.from_pandas(df, schema=schema, preserve_index=False, safe=False)
+            writer.write_table(table)  # one row group per chunk
+            progress.rows += len(df)
+
+
+# ---------- Background exports (Streamlit) ----------
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="export")
+_jobs = {}
+_jobs_lock = threading.Lock()
+_last_prune = 0.0
+
+
+def start_export(job_id: str, device_ids, start_dt: datetime, end_dt: datetime, out_path: str,
+                 fmt: str = "csv", chunk_rows: int = EXPORT_CHUNK_ROWS) -> ExportProgress:
+    """Run export_readings on a worker thread; poll the returned progress object."""
+    progress = ExportProgress()
+    progress.path = out_path
+    with _jobs_lock:
+        _jobs[job_id] = progress
+    _executor.submit(export_readings, list(device_ids), start_dt, end_dt, out_path, fmt,
+                     chunk_rows, progress)
+    return progress
+
+
+def get_export(job_id: str):
+    with _jobs_lock:
+        return _jobs.get(job_id)
+
+
+def _unlink(path):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+def prune_exports(directory: Path = None, ttl: float = EXPORT_TTL_SECONDS, force: bool = False) -> int:
+    """Forget jobs finished more than ``ttl`` seconds ago and delete their files.
+
+    With ``directory`` (the dashboard's export folder) also delete export files
+    older than ``ttl`` that no job knows about, e.g. from before a restart.
+    Runs at most every EXPORT_PRUNE_SECONDS unless ``force``; returns the files deleted.
+    """
+    global _last_prune
+    now = time.monotonic()
+    with _jobs_lock:
+        if not force and now - _last_prune < EXPORT_PRUNE_SECONDS:
+            return 0
+        _last_prune = now
+        expired = [j for j, p in _jobs.items() if p.done and now - p.finished > ttl]
+        paths = [_jobs.pop(j).path for j in expired]
+        running = {p.path for p in _jobs.values()}
+    for path in paths:
+        if path and path not in running:
+            _unlink(path)
+    deleted = len(paths)
+    if directory is not None and Path(directory).is_dir():
+        cutoff = time.time() - ttl
+        for f in Path(directory).iterdir():
+            if f.name.endswith((".csv.gz", ".parquet")) and str(f) not in running:
+                try:
+                    stale = f.stat().st_mtime < cutoff
+                except OSError:
+                    continue
+                if stale:
+                    _unlink(f)
+                    deleted += 1
+    return deleted
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Export readings to compressed CSV or Parquet.")
+    ap.add_argument("--device", action="append", help="device id (repeatable); default: all devices")
+    ap.add_argument("--start", required=True, help="start date/time, e.g. 2025-01-01")
+    ap.add_argument("--end", required=True, help="end date/time, e.g. 2025-02-01")
+    ap.add_argument("--format", choices=["csv", "parquet"], default="csv")
+    ap.add_argument("--out", help="output file (default: readings_<start>_<end>.csv.gz / .parquet)")
+    ap.add_argument("--chunk-rows", type=int, default=EXPORT_CHUNK_ROWS)
+    args = ap.parse_args()
+
+    if args.device:
+        device_ids = args.device
+    else:
+        from devices import registry
+        device_ids = registry.ids()
+    start_dt, end_dt = datetime.fromisoformat(args.start), datetime.fromisoformat(args.end)
+    ext = "parquet" if args.format == "parquet" else "csv.gz"
+    out = args.out or f"readings_{start_dt:%Y%m%d}_{end_dt:%Y%m%d}.{ext}"
+
+    print(f"[export] {len(device_ids)} device(s) -> {out}")
+    progress = start_export("cli", device_ids, start_dt, end_dt, out, args.format, args.chunk_rows)
+    while not progress.done:
+        time.sleep(1)
+        print(f"[export] {progress.rows:,} rows ({progress.rows_per_sec:,.0f} rows/s)", end="\r")
+    print()
+    if progress.error:
+        print(f"[export] ERROR: {progress.error}")
+        raise SystemExit(1)
+    size_mb = os.path.getsize(out) / 1e6
+    print(f"[export] Done: {progress.rows:,} rows, {size_mb:.1f} MB, {progress.rows_per_sec:,.0f} rows/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+fleet.py
+--------
+Fleet-wide time series: many devices on one common time grid.
+
+Device series are fetched concurrently (already bucketed by MongoDB, see
+tuya_api_mongo.bucketed_docs) and scattered into one (buckets x devices)
+float32 matrix per metric in a single vectorized step. Fleet statistics
+(sum, mean, percentiles) are then column reductions over that matrix, so
+no wide per-device DataFrame is ever built and 1,000+ devices stay cheap.
+"""
+
+import os
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from timeutil import LOCAL_TZ_NAME, as_utc
+from tuya_api_mongo import bucketed_docs, pandas_freq
+
+FLEET_FETCH_WORKERS = int(os.getenv("FLEET_FETCH_WORKERS", "16"))
+# a device that misses a bucket keeps its last value for at most this many buckets
+FLEET_MAX_FFILL = int(os.getenv("FLEET_MAX_FFILL", "2"))
+
+def fetch_series(dev_ids: list, start_dt: datetime, end_dt: datetime, bucket: str = "5min",
+                 fields=("power", "voltage"), aggs=("mean",), fetch=bucketed_docs,
+                 workers: int = FLEET_FETCH_WORKERS) -> dict:
+    """Fetch every device's bucketed series concurrently -> {device_id: DataFrame}."""
+    def one(did):
+        return did, fetch(did, start_dt, end_dt, bucket=bucket, aggs=aggs, fields=fields)
+
+    if not dev_ids:
+        return {}
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(dev_ids)))) as pool:
+        return {did: df for did, df in pool.map(one, dev_ids) if not df.empty}
+
+
+def time_grid(start_dt: datetime, end_dt: datetime, bucket: str, tz: str = LOCAL_TZ_NAME) -> pd.DatetimeIndex:
+    """Bucket starts covering [start_dt, end_dt], aligned like $dateTrunc in ``tz``, in UTC."""
+    freq = pandas_freq(bucket)
+
+    def local(dt):
+        return pd.Timestamp(as_utc(dt)).tz_convert(tz)
+
+    return pd.date_range(local(start_dt).floor(freq), local(end_dt), freq=freq).tz_convert("UTC")
+
+
+def align(series: dict, dev_ids: list, grid: pd.DatetimeIndex, fields) -> dict:
+    """Scatter all device series onto ``grid`` at once -> {field: (len(grid), len(dev_ids)) matrix}."""
+    n_rows, n_cols = len(grid), len(dev_ids)
+    mats = {f: np.full((n_rows, n_cols), np.nan, dtype=np.float32) for f in fields}
+    present = [(c, series[did]) for c, did in enumerate(dev_ids) if did in series]
+    if not present or n_rows == 0:
+        return mats
+
+    grid_ns = grid.as_unit("ns").asi8
+    cols = np.concatenate([np.full(len(df), c, dtype=np.int64) for c, df in present])
+    ts = np.concatenate([pd.DatetimeIndex(df["timestamp"]).as_unit("ns").asi8 for _, df in present])
+    rows = np.searchsorted(grid_ns, ts, side="right") - 1
+    ok = (rows >= 0) & (rows < n_rows)
+    rows, cols = rows[ok], cols[ok]
+    for f in fields:
+        vals = np.concatenate([
+            df[f].to_numpy(dtype=np.float32) if f in df.columns else np.full(len(df), np.nan, np.float32)
+            for _, df in present
+        ])
+        mats[f][rows, cols] = vals[ok]
+    return mats
+
+
+def ffill_limited(mat: np.ndarray, limit: int) -> np.ndarray:
+    """Forward-fill NaNs down each column, but never across gaps longer than ``limit`` rows."""
+    if limit <= 0 or mat.size == 0:
+        return mat
+    n_rows = mat.shape[0]
+    row_idx = np.arange(n_rows)[:, None]
+    valid = ~np.isnan(mat)
+    last = np.where(valid, row_idx, -1)
+    np.maximum.accumulate(last, axis=0, out=last)
+    filled = mat[np.clip(last, 0, None), np.arange(mat.shape[1])]
+    too_old = (last < 0) | (row_idx - last > limit)
+    filled[too_old] = np.nan
+    return filled
+
+
+def fleet_stats(mat: np.ndarray, stats=("sum", "mean"), percentiles=()) -> dict:
+    """Reduce a (buckets x devices) matrix across devices."""
+    out = {}
+    reporting = (~np.isnan(mat)).sum(axis=1)
+    with warnings.catch_warnings():
+        # rows where no device reported are expected to come out as NaN
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        if "sum" in stats:
+            out["sum"] = np.where(reporting > 0, np.nansum(mat, axis=1, dtype=np.float64), np.nan)
+        if "mean" in stats:
+            out["mean"] = np.nanmean(mat, axis=1, dtype=np.float64)
+        if "min" in stats:
+            out["min"] = np.nanmin(mat, axis=1)
+        if "max" in stats:
+            out["max"] = np.nanmax(mat, axis=1)
+        for q in percentiles:
+            out[f"p{q:g}"] = np.nanpercentile(mat, q, axis=1)
+    out["reporting"] = reporting
+    return out
+
+
+def fleet_timeseries(devices: list, start_dt: datetime, end_dt: datetime, bucket: str = "5min",
+                     fields=("power", "voltage"), stats=("sum", "mean"), percentiles=(),
+                     max_ffill: int = FLEET_MAX_FFILL, fetch=bucketed_docs) -> pd.DataFrame:
+    """Fleet statistics per bucket.
+
+    Columns: ``timestamp`` plus ``<field>_<stat>`` for every field and stat /
+    percentile (e.g. ``power_sum``, ``power_p95``) and ``<field>_reporting``.
+    """
+    dev_ids = [d["id"] if isinstance(d, dict) else d for d in devices]
+    series = fetch_series(dev_ids, start_dt, end_dt, bucket, fields, fetch=fetch)
+    grid = time_grid(start_dt, end_dt, bucket)
+    mats = align(series, dev_ids, grid, fields)
+
+    out = {"timestamp": grid}
+    for f, mat in mats.items():
+        mat = ffill_limited(mat, max_ffill)
+        for name, values in fleet_stats(mat, stats, percentiles).items():
+            out[f"{f}_{name}"] = values
+    return pd.DataFrame(out)
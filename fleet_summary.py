@@ -0,0 +1,94 @@
+"""
+fleet_summary.py
+----------------
+Running fleet summary kept by data_collector and published for the dashboard.
+
+The collector already sees every reading, so it keeps the home page numbers
+(total power, max voltage, today / month kWh and bills) up to date in memory
+and writes them every SUMMARY_PUBLISH_SECONDS to a single document. The
+home page then reads that one document instead of scanning every device's
+readings for the day and the month.
+"""
+
+import os
+from datetime import datetime
+
+from pymongo.errors import PyMongoError
+
+from billing import _tier_cost, aggregate_totals_all_devices
+from timeutil import as_utc, local_now, to_local, utc_now
+SUMMARY_PUBLISH_SECONDS = float(os.getenv("SUMMARY_PUBLISH_SECONDS", "30"))
+# the dashboard falls back to a full recompute when the summary is older than this
+SUMMARY_MAX_AGE_SECONDS = float(os.getenv("SUMMARY_MAX_AGE_SECONDS", "180"))
+
+
+class FleetSummary:
+    def __init__(self):
+        self.latest = {}        # device_id -> (power, voltage)
+        self.device_ids = []
+        self.day = None         # local date the today_kwh total belongs to
+        self.month = None       # (year, month) of month_kwh
+        self.today_kwh = 0.0
+        self.month_kwh = 0.0
+
+    def seed(self, devices: list) -> bool:
+        """Start from the totals already stored in MongoDB (one full scan, at startup
+        and whenever the device list changes).
+
+        Returns False when MongoDB could not be read: the totals are kept as they
+        were (zero before the first seed) and the caller should retry later.
+        """
+        self.set_devices(devices)
+        now = local_now()
+        try:
+            p_now, v_now, t_kwh, _, m_kwh, _ = aggregate_totals_all_devices(self.device_ids)
+        except PyMongoError:
+            if self.day is None:
+                self.day, self.month = now.date(), (now.year, now.month)
+            return False
+        self.day, self.month = now.date(), (now.year, now.month)
+        self.today_kwh, self.month_kwh = t_kwh, m_kwh
+        return True
+
+    def set_devices(self, devices: list):
+        self.device_ids = [d["id"] if isinstance(d, dict) else d for d in devices]
+        known = set(self.device_ids)
+        self.latest = {k: v for k, v in self.latest.items() if k in known}
+
+    def _roll(self, local_ts: datetime):
+        if self.month != (local_ts.year, local_ts.month):
+            self.month = (local_ts.year, local_ts.month)
+            self.month_kwh = 0.0
+        if self.day != local_ts.date():
+            self.day = local_ts.date()
+            self.today_kwh = 0.0
+
+    def add_reading(self, doc: dict):
+        local_ts = to_local(doc["timestamp"])
+        self._roll(local_ts)
+        self.latest[doc["device_id"]] = (float(doc.get("power") or 0), doc.get("voltage"))
+        e = float(doc.get("energy_kWh") or 0)
+        self.today_kwh += e
+        self.month_kwh += e
+
+    def snapshot(self) -> dict:
+        self._roll(local_now())
+        voltages = [float(v) for _, v in self.latest.values() if v is not None]
+        today_kwh, month_kwh = round(self.today_kwh, 3), round(self.month_kwh, 3)
+        return {
+            "devices": len(self.device_ids),
+            "power_total_W": round(sum(p for p, _ in self.latest.values()), 2),
+            "voltage_max_V": round(max(voltages), 2) if voltages else 0.0,
+            "today_kwh": today_kwh,
+            "today_bdt": _tier_cost(today_kwh),
+            "month_kwh": month_kwh,
+            "month_bdt": _tier_cost(month_kwh),
+            "updated_at": utc_now(),
+        }
+
+
+def summary_age_seconds(summary: dict) -> float:
+    updated = summary.get("updated_at")
+    if updated is None:
+        return float("inf")
+    return (utc_now() - as_utc(updated)).total_seconds()
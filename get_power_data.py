@@ -1,13 +1,62 @@
-from tuya_api import get_token, get_device_status
-from tuya_api_mongo import insert_reading
-from helpers import parse_metrics, build_doc
+import os
+import threading
+import time
 
-def fetch_and_log_once(device_id: str, device_name: str = ""):
-    token = get_token()
-    raw = get_device_status(device_id, token)
+from tuya_api import get_token, get_device_status, PRIORITY_BACKGROUND, PRIORITY_DASHBOARD
+from tuya_api_mongo import insert_reading, upsert_latest
+from helpers import parse_metrics, build_doc, build_reading
+
+# Minimum seconds between two on-demand Tuya fetches for the same device
+REFRESH_MIN_INTERVAL = float(os.getenv("REFRESH_MIN_INTERVAL", "15"))
+
+def store_reading(device_id: str, doc: dict):
+    """Single storage path for a new reading: history + last-value document."""
+    insert_reading(device_id, doc)
+    upsert_latest(device_id, doc)
+
+def fetch_and_log_once(device_id: str, device_name: str = "", priority: int = PRIORITY_BACKGROUND,
+                       interval_s: float = 5.0):
+    """Poll one device and store the reading; ``interval_s`` is the time it stands for (its energy)."""
+    token = get_token(priority)
+    raw = get_device_status(device_id, token, priority)
     if not raw.get("success"):
         return {"error": raw}
-    v, c, p, e = parse_metrics(raw)
-    doc = build_doc(device_id, device_name, v, c, p, e)
-    insert_reading(device_id, doc)
-    return {"ok": True, "row": doc, "raw": raw}
+    v, c, p, e = parse_metrics(raw, interval_s)
+    reading = build_reading(device_id, device_name, v, c, p, e)
+    store_reading(device_id, reading.as_doc())
+    # the raw status JSON is only kept for errors; the reading itself is a slotted record
+    return {"ok": True, "row": reading}
+
+
+# ---------- On-demand refresh (dashboard "force refresh") ----------
+_refresh_locks = {}
+_refresh_last = {}  # device_id -> (monotonic ts, result)
+_refresh_guard = threading.Lock()
+
+def refresh_latest(device_id: str, device_name: str = ""):
+    """Fetch the device status now and update its last-value document.
+
+    Rate limited per device to one Tuya call every REFRESH_MIN_INTERVAL seconds;
+    concurrent callers share the in-flight fetch. The reading is *not* appended
+    to the history collection, that stays the collector's job, so forced
+    refreshes never double-count energy.
+    """
+    with _refresh_guard:
+        lock = _refresh_locks.setdefault(device_id, threading.Lock())
+    with lock:
+        last = _refresh_last.get(device_id)
+        if last and time.monotonic() - last[0] < REFRESH_MIN_INTERVAL:
+            return {**last[1], "throttled": True}
+        try:
+            raw = get_device_status(device_id, get_token(PRIORITY_DASHBOARD), PRIORITY_DASHBOARD)
+        except Exception as e:
+            return {"error": str(e)}
+        if not raw.get("success"):
+            result = {"error": raw}
+        else:
+            v, c, p, e = parse_metrics(raw)
+            doc = build_doc(device_id, device_name, v, c, p, e)
+            upsert_latest(device_id, doc)
+            result = {"ok": True, "row": doc}
+        _refresh_last[device_id] = (time.monotonic(), result)
+        return result
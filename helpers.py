@@ -1,46 +1,78 @@
-import json
 import os
+
 import streamlit as st
-from datetime import datetime, timedelta, timezone
+from datetime import datetime, timezone
+from devices import registry
+
+# a reading stands for the time since the device's previous one, but never for
+# more than this (after an outage the power in between is unknown)
+MAX_SAMPLE_SECONDS = float(os.getenv("MAX_SAMPLE_SECONDS", "60"))
 
-dhaka_tz = timezone(timedelta(hours=6))
 
+def sample_seconds(elapsed, default: float) -> float:
+    """Seconds of energy a reading counts: ``elapsed`` since the device's previous
+    reading (``default`` for its first one), capped at MAX_SAMPLE_SECONDS."""
+    if elapsed is None:
+        return default
+    return min(max(float(elapsed), 0.0), MAX_SAMPLE_SECONDS)
 
-def parse_metrics(status_json: dict):
+def parse_metrics(status_json: dict, interval_s: float = 5.0):
     result = status_json.get("result", [])
     m = {x.get("code"): x.get("value") for x in result}
     voltage = (m.get("cur_voltage") or 0) / 10.0     # deciV → V
     power   = (m.get("cur_power") or 0) * 1.0        # W
     current = (m.get("cur_current") or 0) / 1000.0   # mA → A
-    # integrate power over 5s: kWh = W * (5/3600) / 1000
-    energy_kwh = power * (5.0 / 3600.0) / 1000.0
+    # integrate power over the sample interval: kWh = W * (s/3600) / 1000
+    energy_kwh = power * (interval_s / 3600.0) / 1000.0
     return voltage, current, power, energy_kwh
 
-def build_doc(device_id: str, device_name: str, v: float, c: float, p: float, e: float):
-    return {
-        "timestamp": datetime.now(dhaka_tz),
-        "device_id": device_id,
-        "device_name": device_name or "",
-        "voltage": v,
-        "current": c,
-        "power": p,
-        "energy_kWh": e,
-    }
+class Reading:
+    """One sample. ``__slots__`` keeps it to a few machine words instead of a dict per reading."""
+
+    __slots__ = ("timestamp", "device_id", "device_name", "voltage", "current", "power", "energy_kWh")
+
+    def __init__(self, timestamp, device_id, device_name, voltage, current, power, energy_kWh):
+        self.timestamp = timestamp
+        self.device_id = device_id
+        self.device_name = device_name
+        self.voltage = voltage
+        self.current = current
+        self.power = power
+        self.energy_kWh = energy_kWh
+
+    # mapping-style reads, so code written against reading dicts keeps working
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
 
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def as_doc(self) -> dict:
+        """The MongoDB document for this reading."""
+        return {k: getattr(self, k) for k in self.__slots__}
+
+    def __repr__(self):
+        return (f"Reading({self.timestamp:%Y-%m-%d %H:%M:%S} P={self.power:g}W "
+                f"V={self.voltage:g}V I={self.current:g}A)")
+
+
+def build_reading(device_id: str, device_name: str, v: float, c: float, p: float, e: float) -> Reading:
+    return Reading(datetime.now(timezone.utc), device_id, device_name or "", v, c, p, e)
+
+def build_doc(device_id: str, device_name: str, v: float, c: float, p: float, e: float):
+    return build_reading(device_id, device_name, v, c, p, e).as_doc()
 
-DEVICE_FILE = "devices.json"
 
 def load_devices():
-    """Load all devices from the JSON file."""
-    if not os.path.exists(DEVICE_FILE):
-        return []
-    with open(DEVICE_FILE, "r") as f:
-        return json.load(f)
+    """Load all devices (see devices.DeviceRegistry)."""
+    return registry.all()
 
 def save_devices(devices):
-    """Save all devices to the JSON file."""
-    with open(DEVICE_FILE, "w") as f:
-        json.dump(devices, f, indent=4)
+    """Replace all devices, atomically and under the registry lock."""
+    registry.replace_all(devices)
 
 def go_home():
     """Navigate back to home page."""
@@ -0,0 +1,125 @@
+"""
+import_csv.py
+-------------
+Bulk import of legacy CSV logs (data/{device_id}.csv, written by
+app_merged.log_data) into MongoDB.
+
+- parses with pandas' C engine in chunks (IMPORT_CHUNK_ROWS rows at a time)
+- normalizes the schema: known columns only, numeric metrics, UTC-string
+  timestamps -> tz-aware UTC
+- skips duplicates inside the file itself, and rows already stored for that
+  device through the unique reading key (tuya_api_mongo.insert_readings),
+  without reading existing data first
+- loads with batched, unordered insert_many and reports rows/s
+
+Run dedupe_readings.py first on devices whose readings predate the reading
+key, so those rows are recognised as duplicates too.
+
+Usage:
+    python import_csv.py                      # every data/*.csv
+    python import_csv.py data/<device_id>.csv --device-name "Plug 1"
+"""
+
+import argparse
+import time
+from pathlib import Path
+
+import pandas as pd
+
+from tuya_api_mongo import get_collection, insert_readings, METRIC_FIELDS, READING_RESOLUTION_S
+
+IMPORT_CHUNK_ROWS = 200_000
+INSERT_BATCH = 10_000
+CSV_COLUMNS = ["timestamp", "device_id", "device_name", *METRIC_FIELDS]
+
+
+def read_chunks(path: Path, chunk_rows: int = IMPORT_CHUNK_ROWS):
+    return pd.read_csv(
+        path,
+        engine="c",
+        chunksize=chunk_rows,
+        on_bad_lines="skip",
+        usecols=lambda c: c in CSV_COLUMNS,
+        dtype={"device_id": "string", "device_name": "string"},
+    )
+
+
+def normalize(df: pd.DataFrame, device_id: str, device_name: str = None) -> pd.DataFrame:
+    # legacy rows were written as naive UTC strings ("%Y-%m-%d %H:%M:%S")
+    df = df.reindex(columns=CSV_COLUMNS)
+    df["timestamp"] = pd.to_datetime(df["timestamp"], utc=True, errors="coerce")
+    for f in METRIC_FIELDS:
+        df[f] = pd.to_numeric(df[f], errors="coerce")
+    df["device_id"] = device_id
+    df["device_name"] = device_name if device_name else df["device_name"].fillna("")
+    df = df.dropna(subset=["timestamp"])
+    # same key as tuya_api_mongo.reading_key, vectorized
+    epoch = df["timestamp"].dt.as_unit("s").astype("int64")
+    df["ts_key"] = epoch - epoch % READING_RESOLUTION_S
+    return df.drop_duplicates(subset=["ts_key"])
+
+
+def import_file(path: Path, device_id: str = None, device_name: str = None,
+                chunk_rows: int = IMPORT_CHUNK_ROWS) -> dict:
+    device_id = device_id or path.stem
+    coll = get_collection(device_id)
+    if coll is None:
+        raise RuntimeError("MongoDB is not configured (MONGODB_URI)")
+
+    stats = {"read": 0, "inserted": 0, "skipped": 0}
+    started = time.monotonic()
+    for chunk in read_chunks(path, chunk_rows):
+        stats["read"] += len(chunk)
+        df = normalize(chunk, device_id, device_name)
+        inserted = _insert(device_id, df)
+        stats["inserted"] += inserted
+        stats["skipped"] += len(chunk) - inserted
+
+    stats["seconds"] = round(time.monotonic() - started, 2)
+    stats["rows_per_sec"] = round(stats["read"] / stats["seconds"]) if stats["seconds"] else stats["read"]
+    return stats
+
+
+def _insert(device_id: str, df: pd.DataFrame) -> int:
+    if df.empty:
+        return 0
+    # plain Python str / int / float / Timestamp values for BSON
+    df = df.astype({"device_id": object, "device_name": object, "ts_key": object})
+    inserted = 0
+    for start in range(0, len(df), INSERT_BATCH):
+        docs = df.iloc[start:start + INSERT_BATCH].to_dict("records")
+        inserted += insert_readings(device_id, docs)
+    return inserted
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Import legacy data/{device_id}.csv logs into MongoDB.")
+    ap.add_argument("paths", nargs="*", help="CSV files or directories (default: data/)")
+    ap.add_argument("--device-id", help="device id (default: file name without .csv)")
+    ap.add_argument("--device-name", help="device name to store on every row")
+    ap.add_argument("--chunk-rows", type=int, default=IMPORT_CHUNK_ROWS)
+    args = ap.parse_args()
+
+    files = []
+    for p in map(Path, args.paths or ["data"]):
+        files += sorted(p.glob("*.csv")) if p.is_dir() else [p]
+    if not files:
+        print("[import] No CSV files found.")
+        return
+
+    total = {"read": 0, "inserted": 0, "skipped": 0}
+    started = time.monotonic()
+    for path in files:
+        stats = import_file(path, args.device_id, args.device_name, args.chunk_rows)
+        for k in total:
+            total[k] += stats[k]
+        print(f"[import] {path}: read {stats['read']:,}, inserted {stats['inserted']:,}, "
+              f"skipped {stats['skipped']:,} ({stats['rows_per_sec']:,} rows/s)")
+    elapsed = time.monotonic() - started
+    rate = total["read"] / elapsed if elapsed else 0
+    print(f"[import] Total: read {total['read']:,}, inserted {total['inserted']:,}, "
+          f"skipped {total['skipped']:,} in {elapsed:.1f}s ({rate:,.0f} rows/s)")
+
+
+if __name__ == "__main__":
+    main()
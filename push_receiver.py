@@ -0,0 +1,463 @@
+"""
+push_receiver.py
+----------------
+Push ingestion: a local HTTP receiver for device status-change messages,
+as an alternative to polling every device every cycle.
+
+Tuya delivers status changes through its message service; a bridge (or
+``python push_receiver.py produce`` for local testing) forwards them here,
+shaped like the message service events:
+
+    POST /events                 one envelope, or a JSON list of envelopes
+    X-Push-Sign: <hex HMAC-SHA256 of the body with TUYA_PUSH_SECRET>
+
+    {"protocol": 4, "pv": "2.0", "t": 1700000000000,
+     "data": {"devId": "...", "status": [{"code": "cur_power", "value": 1234, "t": 1700000000000}]}}
+
+Protocol 4 is a status report, protocol 20 a device event (bizCode
+"online" / "offline"). ``data`` must already be decrypted JSON. GET /health
+returns the receiver's counters.
+
+Events only carry the codes that changed, so the receiver keeps the last
+value of every metric code per device and, every PUSH_BATCH_SECONDS, writes
+the devices that changed: history with insert_readings, every last-value
+document in one bulk write, then the collector's ring store and fleet
+summary. History gets at most one reading per device per ts_key slot; an
+unchanged device that is online gets its held values written every
+PUSH_SAMPLE_SECONDS. Like a polled reading, each one counts the energy of the
+time since the device's previous reading, so totals do not depend on how
+often either mode writes. Redelivered events fall into an already written
+slot and are dropped.
+
+Polling stays as a slow reconciliation fallback: data_collector.py in push
+mode calls reconcile() for every device every PUSH_RECONCILE_SECONDS, which
+feeds get_device_status into the same state and counts the values push missed.
+
+Usage:
+    COLLECTOR_MODE=push python data_collector.py       # receiver + reconciliation polling
+    python push_receiver.py serve                      # receiver only (MongoDB, no ring store)
+    python push_receiver.py produce [--devices <id> ...] [--seconds 60] [--rate 1]
+"""
+
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import random
+import threading
+import time
+import urllib.request
+from collections import Counter
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from devices import registry
+from helpers import Reading, parse_metrics, sample_seconds
+from timeutil import utc_now
+from tuya_api import get_device_status, get_token, rate_limit_stats, PRIORITY_BACKGROUND
+from tuya_api_mongo import insert_readings, reading_key, upsert_latest_many, READING_RESOLUTION_S
+
+PUSH_HOST = os.getenv("PUSH_HOST", "127.0.0.1")
+PUSH_PORT = int(os.getenv("PUSH_PORT", "8765"))
+PUSH_SECRET = os.getenv("TUYA_PUSH_SECRET") or os.getenv("TUYA_ACCESS_SECRET", "")
+# changed devices are written at most this often; events in between are coalesced
+PUSH_BATCH_SECONDS = float(os.getenv("PUSH_BATCH_SECONDS", "1"))
+# unchanged online devices get their held values written this often
+PUSH_SAMPLE_SECONDS = int(os.getenv("PUSH_SAMPLE_SECONDS", str(READING_RESOLUTION_S)))
+# stop holding the values of a device nothing (push or reconciliation) was heard from in this long
+PUSH_HOLD_SECONDS = float(os.getenv("PUSH_HOLD_SECONDS", "900"))
+# events older than this, or this far in the future, are rejected (replays / bad clocks)
+PUSH_MAX_AGE_SECONDS = float(os.getenv("PUSH_MAX_AGE_SECONDS", "600"))
+PUSH_MAX_BODY_BYTES = int(os.getenv("PUSH_MAX_BODY_BYTES", str(1 << 20)))
+
+STATUS_PROTOCOL = 4
+EVENT_PROTOCOL = 20
+# the status codes parse_metrics turns into a reading
+METRIC_CODES = ("cur_voltage", "cur_current", "cur_power")
+
+
+class PushError(ValueError):
+    """An event that failed validation; ``reason`` is the counter it is reported under."""
+
+    def __init__(self, reason: str, detail: str = ""):
+        super().__init__(f"{reason}: {detail}" if detail else reason)
+        self.reason = reason
+
+
+# ---------- Decoding / validation ----------
+def sign_body(body: bytes, secret: str = PUSH_SECRET) -> str:
+    return hmac.new(secret.encode("utf-8"), body, hashlib.sha256).hexdigest().upper()
+
+def verify(body: bytes, sign: str, secret: str = PUSH_SECRET) -> bool:
+    return hmac.compare_digest(sign_body(body, secret), (sign or "").upper())
+
+def _now_ms() -> int:
+    return int(time.time() * 1000)
+
+def _is_number(v) -> bool:
+    return isinstance(v, (int, float)) and not isinstance(v, bool)
+
+def decode_event(envelope, now_ms: int = None) -> dict:
+    """One message service envelope -> {"device_id", "t", "status", "biz"}; raises PushError."""
+    if not isinstance(envelope, dict):
+        raise PushError("malformed", "envelope is not an object")
+    protocol = envelope.get("protocol")
+    if protocol not in (STATUS_PROTOCOL, EVENT_PROTOCOL):
+        raise PushError("unsupported_protocol", repr(protocol))
+    data = envelope.get("data")
+    if isinstance(data, str):
+        try:
+            data = json.loads(data)
+        except ValueError:
+            raise PushError("encrypted", "data must be decrypted JSON") from None
+    if not isinstance(data, dict):
+        raise PushError("malformed", "data is not an object")
+
+    device_id = data.get("devId")
+    if not isinstance(device_id, str) or registry.get(device_id) is None:
+        raise PushError("unknown_device", repr(device_id))
+    t = envelope.get("t", data.get("ts"))
+    if not _is_number(t):
+        raise PushError("malformed", "missing t")
+    now_ms = _now_ms() if now_ms is None else now_ms
+    if not -PUSH_MAX_AGE_SECONDS * 1000 <= t - now_ms <= 60_000:
+        raise PushError("stale", f"t={t}")
+
+    if protocol == EVENT_PROTOCOL:
+        return {"device_id": device_id, "t": int(t), "status": [], "biz": data.get("bizCode")}
+
+    status = data.get("status")
+    if not isinstance(status, list):
+        raise PushError("malformed", "status is not a list")
+    items = []
+    for s in status:
+        if not isinstance(s, dict) or s.get("code") not in METRIC_CODES:
+            continue  # switch_1, add_ele, ...: not part of a reading
+        v = s.get("value")
+        if not _is_number(v) or v < 0:
+            raise PushError("bad_value", f"{s.get('code')}={v!r}")
+        st = s.get("t", t)
+        items.append((s["code"], v, int(st) if _is_number(st) else int(t)))
+    return {"device_id": device_id, "t": int(t), "status": items, "biz": None}
+
+
+# ---------- Per-device state ----------
+class _DeviceState:
+    __slots__ = ("name", "codes", "online", "seen", "dirty", "event_ms", "last_key", "last_ts")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.codes = {}        # code -> (value, t ms)
+        self.online = True
+        self.seen = 0.0        # monotonic time of the last event / reconciliation
+        self.dirty = False     # changed since the last written reading
+        self.event_ms = 0      # time of the newest applied change
+        self.last_key = None   # ts_key slot of the last reading written to history
+        self.last_ts = None    # and its timestamp: the next reading's energy interval starts there
+
+    def complete(self) -> bool:
+        return all(c in self.codes for c in METRIC_CODES)
+
+    def reading(self, device_id: str, ts: datetime) -> Reading:
+        status = {"result": [{"code": c, "value": v} for c, (v, _) in self.codes.items()]}
+        elapsed = None if self.last_ts is None else (ts - self.last_ts).total_seconds()
+        return Reading(ts, device_id, self.name,
+                       *parse_metrics(status, sample_seconds(elapsed, PUSH_SAMPLE_SECONDS)))
+
+
+class PushIngestor:
+    """Decoded events -> per-device state -> batched readings on a flush thread.
+
+    ``sink(device_id, reading)`` is called from the flush thread for every
+    reading written to history (the collector feeds its ring store and fleet
+    summary from it).
+    """
+
+    def __init__(self, sink=None):
+        self.sink = sink
+        self._lock = threading.Lock()
+        self._devices = {}
+        self._counts = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+        self.server = None
+
+    def count(self, key: str, n: int = 1):
+        with self._lock:
+            self._counts[key] += n
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._counts, "devices": len(self._devices),
+                    "online": sum(s.online for s in self._devices.values())}
+
+    def _state(self, device_id: str, name: str = None) -> _DeviceState:
+        st = self._devices.get(device_id)
+        if st is None:
+            if name is None:
+                name = (registry.get(device_id) or {}).get("name", "")
+            st = self._devices[device_id] = _DeviceState(name)
+        return st
+
+    # ----- input -----
+    def submit(self, body: bytes):
+        """Decode and apply one POST body; returns (accepted, rejected). Raises ValueError on bad JSON."""
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            raise ValueError("body is not JSON") from None
+        envelopes = payload if isinstance(payload, list) else [payload]
+        accepted, rejected, now_ms = 0, 0, _now_ms()
+        for env in envelopes:
+            try:
+                self.apply(decode_event(env, now_ms))
+                accepted += 1
+            except PushError as e:
+                self.count(f"rejected_{e.reason}")
+                rejected += 1
+        self.count("events", accepted)
+        return accepted, rejected
+
+    def apply(self, event: dict):
+        with self._lock:
+            st = self._state(event["device_id"])
+            st.seen = time.monotonic()
+            if event["biz"] == "offline":
+                st.online = False
+            elif event["biz"] == "online" or event["status"]:
+                st.online = True
+            self._observe(st, event["status"])
+
+    def _observe(self, st: _DeviceState, items) -> list:
+        """Apply (code, value, t ms) items not older than what is held; returns the codes that changed."""
+        changed = []
+        for code, value, t in items:
+            held = st.codes.get(code)
+            if held is not None and t < held[1]:
+                continue  # out of order: a newer value is already applied
+            if held is None or held[0] != value:
+                changed.append(code)
+                st.event_ms = max(st.event_ms, t)
+            st.codes[code] = (value, t)
+        st.dirty = st.dirty or bool(changed)
+        return changed
+
+    def reconcile(self, device_id: str, device_name: str = "") -> dict:
+        """Slow polling fallback: fold get_device_status into the pushed state."""
+        raw = get_device_status(device_id, get_token(PRIORITY_BACKGROUND), PRIORITY_BACKGROUND)
+        if not raw.get("success"):
+            return {"error": raw}
+        t = _now_ms()
+        items = [(s["code"], s["value"], t) for s in raw.get("result", [])
+                 if s.get("code") in METRIC_CODES and _is_number(s.get("value"))]
+        with self._lock:
+            st = self._state(device_id, device_name)
+            st.name = device_name or st.name
+            seeded = st.complete()
+            st.seen = time.monotonic()
+            changed = self._observe(st, items)
+            if seeded and changed:
+                self._counts["reconcile_missed"] += 1  # push did not deliver this change
+            self._counts["reconciled"] += 1
+        return {"ok": True, "changed": changed}
+
+    def retain(self, device_ids):
+        """Forget devices that were removed from the registry."""
+        keep = set(device_ids)
+        with self._lock:
+            for did in [d for d in self._devices if d not in keep]:
+                del self._devices[did]
+
+    # ----- output -----
+    def _due(self, now: datetime):
+        """(device_id, reading, to_history) for every device that needs a write."""
+        now_key, mono = reading_key(now), time.monotonic()
+        out = []
+        with self._lock:
+            for did, st in self._devices.items():
+                if not st.complete():
+                    continue
+                if st.dirty:
+                    ts = min(datetime.fromtimestamp(st.event_ms / 1000, timezone.utc), now)
+                    key = reading_key(ts)
+                    # one history reading per slot; a second change only refreshes the last value
+                    out.append((did, st.reading(did, ts), st.last_key is None or key > st.last_key))
+                    st.dirty = False
+                elif (st.online and mono - st.seen <= PUSH_HOLD_SECONDS
+                      and (st.last_key is None or now_key - st.last_key >= PUSH_SAMPLE_SECONDS)):
+                    out.append((did, st.reading(did, now), True))
+                else:
+                    continue
+                if out[-1][2]:
+                    st.last_ts = out[-1][1].timestamp
+                    st.last_key = reading_key(st.last_ts)
+        return out
+
+    def flush(self, now: datetime = None) -> int:
+        """Write every due reading; returns how many went to history."""
+        due = self._due(now or utc_now())
+        if not due:
+            return 0
+        written = 0
+        for did, reading, to_history in due:
+            if not to_history:
+                self.count("latest_only")
+                continue
+            try:
+                insert_readings(did, [reading.as_doc()])
+            except Exception as e:
+                self.count("store_errors")
+                print(f"[push] ERROR storing reading for {did}: {e}")
+                continue
+            written += 1
+            if self.sink is not None:
+                self.sink(did, reading)
+        if not upsert_latest_many({did: reading.as_doc() for did, reading, _ in due}):
+            self.count("latest_errors")
+            print(f"[push] ERROR updating the last values of {len(due)} device(s)")
+        self.count("readings", written)
+        return written
+
+    def run(self):
+        while not self._stop.wait(PUSH_BATCH_SECONDS):
+            self.flush()
+
+    # ----- lifecycle -----
+    def start(self, host: str = PUSH_HOST, port: int = PUSH_PORT):
+        self.server = ThreadingHTTPServer((host, port), _Handler)
+        self.server.daemon_threads = True
+        self.server.ingestor = self
+        threading.Thread(target=self.server.serve_forever, name="push-http", daemon=True).start()
+        self._thread = threading.Thread(target=self.run, name="push-flush", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def _reply(self, code: int, body: dict):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        ingestor = self.server.ingestor
+        if self.path.rstrip("/") != "/events":
+            return self._reply(404, {"error": "not found"})
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > PUSH_MAX_BODY_BYTES:
+            ingestor.count("rejected_too_large")
+            return self._reply(413, {"error": "body too large"})
+        body = self.rfile.read(length)
+        if not verify(body, self.headers.get("X-Push-Sign", "")):
+            ingestor.count("rejected_signature")
+            return self._reply(401, {"error": "bad signature"})
+        try:
+            accepted, rejected = ingestor.submit(body)
+        except ValueError as e:
+            ingestor.count("rejected_malformed")
+            return self._reply(400, {"error": str(e)})
+        self._reply(202, {"accepted": accepted, "rejected": rejected})
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/health":
+            return self._reply(200, {**self.server.ingestor.stats(), "tuya_rate": rate_limit_stats()})
+        self._reply(404, {"error": "not found"})
+
+    def log_message(self, fmt, *args):
+        pass  # one line per POST is too chatty; /health has the counters
+
+
+def start_push_receiver(sink=None, host: str = PUSH_HOST, port: int = PUSH_PORT) -> PushIngestor:
+    return PushIngestor(sink).start(host, port)
+
+
+# ---------- Local message producer stand-in ----------
+def _post(url: str, envelopes: list, secret: str) -> dict:
+    body = json.dumps(envelopes).encode("utf-8")
+    req = urllib.request.Request(url, data=body, method="POST", headers={
+        "Content-Type": "application/json", "X-Push-Sign": sign_body(body, secret)})
+    with urllib.request.urlopen(req, timeout=10) as res:
+        return json.loads(res.read())
+
+def produce(url: str, device_ids, seconds: float = 60.0, rate: float = 1.0, change: float = 0.3,
+            duplicate: float = 0.05, secret: str = PUSH_SECRET) -> Counter:
+    """Post random-walk status changes the way the message service would.
+
+    The first batch carries every metric code of every device; after that
+    each device changes with probability ``change`` per tick, and a fraction
+    ``duplicate`` of the events is delivered twice.
+    """
+    rng = random.Random()
+    watts = {d: rng.uniform(0, 1500) for d in device_ids}
+    totals, first = Counter(), True
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        t = _now_ms()
+        batch = []
+        for did in device_ids:
+            if not first and rng.random() >= change:
+                continue
+            watts[did] = max(0.0, watts[did] + rng.gauss(0, 50))
+            volts = rng.gauss(230, 2)
+            status = [{"code": "cur_power", "value": int(watts[did] * 10), "t": t}]
+            if first or rng.random() < 0.5:
+                status += [{"code": "cur_voltage", "value": int(volts * 10), "t": t},
+                           {"code": "cur_current", "value": int(watts[did] / volts * 1000), "t": t}]
+            batch.append({"protocol": STATUS_PROTOCOL, "pv": "2.0", "t": t,
+                          "data": {"devId": did, "status": status}})
+        batch += [e for e in batch if rng.random() < duplicate]
+        if batch:
+            res = _post(url, batch, secret)
+            totals.update(sent=len(batch), accepted=res["accepted"], rejected=res["rejected"])
+        first = False
+        time.sleep(1.0 / rate)
+    return totals
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Push ingestion receiver and a local message producer.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    s = sub.add_parser("serve", help="run the receiver alone (no ring store / fleet summary)")
+    s.add_argument("--host", default=PUSH_HOST)
+    s.add_argument("--port", type=int, default=PUSH_PORT)
+    p = sub.add_parser("produce", help="post simulated status changes to a receiver")
+    p.add_argument("--url", default=f"http://{PUSH_HOST}:{PUSH_PORT}/events")
+    p.add_argument("--devices", nargs="*", help="device ids (default: all devices)")
+    p.add_argument("--seconds", type=float, default=60.0)
+    p.add_argument("--rate", type=float, default=1.0, help="batches per second")
+    p.add_argument("--change", type=float, default=0.3, help="chance a device changes per batch")
+    p.add_argument("--duplicate", type=float, default=0.05, help="share of events delivered twice")
+    args = ap.parse_args()
+
+    if args.cmd == "produce":
+        totals = produce(args.url, args.devices or registry.ids(), args.seconds, args.rate,
+                         args.change, args.duplicate)
+        print(f"[push] sent {totals['sent']:,} events: {totals['accepted']:,} accepted, "
+              f"{totals['rejected']:,} rejected")
+        return
+
+    ingestor = start_push_receiver(host=args.host, port=args.port)
+    print(f"[push] Listening on http://{args.host}:{args.port}/events (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(10)
+            print(f"[push] {ingestor.stats()}")
+    except KeyboardInterrupt:
+        ingestor.stop()
+
+
+if __name__ == "__main__":
+    main()
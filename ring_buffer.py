@@ -0,0 +1,109 @@
+"""
+ring_buffer.py
+--------------
+Fixed-size, array-backed ring buffer for the live power trend.
+
+One buffer lives in each Streamlit session per device. It is seeded once
+with the last LIVE_WINDOW_HOURS of readings and afterwards only extended
+with readings newer than its last timestamp, so a refresh costs one tiny
+"timestamp > last" query no matter how long the window is. While
+data_collector keeps the shared ring store (ring_store.py) fresh, both the
+seed and the refreshes are read from it instead, without a query at all.
+"""
+
+import os
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pandas as pd
+
+from ring_store import shared_ring_store
+from tuya_api_mongo import docs_since
+
+LIVE_WINDOW_HOURS = float(os.getenv("LIVE_WINDOW_HOURS", "2"))
+# collector interval; only used to size the buffer
+LIVE_SAMPLE_SECONDS = float(os.getenv("LIVE_SAMPLE_SECONDS", "10"))
+
+FIELDS = ("power", "voltage", "current")
+
+
+class RingBuffer:
+    """Timestamps (int64 ns, UTC) plus one float32 column per metric."""
+
+    def __init__(self, capacity: int):
+        self.capacity = int(capacity)
+        self.ts = np.zeros(self.capacity, dtype=np.int64)
+        self.values = {f: np.zeros(self.capacity, dtype=np.float32) for f in FIELDS}
+        self._head = 0   # next write position
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def last_ts(self):
+        if self._size == 0:
+            return None
+        return int(self.ts[(self._head - 1) % self.capacity])
+
+    def extend(self, ts: np.ndarray, values: dict):
+        """Append readings (ascending ``ts``); only the newest ``capacity`` are kept."""
+        k = len(ts)
+        if k == 0:
+            return
+        if k > self.capacity:
+            ts = ts[-self.capacity:]
+            values = {f: v[-self.capacity:] for f, v in values.items()}
+            k = self.capacity
+        idx = (self._head + np.arange(k)) % self.capacity
+        self.ts[idx] = ts
+        for f in FIELDS:
+            self.values[f][idx] = values.get(f, np.nan)
+        self._head = (self._head + k) % self.capacity
+        self._size = min(self._size + k, self.capacity)
+
+    def _ordered(self, arr: np.ndarray) -> np.ndarray:
+        if self._size < self.capacity:
+            return arr[:self._size]
+        return np.concatenate([arr[self._head:], arr[:self._head]])
+
+    def to_frame(self, since_ns: int = None) -> pd.DataFrame:
+        ts = self._ordered(self.ts)
+        cols = {f: self._ordered(self.values[f]) for f in FIELDS}
+        if since_ns is not None:
+            start = int(np.searchsorted(ts, since_ns, side="left"))
+            ts = ts[start:]
+            cols = {f: v[start:] for f, v in cols.items()}
+        df = pd.DataFrame(cols)
+        df.insert(0, "timestamp", pd.to_datetime(ts, unit="ns", utc=True))
+        return df
+
+
+def _docs_to_arrays(docs: list):
+    ts = pd.to_datetime([d["timestamp"] for d in docs], utc=True).as_unit("ns").asi8
+    values = {f: np.array([d.get(f, np.nan) for d in docs], dtype=np.float32) for f in FIELDS}
+    return ts, values
+
+
+def new_live_buffer(window_hours: float = LIVE_WINDOW_HOURS) -> RingBuffer:
+    # 10% headroom for collector jitter
+    return RingBuffer(int(window_hours * 3600 / LIVE_SAMPLE_SECONDS * 1.1) + 1)
+
+
+def update_live_buffer(buf: RingBuffer, device_id: str, window_hours: float = LIVE_WINDOW_HOURS) -> RingBuffer:
+    """Seed an empty buffer with the window, otherwise fetch only newer readings."""
+    after = datetime.now(timezone.utc) - timedelta(hours=window_hours)
+    if buf.last_ts is not None:
+        # after a long idle spell only the window is worth fetching, the buffer keeps no more
+        after = max(after, pd.Timestamp(buf.last_ts, unit="ns", tz="UTC").to_pydatetime())
+    store = shared_ring_store()
+    after_ns = pd.Timestamp(after).value
+    w = store.window(device_id, after_ns) if store is not None and store.covers(device_id, after_ns) else None
+    if w is not None:
+        buf.extend(*w)
+        return buf
+    docs = docs_since(device_id, after, fields=("timestamp",) + FIELDS)
+    if docs:
+        ts, values = _docs_to_arrays(docs)
+        buf.extend(ts, values)
+    return buf
@@ -0,0 +1,372 @@
+"""
+ring_store.py
+-------------
+Memory-mapped ring of the last RING_HOURS of readings, shared between
+data_collector (the only writer) and the dashboard processes (readers).
+
+File layout, fixed once created (sizes come from the header):
+    header      4096 bytes: magic, version, slots, capacity, heartbeat
+    device ids  slots x 64 bytes (empty = free slot)
+    seq         slots x int64, per-slot sequence lock (odd while writing)
+    count       slots x int64, readings ever written to the slot (write cursor)
+    seeded      slots x int64, ns from which the slot holds every reading
+    timestamp   slots x capacity int64 (ns, UTC)
+    <field>     slots x capacity float32, one array per RING_FIELDS
+
+Readers map the file read-only and slice numpy views straight out of the
+page cache. Only the requested window is copied, under the slot's sequence
+lock, so a reading that is being written is never seen half-done. The
+last-24h views of the dashboard need no database round trip; when the
+collector is not running (stale heartbeat) callers fall back to MongoDB.
+"""
+
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from pymongo.errors import PyMongoError
+
+from timeutil import LOCAL_TZ_NAME, epoch_ns
+from tuya_api_mongo import bucket_readings, bucketed_docs, docs_since, METRIC_FIELDS
+
+RING_STORE_PATH = Path(os.getenv("RING_STORE_PATH", "ring_store.bin"))
+RING_HOURS = float(os.getenv("RING_HOURS", "24"))
+# seconds between two readings of a device; only used to size the rings
+# (data_collector passes the interval of its mode to open_writer)
+RING_SAMPLE_SECONDS = float(os.getenv("RING_SAMPLE_SECONDS", "10"))
+RING_MAX_DEVICES = int(os.getenv("RING_MAX_DEVICES", "256"))
+# readers ignore the store when the collector hasn't written for this long
+RING_STALE_SECONDS = float(os.getenv("RING_STALE_SECONDS", "120"))
+# a reader gives up (and the caller reads MongoDB) after this many tries at a slot being written
+RING_READ_RETRIES = int(os.getenv("RING_READ_RETRIES", "1000"))
+RING_FIELDS = ("power", "voltage", "current", "energy_kWh")
+
+_MAGIC = b"RNG1"
+_VERSION = 2
+_HEADER_BYTES = 4096
+_ID_BYTES = 64
+_HEADER = np.dtype([("magic", "S4"), ("version", "<u4"), ("slots", "<u4"), ("capacity", "<u4"),
+                    ("heartbeat_ns", "<i8")])
+
+
+def default_capacity(hours: float = RING_HOURS, sample_seconds: float = RING_SAMPLE_SECONDS) -> int:
+    # 10% headroom for collector jitter, as in ring_buffer.new_live_buffer
+    return int(hours * 3600 / sample_seconds * 1.1) + 1
+
+
+def _layout_size(slots: int, capacity: int) -> int:
+    return _HEADER_BYTES + slots * (_ID_BYTES + 8 + 8 + 8) + slots * capacity * (8 + 4 * len(RING_FIELDS))
+
+
+class RingStore:
+    def __init__(self, path: Path = RING_STORE_PATH, writable: bool = False):
+        self.path = Path(path)
+        self.writable = writable
+        self._mm = np.memmap(self.path, dtype=np.uint8, mode="r+" if writable else "r")
+        header = np.ndarray((1,), dtype=_HEADER, buffer=self._mm)
+        if header["magic"][0] != _MAGIC or header["version"][0] != _VERSION:
+            raise ValueError(f"{self.path} is not a ring store")
+        self.slots, self.capacity = int(header["slots"][0]), int(header["capacity"][0])
+        if len(self._mm) < _layout_size(self.slots, self.capacity):
+            raise ValueError(f"{self.path} is truncated")
+        self._header = header
+
+        off = _HEADER_BYTES
+
+        def view(dtype, shape):
+            nonlocal off
+            arr = np.ndarray(shape, dtype=dtype, buffer=self._mm, offset=off)
+            off += arr.nbytes
+            return arr
+
+        self._ids = view(f"S{_ID_BYTES}", (self.slots,))
+        self._seq = view("<i8", (self.slots,))
+        self._count = view("<i8", (self.slots,))
+        self._seeded = view("<i8", (self.slots,))
+        self._ts = view("<i8", (self.slots, self.capacity))
+        self._values = {f: view("<f4", (self.slots, self.capacity)) for f in RING_FIELDS}
+        st = os.stat(self.path)
+        self.stamp = (st.st_ino, st.st_size)
+        self._slot_of = {}
+
+    @classmethod
+    def create(cls, path: Path, slots: int, capacity: int) -> "RingStore":
+        path = Path(path)
+        tmp = path.with_name(path.name + ".tmp")
+        with open(tmp, "wb") as f:
+            f.truncate(_layout_size(slots, capacity))  # sparse: unused slots take no disk
+        header = np.memmap(tmp, dtype=_HEADER, mode="r+", shape=(1,))
+        header[0] = (_MAGIC, _VERSION, slots, capacity, 0)
+        header.flush()
+        del header
+        os.replace(tmp, path)
+        return cls(path, writable=True)
+
+    @classmethod
+    def open_writer(cls, path: Path = RING_STORE_PATH, slots: int = RING_MAX_DEVICES,
+                    capacity: int = None, sample_seconds: float = RING_SAMPLE_SECONDS) -> "RingStore":
+        """The collector's store: reuse the file if its layout matches, else recreate it.
+
+        Without ``capacity``, the rings hold RING_HOURS of readings arriving every ``sample_seconds``.
+        """
+        capacity = capacity or default_capacity(sample_seconds=sample_seconds)
+        try:
+            store = cls(path, writable=True)
+            if (store.slots, store.capacity) == (slots, capacity):
+                store._recover()
+                return store
+        except (FileNotFoundError, ValueError):
+            pass
+        return cls.create(path, slots, capacity)
+
+    def _recover(self):
+        """Reset the sequence locks a previous writer left behind.
+
+        A slot whose lock is odd was being written when the collector stopped:
+        its row may be torn, so it is emptied (seed_from_db refills it).
+        """
+        for s in np.flatnonzero(self._seq & 1):
+            self._count[s] = 0
+            self._seeded[s] = time.time_ns()
+        self._seq[:] = 0
+
+    # ---------- Slots ----------
+    def slot(self, device_id: str, create: bool = False):
+        key = device_id.encode("utf-8")[:_ID_BYTES]
+        s = self._slot_of.get(device_id)
+        if s is not None and self._ids[s] == key:
+            return s
+        hits = np.flatnonzero(self._ids == key)
+        if len(hits):
+            s = int(hits[0])
+        elif create:
+            free = np.flatnonzero(self._ids == b"")
+            if not len(free):
+                raise RuntimeError(f"Ring store is full ({self.slots} devices); raise RING_MAX_DEVICES")
+            s = int(free[0])
+            self._seq[s] += 1
+            self._count[s] = 0
+            # complete only from now on, until seed_from_db fills in the window before it
+            self._seeded[s] = time.time_ns()
+            self._ids[s] = key
+            self._seq[s] += 1
+        else:
+            return None
+        self._slot_of[device_id] = s
+        return s
+
+    def retain(self, device_ids):
+        """Free the slots of devices no longer in ``device_ids``."""
+        keep = {d.encode("utf-8")[:_ID_BYTES] for d in device_ids}
+        for s in np.flatnonzero(self._ids != b""):
+            if self._ids[s] not in keep:
+                self._seq[s] += 1
+                self._ids[s] = b""
+                self._count[s] = 0
+                self._seeded[s] = 0
+                self._seq[s] += 1
+        self._slot_of.clear()
+
+    # ---------- Writing (data_collector) ----------
+    def set_complete_from(self, device_id: str, from_ns: int):
+        """Record that the slot holds every reading since ``from_ns`` (and maybe not before)."""
+        s = self.slot(device_id, create=True)
+        self._seeded[s] = from_ns
+
+    def touch(self):
+        self._header["heartbeat_ns"][0] = time.time_ns()
+
+    def extend(self, device_id: str, ts: np.ndarray, values: dict):
+        """Append readings (ascending ``ts`` in ns); ones not newer than the slot's last are dropped."""
+        s = self.slot(device_id, create=True)
+        n, cap = int(self._count[s]), self.capacity
+        ts = np.asarray(ts, dtype=np.int64)
+        keep = slice(None)
+        if n:
+            keep = slice(int(np.searchsorted(ts, self._ts[s, (n - 1) % cap], side="right")), None)
+        ts = ts[keep]
+        trimmed = len(ts) > cap
+        ts = ts[-cap:]
+        k = len(ts)
+        if k:
+            idx = (n + np.arange(k)) % cap
+            self._seq[s] += 1
+            if trimmed:  # more than fits: the slot only holds the newest ``cap`` readings
+                self._seeded[s] = max(int(self._seeded[s]), int(ts[0]))
+            self._ts[s, idx] = ts
+            for f in RING_FIELDS:
+                v = values.get(f)
+                self._values[f][s, idx] = np.nan if v is None else np.asarray(v, dtype=np.float32)[keep][-cap:]
+            self._count[s] = n + k
+            self._seq[s] += 1
+        self.touch()
+
+    def append(self, device_id: str, doc: dict):
+        self.extend(device_id, np.array([epoch_ns(doc["timestamp"])]),
+                    {f: [np.nan if doc.get(f) is None else doc[f]] for f in RING_FIELDS})
+
+    # ---------- Reading (dashboard) ----------
+    def is_fresh(self) -> bool:
+        return time.time_ns() - int(self._header["heartbeat_ns"][0]) <= RING_STALE_SECONDS * 1e9
+
+    def _segments(self, n: int):
+        """Slices of the ring row in time order."""
+        cap = self.capacity
+        if n <= cap:
+            return [slice(0, n)]
+        head = n % cap
+        return [slice(head, cap), slice(0, head)]
+
+    def window(self, device_id: str, after_ns: int = None):
+        """(ts, {field: values}) newer than ``after_ns``, in time order; None if the device has no
+        slot or the slot could not be read consistently."""
+        s = self.slot(device_id)
+        if s is None:
+            return None
+        for _ in range(RING_READ_RETRIES):
+            seq = int(self._seq[s])
+            if seq & 1:
+                time.sleep(0)
+                continue
+            n = int(self._count[s])
+            ts_row = self._ts[s]
+            parts = []
+            for seg in self._segments(n):
+                v = ts_row[seg]  # zero-copy view
+                start = 0 if after_ns is None else int(np.searchsorted(v, after_ns, side="right"))
+                parts.append((seg.start + start, seg.stop))
+            ts = np.concatenate([ts_row[a:b] for a, b in parts])
+            values = {f: np.concatenate([self._values[f][s, a:b] for a, b in parts]) for f in RING_FIELDS}
+            if int(self._seq[s]) == seq:
+                return ts, values
+        return None  # the slot stayed locked: let the caller read MongoDB
+
+    def last_ns(self, device_id: str):
+        s = self.slot(device_id)
+        n = int(self._count[s]) if s is not None else 0
+        return int(self._ts[s, (n - 1) % self.capacity]) if n else None
+
+    def oldest_ns(self, device_id: str):
+        w = self.window(device_id)
+        return int(w[0][0]) if w and len(w[0]) else None
+
+    def complete_from_ns(self, device_id: str):
+        """ns from which the slot holds every reading, or None if the device has no slot
+        (or it could not be read consistently)."""
+        s = self.slot(device_id)
+        if s is None:
+            return None
+        for _ in range(RING_READ_RETRIES):
+            seq = int(self._seq[s])
+            if seq & 1:
+                time.sleep(0)
+                continue
+            n, seeded = int(self._count[s]), int(self._seeded[s])
+            # once wrapped, the oldest readings have been overwritten
+            oldest = int(self._ts[s, n % self.capacity]) if n > self.capacity else seeded
+            if int(self._seq[s]) == seq:
+                return max(seeded, oldest)
+        return None
+
+    def covers(self, device_id: str, start_ns: int) -> bool:
+        """True when the slot holds every reading since ``start_ns``."""
+        since = self.complete_from_ns(device_id)
+        return since is not None and since <= start_ns
+
+    def to_frame(self, device_id: str, after_ns: int = None) -> pd.DataFrame:
+        w = self.window(device_id, after_ns)
+        if w is None or not len(w[0]):
+            return pd.DataFrame()
+        ts, values = w
+        df = pd.DataFrame(values)
+        df.insert(0, "timestamp", pd.to_datetime(ts, unit="ns", utc=True))
+        return df
+
+    def latest(self, device_id: str):
+        """Newest reading as a dict (timestamp: tz-aware UTC pd.Timestamp), or None."""
+        last = self.last_ns(device_id)
+        if last is None:
+            return None
+        w = self.window(device_id, last - 1)
+        if w is None or not len(w[0]):
+            return None
+        ts, values = w
+        row = {"timestamp": pd.Timestamp(int(ts[-1]), unit="ns", tz="UTC"), "device_id": device_id}
+        row.update({f: float(v[-1]) for f, v in values.items()})
+        return row
+
+
+# ---------- Collector side ----------
+def seed_from_db(store: RingStore, device_id: str, hours: float = RING_HOURS) -> int:
+    """Fill the device's ring from MongoDB with whatever it is missing of the window.
+
+    Returns the number of readings added, or -1 when MongoDB could not be
+    read; the slot then only counts as complete from now on, so covers()
+    sends older ranges to MongoDB instead of showing a short series.
+    """
+    window_start = datetime.now(timezone.utc) - timedelta(hours=hours)
+    after = window_start
+    last = store.last_ns(device_id)
+    if last is not None:
+        after = max(after, pd.Timestamp(last, unit="ns", tz="UTC"))
+    try:
+        docs = docs_since(device_id, after, fields=("timestamp",) + RING_FIELDS, raise_errors=True)
+    except (PyMongoError, RuntimeError) as e:
+        # whatever the slot holds may end in a gap: only trust readings from now on
+        store.set_complete_from(device_id, time.time_ns())
+        print(f"[ring] WARNING: could not seed {device_id} from MongoDB ({e})")
+        return -1
+    if last is None or last < epoch_ns(window_start):
+        # the slot was empty (or only held readings from before a gap): it now holds the whole window
+        store.set_complete_from(device_id, epoch_ns(window_start))
+    if docs:
+        ts = pd.to_datetime([d["timestamp"] for d in docs], utc=True).as_unit("ns").asi8
+        values = {f: np.array([d.get(f) if d.get(f) is not None else np.nan for d in docs], dtype=np.float32)
+                  for f in RING_FIELDS}
+        store.extend(device_id, ts, values)
+    else:
+        store.slot(device_id, create=True)
+    return len(docs)
+
+
+# ---------- Dashboard side ----------
+_reader = None
+
+def shared_ring_store():
+    """Read-only view of the collector's store, or None when there is none or it is stale."""
+    global _reader
+    try:
+        st = os.stat(RING_STORE_PATH)
+    except OSError:
+        return None
+    if _reader is None or _reader.stamp != (st.st_ino, st.st_size):
+        try:
+            _reader = RingStore(RING_STORE_PATH)
+        except (OSError, ValueError):
+            _reader = None
+            return None
+    return _reader if _reader.is_fresh() else None
+
+
+def ring_latest(device_id: str):
+    store = shared_ring_store()
+    return store.latest(device_id) if store is not None else None
+
+
+def ring_bucketed_docs(device_id: str, start_dt: datetime, end_dt: datetime, bucket: str = "5min",
+                       aggs=("mean",), fields=METRIC_FIELDS, tz: str = LOCAL_TZ_NAME) -> pd.DataFrame:
+    """bucketed_docs served from the ring when it covers the range, else from MongoDB."""
+    store = shared_ring_store()
+    start_ns, end_ns = epoch_ns(start_dt), epoch_ns(end_dt)
+    if store is None or not set(fields) <= set(RING_FIELDS) or not store.covers(device_id, start_ns):
+        return bucketed_docs(device_id, start_dt, end_dt, bucket=bucket, aggs=aggs, fields=fields, tz=tz)
+    df = store.to_frame(device_id, after_ns=start_ns - 1)
+    if df.empty:
+        return df
+    df = df[df["timestamp"] <= pd.Timestamp(end_ns, unit="ns", tz="UTC")]
+    if df.empty:
+        return df
+    return bucket_readings(df, bucket, aggs, fields, tz)
@@ -0,0 +1,93 @@
+"""
+timeutil.py
+-----------
+The one time layer of the app.
+
+- Inside, everything is UTC: readings are stored as UTC datetimes, query
+  bounds are tz-aware UTC, and query frames carry UTC timestamps plus an
+  int64 epoch-ms index (tuya_api_mongo.compact_frame).
+- Local time (Asia/Dhaka) only exists at the edges: local day / month
+  boundaries are computed here, once, and handed to the queries as UTC;
+  the dashboard converts timestamps with to_local() right before display.
+"""
+
+from datetime import date, datetime, time, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+import pandas as pd
+
+LOCAL_TZ_NAME = "Asia/Dhaka"
+LOCAL_TZ = ZoneInfo(LOCAL_TZ_NAME)
+
+# range ends are inclusive ($lte), so a period ends on its last microsecond
+_LAST = timedelta(microseconds=1)
+
+
+def utc_now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def local_now() -> datetime:
+    return datetime.now(LOCAL_TZ)
+
+
+def as_utc(ts: datetime) -> datetime:
+    """Aware UTC datetime; naive input is taken as UTC, as MongoDB does."""
+    if ts.tzinfo is None:
+        return ts.replace(tzinfo=timezone.utc)
+    return ts.astimezone(timezone.utc)
+
+
+def naive_utc(ts: datetime) -> datetime:
+    """Naive UTC, the way MongoDB compares dates and stores bucket hours."""
+    return as_utc(ts).replace(tzinfo=None)
+
+
+def _utc_timestamp(ts) -> pd.Timestamp:
+    ts = pd.Timestamp(ts)
+    return ts if ts.tzinfo is not None else ts.tz_localize("UTC")
+
+
+def epoch_ns(ts) -> int:
+    """Epoch nanoseconds of a datetime / pd.Timestamp / datetime64; naive input is UTC."""
+    return int(_utc_timestamp(ts).value)
+
+
+def epoch_ms(ts) -> int:
+    return epoch_ns(ts) // 1_000_000
+
+
+def local_date_range(start: date, end: date):
+    """(first, last instant) in UTC of the local days ``start`` .. ``end``, inclusive."""
+    first = datetime.combine(start, time.min, tzinfo=LOCAL_TZ)
+    after = datetime.combine(end + timedelta(days=1), time.min, tzinfo=LOCAL_TZ)
+    return first.astimezone(timezone.utc), (after - _LAST).astimezone(timezone.utc)
+
+
+def local_day_range(now: datetime = None):
+    """Today in local time, as a UTC range."""
+    today = (now.astimezone(LOCAL_TZ) if now else local_now()).date()
+    return local_date_range(today, today)
+
+
+def local_month_range(now: datetime = None):
+    """This local calendar month, as a UTC range."""
+    today = (now.astimezone(LOCAL_TZ) if now else local_now()).date()
+    first = today.replace(day=1)
+    last = (first.replace(year=first.year + 1, month=1) if first.month == 12
+            else first.replace(month=first.month + 1)) - timedelta(days=1)
+    return local_date_range(first, last)
+
+
+def local_datetime(d: date, t: time = None) -> datetime:
+    """A local wall-clock date / time as an aware UTC datetime."""
+    return datetime.combine(d, t or time.min, tzinfo=LOCAL_TZ).astimezone(timezone.utc)
+
+
+def to_local(ts):
+    """Presentation edge: UTC Series / DatetimeIndex / Timestamp -> local time."""
+    if isinstance(ts, pd.Series):
+        return pd.to_datetime(ts, utc=True).dt.tz_convert(LOCAL_TZ_NAME)
+    if isinstance(ts, pd.DatetimeIndex):
+        return (ts if ts.tz is not None else ts.tz_localize("UTC")).tz_convert(LOCAL_TZ_NAME)
+    return _utc_timestamp(ts).tz_convert(LOCAL_TZ_NAME)
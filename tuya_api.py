@@ -1,4 +1,6 @@
 import os, time, json, hmac, hashlib, requests
+import asyncio, heapq, itertools, threading
+from collections import deque
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -7,6 +9,156 @@ ACCESS_SECRET = os.getenv("TUYA_ACCESS_SECRET", "")
 API_ENDPOINT = os.getenv("TUYA_API_ENDPOINT", "https://openapi.tuyaeu.com")
 HTTP_TIMEOUT = 15
 
+# ---------- Rate limiting ----------
+# Per-process budget: the collector and the dashboard are separate processes,
+# so give each its share of the project's QPS quota.
+TUYA_QPS = float(os.getenv("TUYA_QPS", "10"))
+TUYA_BURST = float(os.getenv("TUYA_BURST", str(max(1.0, TUYA_QPS))))
+# tokens only interactive calls may take, so a click never waits behind polling
+TUYA_RESERVE = float(os.getenv("TUYA_RESERVE", "1"))
+
+PRIORITY_INTERACTIVE = 0  # on/off clicks, group control
+PRIORITY_DASHBOARD = 1    # dashboard reads (force refresh)
+PRIORITY_BACKGROUND = 2   # collector polling / reconciliation
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_DASHBOARD: "dashboard",
+                  PRIORITY_BACKGROUND: "background"}
+# longest a call of each class waits for a token before giving up (None: as long as it takes)
+PRIORITY_TIMEOUTS = {PRIORITY_INTERACTIVE: 10.0, PRIORITY_DASHBOARD: float(HTTP_TIMEOUT),
+                     PRIORITY_BACKGROUND: None}
+
+
+class RateLimitTimeout(RuntimeError):
+    pass
+
+
+class _WaitStats:
+    __slots__ = ("calls", "timeouts", "total_s", "max_s", "recent")
+
+    def __init__(self):
+        self.calls = 0
+        self.timeouts = 0
+        self.total_s = 0.0
+        self.max_s = 0.0
+        self.recent = deque(maxlen=1000)  # last waits, for the p95
+
+    def add(self, waited: float):
+        self.calls += 1
+        self.total_s += waited
+        self.max_s = max(self.max_s, waited)
+        self.recent.append(waited)
+
+    def as_dict(self, queued: int) -> dict:
+        recent = sorted(self.recent)
+        p95 = recent[int(0.95 * (len(recent) - 1))] if recent else 0.0
+        return {
+            "calls": self.calls,
+            "timeouts": self.timeouts,
+            "queued": queued,
+            "wait_avg_ms": round(self.total_s / self.calls * 1000, 1) if self.calls else 0.0,
+            "wait_p95_ms": round(p95 * 1000, 1),
+            "wait_max_ms": round(self.max_s * 1000, 1),
+        }
+
+
+class RateLimiter:
+    """Token bucket shared by every thread (and, via acquire_async, every task) of the process.
+
+    Callers queue by priority: a token always goes to the highest priority
+    waiter (FIFO within a class), and all but interactive calls leave
+    ``reserve`` tokens in the bucket.
+    """
+
+    def __init__(self, rate: float = TUYA_QPS, burst: float = TUYA_BURST, reserve: float = TUYA_RESERVE):
+        self.rate = rate
+        self.burst = max(burst, 1.0 + reserve)
+        self.reserve = reserve
+        self._tokens = self.burst
+        self._stamp = time.monotonic()
+        self._cond = threading.Condition()
+        self._waiting = []  # heap of (priority, seq)
+        self._seq = itertools.count()
+        self._stats = {p: _WaitStats() for p in PRIORITY_NAMES}
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+
+    def _floor(self, priority: int) -> float:
+        return 0.0 if priority == PRIORITY_INTERACTIVE else self.reserve
+
+    def try_acquire(self, priority: int = PRIORITY_BACKGROUND) -> bool:
+        """Take a token only if one is free right now and nobody is queued ahead."""
+        with self._cond:
+            self._refill(time.monotonic())
+            if (self._waiting and self._waiting[0][0] <= priority) or \
+                    self._tokens < 1.0 + self._floor(priority):
+                return False
+            self._tokens -= 1.0
+            self._stats[priority].add(0.0)
+            return True
+
+    def acquire(self, priority: int = PRIORITY_BACKGROUND, timeout: float = None) -> float:
+        """Block until a token is granted; returns the seconds waited, raises RateLimitTimeout."""
+        start = time.monotonic()
+        deadline = None if timeout is None else start + timeout
+        floor = self._floor(priority)
+        entry = (priority, next(self._seq))
+        with self._cond:
+            heapq.heappush(self._waiting, entry)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    head = self._waiting[0] == entry
+                    if head and self._tokens >= 1.0 + floor:
+                        self._tokens -= 1.0
+                        break
+                    if deadline is not None and now >= deadline:
+                        self._stats[priority].timeouts += 1
+                        raise RateLimitTimeout(
+                            f"no Tuya API token within {timeout:g}s ({PRIORITY_NAMES[priority]})")
+                    # the head sleeps until its token is due; the others until the queue moves
+                    wait = (1.0 + floor - self._tokens) / self.rate if head else None
+                    if deadline is not None:
+                        wait = deadline - now if wait is None else min(wait, deadline - now)
+                    self._cond.wait(wait)
+            finally:
+                self._waiting.remove(entry)
+                heapq.heapify(self._waiting)
+                self._cond.notify_all()
+            waited = time.monotonic() - start
+            self._stats[priority].add(waited)
+        return waited
+
+    async def acquire_async(self, priority: int = PRIORITY_BACKGROUND, timeout: float = None) -> float:
+        """acquire() for asyncio tasks: the wait runs on a worker thread, not the event loop."""
+        if self.try_acquire(priority):
+            return 0.0
+        return await asyncio.to_thread(self.acquire, priority, timeout)
+
+    def stats(self) -> dict:
+        with self._cond:
+            self._refill(time.monotonic())
+            queued = {p: 0 for p in PRIORITY_NAMES}
+            for p, _ in self._waiting:
+                queued[p] += 1
+            return {
+                "qps": self.rate,
+                "tokens": round(self._tokens, 2),
+                **{name: self._stats[p].as_dict(queued[p]) for p, name in PRIORITY_NAMES.items()},
+            }
+
+
+rate_limiter = RateLimiter()
+
+def rate_limit_stats() -> dict:
+    """Queue-wait metrics of the shared limiter, per priority class."""
+    return rate_limiter.stats()
+
+def _limited(priority: int):
+    rate_limiter.acquire(priority, PRIORITY_TIMEOUTS.get(priority))
+
+
 def _make_sign(client_id, secret, method, url, access_token: str = "", body: str = ""):
     t = str(int(time.time() * 1000))
     message = client_id + access_token + t
@@ -21,24 +173,31 @@ def _make_sign(client_id, secret, method, url, access_token: str = "", body: str
     return sign, t
 
 _token_cache = {"value": None, "ts": 0, "ttl": 55}  # seconds
+_token_lock = threading.Lock()
 
-def get_token():
+def get_token(priority: int = PRIORITY_DASHBOARD):
     now = time.time()
     if _token_cache["value"] and (now - _token_cache["ts"] < _token_cache["ttl"]):
         return _token_cache["value"]
-    path = "/v1.0/token?grant_type=1"
-    sign, t = _make_sign(ACCESS_ID, ACCESS_SECRET, "GET", path)
-    headers = {"client_id": ACCESS_ID, "sign": sign, "t": t, "sign_method": "HMAC-SHA256"}
-    res = requests.get(API_ENDPOINT + path, headers=headers, timeout=HTTP_TIMEOUT)
-    data = res.json()
-    if not data.get("success"):
-        raise RuntimeError(f"Failed to get token: {data}")
-    _token_cache["value"] = data["result"]["access_token"]
-    _token_cache["ts"] = now
-    return _token_cache["value"]
-
-def get_device_status(device_id: str, token: str):
+    with _token_lock:  # concurrent callers share one token request
+        now = time.time()
+        if _token_cache["value"] and (now - _token_cache["ts"] < _token_cache["ttl"]):
+            return _token_cache["value"]
+        path = "/v1.0/token?grant_type=1"
+        _limited(priority)
+        sign, t = _make_sign(ACCESS_ID, ACCESS_SECRET, "GET", path)
+        headers = {"client_id": ACCESS_ID, "sign": sign, "t": t, "sign_method": "HMAC-SHA256"}
+        res = requests.get(API_ENDPOINT + path, headers=headers, timeout=HTTP_TIMEOUT)
+        data = res.json()
+        if not data.get("success"):
+            raise RuntimeError(f"Failed to get token: {data}")
+        _token_cache["value"] = data["result"]["access_token"]
+        _token_cache["ts"] = now
+        return _token_cache["value"]
+
+def get_device_status(device_id: str, token: str, priority: int = PRIORITY_DASHBOARD):
     path = f"/v1.0/devices/{device_id}/status"
+    _limited(priority)
     sign, t = _make_sign(ACCESS_ID, ACCESS_SECRET, "GET", path, token)
     headers = {
         "client_id": ACCESS_ID, "sign": sign, "t": t,
@@ -47,9 +206,10 @@ def get_device_status(device_id: str, token: str):
     res = requests.get(API_ENDPOINT + path, headers=headers, timeout=HTTP_TIMEOUT)
     return res.json()
 
-def control_device(device_id: str, token: str, command: str, value):
+def control_device(device_id: str, token: str, command: str, value, priority: int = PRIORITY_INTERACTIVE):
     path = f"/v1.0/devices/{device_id}/commands"
     body = json.dumps({"commands": [{"code": command, "value": value}]})
+    _limited(priority)
     sign, t = _make_sign(ACCESS_ID, ACCESS_SECRET, "POST", path, token, body)
     headers = {
         "client_id": ACCESS_ID, "sign": sign, "t": t,
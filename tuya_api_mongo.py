@@ -1,24 +1,112 @@
 import os
+import re
+from array import array
 from typing import List, Tuple
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+import numpy as np
 import pandas as pd
-from pymongo import MongoClient, ASCENDING, DESCENDING
-from pymongo.errors import PyMongoError
+from pymongo import MongoClient, ASCENDING, DESCENDING, UpdateOne, DeleteOne, WriteConcern
+from pymongo.read_preferences import Primary, SecondaryPreferred
+from pymongo.errors import PyMongoError, DuplicateKeyError, BulkWriteError
 from dotenv import load_dotenv
 
+from archive import archived_months, month_bounds, read_archive
+from timeutil import LOCAL_TZ_NAME, as_utc, naive_utc
+
 
 
 load_dotenv()
 MONGODB_URI = os.getenv("MONGODB_URI", "")
 MONGODB_DB  = os.getenv("MONGODB_DB", "SmartHome")
+# readings whose timestamps fall in the same READING_RESOLUTION_S slot are the same reading
+READING_RESOLUTION_S = int(os.getenv("READING_RESOLUTION_S", "5"))
+# "document": one document per reading in readings_{device_id} (default)
+# "bucket":   one document per device per hour in buckets_{device_id}
+READINGS_LAYOUT = os.getenv("READINGS_LAYOUT", "document").lower()
+# metric fields of a stored reading, in document order
+READING_FIELDS = ("voltage", "current", "power", "energy_kWh")
+
+# ---------- Client configuration ----------
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "50"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "2"))
+MONGO_MAX_IDLE_MS = int(os.getenv("MONGO_MAX_IDLE_MS", "300000"))
+# wire compression, in order of preference; unavailable codecs are skipped
+MONGO_COMPRESSORS = os.getenv("MONGO_COMPRESSORS", "zstd,snappy,zlib")
+# dashboard / analytics reads may go to a secondary that lags by up to this much
+MONGO_ANALYTICS_MAX_STALENESS_S = int(os.getenv("MONGO_ANALYTICS_MAX_STALENESS_S", "90"))
+# ingest write concern: w=1 without journal wait keeps the collector fast
+MONGO_WRITE_W = os.getenv("MONGO_WRITE_W", "1")
+MONGO_WRITE_J = os.getenv("MONGO_WRITE_J", "false").lower() in ("1", "true", "yes")
+
+def _available_compressors() -> list:
+    out = []
+    for name in (c.strip() for c in MONGO_COMPRESSORS.split(",") if c.strip()):
+        try:
+            if name == "zstd":
+                import zstandard  # noqa: F401
+            elif name == "snappy":
+                import snappy  # noqa: F401
+        except ImportError:
+            continue
+        out.append(name)
+    return out
+
+def client_options() -> dict:
+    opts = {
+        "tls": True,
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "maxIdleTimeMS": MONGO_MAX_IDLE_MS,
+        "retryWrites": True,
+        "retryReads": True,
+    }
+    compressors = _available_compressors()
+    if compressors:
+        opts["compressors"] = ",".join(compressors)
+        if "zlib" in compressors:
+            opts["zlibCompressionLevel"] = 6
+    return opts
+
+_ANALYTICS_READ = SecondaryPreferred(max_staleness=MONGO_ANALYTICS_MAX_STALENESS_S)
+_INGEST_WRITE = WriteConcern(w=int(MONGO_WRITE_W) if MONGO_WRITE_W.isdigit() else MONGO_WRITE_W,
+                             j=MONGO_WRITE_J)
+
+def _with_role(coll, role: str):
+    """live: primary reads (default) / analytics: secondary reads / write: ingest write concern."""
+    if role == "analytics":
+        return coll.with_options(read_preference=_ANALYTICS_READ)
+    if role == "write":
+        return coll.with_options(write_concern=_INGEST_WRITE)
+    return coll.with_options(read_preference=Primary())
 
 _client = None
 def get_client():
+    """The one MongoClient of this process (the dashboard and the collector each have one)."""
     global _client
     if _client is None and MONGODB_URI:
-        _client = MongoClient(MONGODB_URI, tls=True)
+        _client = MongoClient(MONGODB_URI, **client_options())
     return _client
 
+_warmed = False
+def warm_up() -> bool:
+    """Connect and authenticate at startup instead of on the first user request."""
+    global _warmed
+    client = get_client()
+    if client is None:
+        return False
+    if _warmed:
+        return True
+    # one attempt per process; if it fails, the first real query connects instead
+    _warmed = True
+    try:
+        client.admin.command("ping")
+        # server selection for the analytics route happens here too
+        _get_db(client).get_collection(LATEST_COLLECTION, read_preference=_ANALYTICS_READ) \
+            .find_one({}, {"_id": 1})
+        return True
+    except PyMongoError:
+        return False
+
 def _get_db(client):
     if client is None:
         return None
@@ -30,28 +118,341 @@ def _get_db(client):
         db = client[MONGODB_DB]
     return db
 
-def get_collection(device_id: str):
+_indexed = set()  # collections whose indexes were ensured by this process
+
+def get_collection(device_id: str, role: str = "live"):
     client = get_client()
     if client is None:
         return None
     db = _get_db(client)
     coll = db[f"readings_{device_id}"]
-    try:
-        coll.create_index([("timestamp", ASCENDING)])
-    except Exception:
-        pass
-    return coll
+    if device_id not in _indexed:
+        try:
+            coll.create_index([("timestamp", ASCENDING)])
+            # keyset pagination sorts on (timestamp, _id)
+            coll.create_index([("timestamp", ASCENDING), ("_id", ASCENDING)])
+            # idempotent writes; sparse so readings stored before ts_key existed don't collide
+            coll.create_index([("ts_key", ASCENDING)], unique=True, sparse=True)
+            _indexed.add(device_id)
+        except Exception:
+            pass
+    return _with_role(coll, role)
+
+def reading_key(ts: datetime) -> int:
+    """Epoch seconds truncated to READING_RESOLUTION_S: the reading's identity."""
+    epoch = int(as_utc(ts).timestamp())
+    return epoch - epoch % READING_RESOLUTION_S
 
 def insert_reading(device_id: str, doc: dict) -> bool:
-    coll = get_collection(device_id)
+    if READINGS_LAYOUT == "bucket":
+        coll = get_bucket_collection(device_id, "write")
+        if coll is None:
+            return False
+        try:
+            _append_to_buckets(coll, [doc])
+            return True
+        except PyMongoError:
+            return False
+    coll = get_collection(device_id, "write")
+    if coll is None:
+        return False
+    try:
+        coll.insert_one({**doc, "ts_key": reading_key(doc["timestamp"])})
+        return True
+    except DuplicateKeyError:
+        return True  # already stored: retries and replays are no-ops
+    except PyMongoError:
+        return False
+
+def insert_readings(device_id: str, docs: list) -> int:
+    """Bulk, ignore-duplicates insert; returns how many readings were new."""
+    if READINGS_LAYOUT == "bucket":
+        coll = get_bucket_collection(device_id, "write")
+        return _append_to_buckets(coll, docs) if coll is not None and docs else 0
+    coll = get_collection(device_id, "write")
+    if coll is None or not docs:
+        return 0
+    docs = [d if "ts_key" in d else {**d, "ts_key": reading_key(d["timestamp"])} for d in docs]
+    try:
+        return len(coll.insert_many(docs, ordered=False).inserted_ids)
+    except BulkWriteError as e:
+        errors = e.details.get("writeErrors", [])
+        if any(err.get("code") != 11000 for err in errors):
+            raise
+        return e.details.get("nInserted", 0)
+
+def backfill_reading_keys(device_id: str, batch: int = 5000) -> dict:
+    """Give readings stored before ts_key existed their key, deleting duplicates.
+
+    Walks the untagged readings in time order; the first reading of every
+    slot keeps it, later ones (double inserts) are removed.
+    """
+    coll = get_collection(device_id, "write")
+    stats = {"tagged": 0, "deleted": 0}
+    if coll is None:
+        return stats
+    while True:
+        docs = list(coll.find({"ts_key": {"$exists": False}}, {"timestamp": 1})
+                    .sort([("timestamp", ASCENDING), ("_id", ASCENDING)]).limit(batch))
+        if not docs:
+            return stats
+        keys = [reading_key(d["timestamp"]) for d in docs]
+        taken = {d["ts_key"] for d in coll.find({"ts_key": {"$in": keys}}, {"ts_key": 1})}
+        ops = []
+        for d, k in zip(docs, keys):
+            if k in taken:
+                ops.append(DeleteOne({"_id": d["_id"]}))
+                stats["deleted"] += 1
+            else:
+                taken.add(k)
+                ops.append(UpdateOne({"_id": d["_id"]}, {"$set": {"ts_key": k}}))
+                stats["tagged"] += 1
+        coll.bulk_write(ops, ordered=True)
+
+# ---------- Hourly bucket layout ----------
+# One document per device per hour with parallel arrays (ts, ts_key and one per
+# field) plus running sums; readings are appended in place with $push / $inc.
+# At a 5-10 s sample rate that is 360-720x fewer documents and index entries
+# than one document per reading.
+_BUCKET_PROJECTION = {"_id": 0, "device_id": 1, "device_name": 1, "ts": 1, "ts_key": 1,
+                      **{f: 1 for f in READING_FIELDS}}
+
+def get_bucket_collection(device_id: str, role: str = "live"):
+    client = get_client()
+    if client is None:
+        return None
+    coll = _get_db(client)[f"buckets_{device_id}"]
+    if ("buckets", device_id) not in _indexed:
+        try:
+            coll.create_index([("hour", ASCENDING)], unique=True)
+            _indexed.add(("buckets", device_id))
+        except Exception:
+            pass
+    return _with_role(coll, role)
+
+def bucket_hour(ts: datetime) -> datetime:
+    return naive_utc(ts).replace(minute=0, second=0, microsecond=0)
+
+def _bucket_append(doc: dict) -> UpdateOne:
+    ts = doc["timestamp"]
+    key = doc.get("ts_key", reading_key(ts))
+    values = {f: doc.get(f) for f in READING_FIELDS}
+    return UpdateOne(
+        # a reading already in the bucket matches nothing; the upsert that follows
+        # collides with the unique hour index and is dropped as a duplicate
+        {"hour": bucket_hour(ts), "ts_key": {"$ne": key}},
+        {
+            "$push": {"ts": ts, "ts_key": key, **values},
+            "$inc": {"n": 1, **{f"sum.{f}": float(v or 0) for f, v in values.items()}},
+            "$min": {"first": ts},
+            "$max": {"last": ts},
+            "$setOnInsert": {"device_id": doc.get("device_id"), "device_name": doc.get("device_name")},
+        },
+        upsert=True,
+    )
+
+def _append_to_buckets(coll, docs: list) -> int:
+    """Append readings to their hour buckets; returns how many were new."""
+    ops = [_bucket_append(d) for d in docs]
+    added = 0
+    # a duplicate-key error is either a reading already stored or two writers
+    # creating the same hour at once; one retry tells them apart
+    for _ in range(2):
+        try:
+            res = coll.bulk_write(ops, ordered=False)
+            return added + res.upserted_count + res.modified_count
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            if any(err.get("code") != 11000 for err in errors):
+                raise
+            added += e.details.get("nUpserted", 0) + e.details.get("nModified", 0)
+            ops = [ops[err["index"]] for err in errors]
+    return added
+
+def _unpack_buckets(buckets: list, lo: datetime = None, hi: datetime = None, lo_inclusive: bool = True):
+    """Concatenate the buckets' arrays into one numpy column per field, in time order."""
+    if not buckets:
+        return None
+    sizes = np.array([len(b["ts"]) for b in buckets], dtype=np.int64)
+    ts = np.concatenate([np.asarray(b["ts"], dtype="datetime64[ms]") for b in buckets])
+    cols = {
+        "timestamp": ts,
+        "device_id": np.repeat(np.array([b.get("device_id") for b in buckets], dtype=object), sizes),
+        "device_name": np.repeat(np.array([b.get("device_name") for b in buckets], dtype=object), sizes),
+        **{f: np.concatenate([np.asarray(b[f], dtype=np.float64) for b in buckets]) for f in READING_FIELDS},
+        "ts_key": np.concatenate([np.asarray(b["ts_key"], dtype=np.int64) for b in buckets]),
+    }
+    keep = np.ones(len(ts), dtype=bool)
+    if lo is not None:
+        lo = np.datetime64(naive_utc(lo), "ms")
+        keep &= (ts >= lo) if lo_inclusive else (ts > lo)
+    if hi is not None:
+        keep &= ts <= np.datetime64(naive_utc(hi), "ms")
+    idx = np.flatnonzero(keep)
+    sel = ts[idx]
+    if len(sel) > 1 and (np.diff(sel) < np.timedelta64(0, "ms")).any():
+        idx = idx[np.argsort(sel, kind="stable")]  # late readings land at the end of their hour
+    return {k: v[idx] for k, v in cols.items()}
+
+def _bucket_frame(cols) -> pd.DataFrame:
+    """Unpacked columns -> the same DataFrame range_docs returns for the document layout."""
+    if cols is None or not len(cols["timestamp"]):
+        return pd.DataFrame()
+    df = pd.DataFrame(cols)
+    df["timestamp"] = pd.to_datetime(df["timestamp"], utc=True)
+    return df
+
+def _bucket_hours(start_dt: datetime, end_dt: datetime) -> dict:
+    return {"hour": {"$gte": bucket_hour(start_dt), "$lte": naive_utc(end_dt)}}
+
+def iter_bucket_frames(device_id: str, start_dt: datetime, end_dt: datetime, chunk_rows: int = 50000):
+    """range_docs for the bucket layout in pieces of whole hours, ~``chunk_rows`` readings each."""
+    coll = get_bucket_collection(device_id, "analytics")
     if coll is None:
+        return
+    buf, rows = [], 0
+    for b in coll.find(_bucket_hours(start_dt, end_dt), _BUCKET_PROJECTION).sort("hour", ASCENDING):
+        buf.append(b)
+        rows += len(b["ts"])
+        if rows >= chunk_rows:
+            df = _bucket_frame(_unpack_buckets(buf, start_dt, end_dt))
+            if not df.empty:
+                yield df
+            buf, rows = [], 0
+    df = _bucket_frame(_unpack_buckets(buf, start_dt, end_dt))
+    if not df.empty:
+        yield df
+
+def _unpacked_stages(start_dt: datetime, end_dt: datetime) -> list:
+    """Aggregation stages turning hour buckets back into one document per reading."""
+    arrays = ["ts", "ts_key", *READING_FIELDS]
+    fields = {("timestamp" if a == "ts" else a): {"$arrayElemAt": ["$r", i]} for i, a in enumerate(arrays)}
+    return [
+        {"$match": _bucket_hours(start_dt, end_dt)},
+        {"$project": {"device_id": 1, "device_name": 1, "r": {"$zip": {"inputs": [f"${a}" for a in arrays]}}}},
+        {"$unwind": "$r"},
+        {"$project": {"_id": 0, "device_id": 1, "device_name": 1, **fields}},
+        {"$match": {"timestamp": {"$gte": start_dt, "$lte": end_dt}}},
+    ]
+
+def _reading_source(device_id: str, start_dt: datetime, end_dt: datetime):
+    """(collection name, stages yielding one document per reading in [start, end]) for the layout."""
+    if READINGS_LAYOUT == "bucket":
+        return f"buckets_{device_id}", _unpacked_stages(start_dt, end_dt)
+    return f"readings_{device_id}", [{"$match": {"timestamp": {"$gte": start_dt, "$lte": end_dt}}}]
+
+
+def oldest_timestamp(device_id: str):
+    """Timestamp of the device's oldest reading in MongoDB (naive UTC), or None."""
+    try:
+        if READINGS_LAYOUT == "bucket":
+            coll = get_bucket_collection(device_id)
+            doc = coll.find_one({}, {"first": 1}, sort=[("hour", ASCENDING)]) if coll is not None else None
+            return doc.get("first") if doc else None
+        coll = get_collection(device_id)
+        doc = coll.find_one({}, {"timestamp": 1}, sort=[("timestamp", ASCENDING)]) if coll is not None else None
+        return doc["timestamp"] if doc else None
+    except PyMongoError:
+        return None
+
+def delete_range(device_id: str, start_dt: datetime, end_dt: datetime) -> int:
+    """Delete readings in [start_dt, end_dt) once they are archived (hour-aligned bounds)."""
+    if READINGS_LAYOUT == "bucket":
+        coll = get_bucket_collection(device_id, "write")
+        q = {"hour": {"$gte": bucket_hour(start_dt), "$lt": naive_utc(end_dt)}}
+    else:
+        coll = get_collection(device_id, "write")
+        q = {"timestamp": {"$gte": start_dt, "$lt": end_dt}}
+    if coll is None:
+        return 0
+    return coll.delete_many(q).deleted_count
+
+# ---------- Latest reading per device ----------
+LATEST_COLLECTION = "latest_readings"
+
+def get_latest_collection():
+    client = get_client()
+    if client is None:
+        return None
+    return _get_db(client)[LATEST_COLLECTION]
+
+def _latest_update(device_id: str, doc: dict):
+    fields = {k: v for k, v in doc.items() if k != "_id"}
+    # only move forward: an older reading never overwrites a newer one
+    return {"_id": device_id, "timestamp": {"$not": {"$gt": fields.get("timestamp")}}}, {"$set": fields}
+
+def upsert_latest(device_id: str, doc: dict) -> bool:
+    """Keep one last-value document per device (``_id`` = device id)."""
+    coll = get_latest_collection()
+    if coll is None:
+        return False
+    try:
+        coll.with_options(write_concern=_INGEST_WRITE).update_one(*_latest_update(device_id, doc), upsert=True)
+        return True
+    except DuplicateKeyError:
+        # a newer reading is already stored; the upsert lost the race
+        return True
+    except PyMongoError:
+        return False
+
+def upsert_latest_many(docs: dict) -> bool:
+    """upsert_latest for {device_id: doc} in one bulk write."""
+    coll = get_latest_collection()
+    if coll is None:
+        return False
+    if not docs:
+        return True
+    ops = [UpdateOne(*_latest_update(did, doc), upsert=True) for did, doc in docs.items()]
+    try:
+        coll.with_options(write_concern=_INGEST_WRITE).bulk_write(ops, ordered=False)
+        return True
+    except BulkWriteError as e:
+        # duplicate keys: newer readings already stored, those upserts lost the race
+        return all(err.get("code") == 11000 for err in e.details.get("writeErrors", []))
+    except PyMongoError:
+        return False
+
+def get_latest(device_id: str):
+    coll = get_latest_collection()
+    if coll is None:
+        return None
+    try:
+        return coll.find_one({"_id": device_id})
+    except PyMongoError:
+        return None
+
+def get_latest_many(device_ids) -> dict:
+    """Last-value documents for many devices in one query -> {device_id: doc}."""
+    coll = get_latest_collection()
+    if coll is None or not device_ids:
+        return {}
+    try:
+        return {d["_id"]: d for d in coll.find({"_id": {"$in": list(device_ids)}})}
+    except PyMongoError:
+        return {}
+
+# ---------- Fleet summary ----------
+SUMMARY_COLLECTION = "fleet_summary"
+
+def publish_summary(summary: dict) -> bool:
+    client = get_client()
+    if client is None:
         return False
     try:
-        coll.insert_one(doc)
+        _get_db(client)[SUMMARY_COLLECTION].replace_one({"_id": "fleet"}, summary, upsert=True)
         return True
     except PyMongoError:
         return False
 
+def get_summary():
+    client = get_client()
+    if client is None:
+        return None
+    try:
+        return _get_db(client)[SUMMARY_COLLECTION].find_one({"_id": "fleet"})
+    except PyMongoError:
+        return None
+
 # # ---------- NEW: Queries ----------
 # def latest_docs(device_id: str, n: int = 100) -> pd.DataFrame:
 #     coll = get_collection(device_id)
@@ -69,34 +470,480 @@ def insert_reading(device_id: str, doc: dict) -> bool:
 
 # ---------- UPDATED: Queries ----------
 def latest_docs(device_id: str, n: int = 100) -> pd.DataFrame:
+    if READINGS_LAYOUT == "bucket":
+        coll = get_bucket_collection(device_id)
+        if coll is None:
+            return pd.DataFrame()
+        buckets, rows = [], 0
+        for b in coll.find({}, _BUCKET_PROJECTION).sort("hour", DESCENDING):
+            buckets.append(b)
+            rows += len(b["ts"])
+            if rows >= n:
+                break
+        return compact_frame(_bucket_frame(_unpack_buckets(buckets[::-1])).tail(n))
     coll = get_collection(device_id)
     if coll is None:
         return pd.DataFrame()
-    cur = coll.find({}, {"_id": 0}).sort("timestamp", DESCENDING).limit(n)
-    df = pd.DataFrame(list(cur))
-    if df.empty:
+    pipeline = [
+        {"$sort": {"timestamp": -1}},
+        {"$limit": n},
+        {"$sort": {"timestamp": 1}},  # only n documents: flip to ascending server-side
+        _FRAME_PROJECTION,
+    ]
+    return _columns_frame(coll.aggregate(pipeline), device_id)
+
+
+def range_docs(device_id: str, start_dt: datetime, end_dt: datetime, compact: bool = True) -> pd.DataFrame:
+    """Readings in [start_dt, end_dt]: archived months (archive.py) followed by MongoDB's.
+
+    ``compact`` (default): float32 metrics, categorical device_id / device_name
+    and an int64 epoch-ms index (see compact_frame); False keeps full precision.
+    """
+    archived = read_archive(device_id, start_dt, end_dt)
+    df = db_range_docs(device_id, start_dt, end_dt, compact)
+    if archived.empty:
         return df
+    if df.empty:
+        return compact_frame(archived) if compact else archived
+    overlap = archived["timestamp"].iloc[-1] >= df["timestamp"].iloc[0]
+    df = pd.concat([archived, df], ignore_index=True)
+    if overlap:
+        # a month leaves MongoDB only after its file is written; a run stopped
+        # in between leaves both copies
+        df = df.sort_values("timestamp", kind="stable")
+        df = df[~(df["ts_key"].notna() & df.duplicated("ts_key"))].reset_index(drop=True)
+    return compact_frame(df) if compact else df
 
-    # Convert UTC → Dhaka (GMT+6)
-    df["timestamp"] = pd.to_datetime(df["timestamp"], utc=True)
-    df["timestamp"] = df["timestamp"].dt.tz_convert("Asia/Dhaka")
 
-    df = df.sort_values("timestamp")  # ascending for charts
+def db_range_docs(device_id: str, start_dt: datetime, end_dt: datetime, compact: bool = True) -> pd.DataFrame:
+    """range_docs without the archive tier."""
+    if READINGS_LAYOUT == "bucket":
+        coll = get_bucket_collection(device_id, "analytics")
+        if coll is None:
+            return pd.DataFrame()
+        buckets = list(coll.find(_bucket_hours(start_dt, end_dt), _BUCKET_PROJECTION).sort("hour", ASCENDING))
+        df = _bucket_frame(_unpack_buckets(buckets, start_dt, end_dt))
+        return compact_frame(df) if compact else df
+    coll = get_collection(device_id, "analytics")
+    if coll is None:
+        return pd.DataFrame()
+    pipeline = [
+        {"$match": {"timestamp": {"$gte": start_dt, "$lte": end_dt}}},
+        {"$sort": {"timestamp": 1}},
+        _FRAME_PROJECTION,
+    ]
+    return _columns_frame(coll.aggregate(pipeline, allowDiskUse=True), device_id, compact)
+
+
+# epoch ms decodes to a plain int instead of a datetime object per reading
+_FRAME_PROJECTION = {"$project": {"_id": 0, "t": {"$toLong": "$timestamp"}, "device_id": 1, "device_name": 1,
+                                  "ts_key": 1, **{f: 1 for f in READING_FIELDS}}}
+
+
+def _columns_frame(docs, device_id: str, compact: bool = True) -> pd.DataFrame:
+    """range_docs' frame built column by column from the cursor.
+
+    Values go straight into typed arrays and names into small code tables, so
+    no list of per-reading dicts (the old peak) is ever held in memory. The
+    cursor is already in time order, so nothing is re-sorted, and timestamps
+    stay UTC (timeutil.to_local converts for display).
+    """
+    nan = float("nan")
+    t, keys = array("q"), array("d")
+    values = {f: array("d") for f in READING_FIELDS}
+    ids, names = {}, {}
+    id_codes, name_codes = array("i"), array("i")
+    for d in docs:
+        t.append(d["t"])
+        k = d.get("ts_key")
+        keys.append(nan if k is None else k)
+        for f, a in values.items():
+            v = d.get(f)
+            a.append(nan if v is None else v)
+        id_codes.append(ids.setdefault(d.get("device_id") or device_id, len(ids)))
+        name_codes.append(names.setdefault(d.get("device_name") or "", len(names)))
+    if not t:
+        return pd.DataFrame()
+
+    epoch_ms = np.frombuffer(t, dtype=np.int64)
+    key_arr = np.frombuffer(keys, dtype=np.float64)
+    cols = {
+        "timestamp": pd.to_datetime(epoch_ms, unit="ms", utc=True),
+        "device_id": pd.Categorical.from_codes(np.frombuffer(id_codes, dtype=np.int32), list(ids)),
+        "device_name": pd.Categorical.from_codes(np.frombuffer(name_codes, dtype=np.int32), list(names)),
+        **{f: np.frombuffer(a, dtype=np.float64).astype(np.float32 if compact else np.float64)
+           for f, a in values.items()},
+        "ts_key": key_arr if np.isnan(key_arr).any() else key_arr.astype(np.int64),
+    }
+    df = pd.DataFrame(cols, index=pd.Index(epoch_ms, name="epoch_ms") if compact else None)
+    if not compact:
+        df["device_id"] = df["device_id"].astype(object)
+        df["device_name"] = df["device_name"].astype(object)
     return df
 
 
-def range_docs(device_id: str, start_dt: datetime, end_dt: datetime) -> pd.DataFrame:
+def compact_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """float32 metrics, categorical device_id / device_name, int64 epoch-ms index."""
+    if df.empty:
+        return df
+    df = df.astype({f: np.float32 for f in READING_FIELDS if f in df.columns})
+    for c in ("device_id", "device_name"):
+        if c in df.columns and not isinstance(df[c].dtype, pd.CategoricalDtype):
+            df[c] = df[c].astype("category")
+    df.index = pd.Index(pd.DatetimeIndex(df["timestamp"]).as_unit("ms").asi8, name="epoch_ms")
+    return df
+
+
+def docs_since(device_id: str, after_dt: datetime, fields=None, limit: int = 0,
+               raise_errors: bool = False) -> list:
+    """Readings strictly newer than ``after_dt``, ascending, as plain dicts.
+
+    Used for incremental refreshes, so no DataFrame or timezone work here.
+    Errors read as "no new readings" unless ``raise_errors`` (callers that
+    must tell an empty range from a failed read).
+    """
+    if READINGS_LAYOUT == "bucket":
+        return _bucket_docs_since(device_id, after_dt, fields, limit, raise_errors)
     coll = get_collection(device_id)
     if coll is None:
+        if raise_errors:
+            raise RuntimeError("MongoDB is not available")
+        return []
+    projection = {"_id": 0}
+    if fields:
+        projection.update({f: 1 for f in fields})
+    cur = coll.find({"timestamp": {"$gt": after_dt}}, projection).sort("timestamp", ASCENDING)
+    if limit:
+        cur = cur.limit(limit)
+    try:
+        return list(cur)
+    except PyMongoError:
+        if raise_errors:
+            raise
+        return []
+
+def _bucket_docs_since(device_id: str, after_dt: datetime, fields=None, limit: int = 0,
+                       raise_errors: bool = False) -> list:
+    coll = get_bucket_collection(device_id)
+    if coll is None:
+        if raise_errors:
+            raise RuntimeError("MongoDB is not available")
+        return []
+    try:
+        buckets = list(coll.find({"hour": {"$gte": bucket_hour(after_dt)}}, _BUCKET_PROJECTION)
+                       .sort("hour", ASCENDING))
+    except PyMongoError:
+        if raise_errors:
+            raise
+        return []
+    cols = _unpack_buckets(buckets, lo=after_dt, lo_inclusive=False)
+    if cols is None:
+        return []
+    names = [f for f in (fields or cols) if f in cols]
+    n = min(limit, len(cols["timestamp"])) if limit else len(cols["timestamp"])
+    values = [cols[f][:n].tolist() for f in names]  # datetime64[ms] -> naive UTC datetimes
+    return [dict(zip(names, row)) for row in zip(*values)]
+
+
+# ---------- Server-side bucketing ----------
+_BUCKET_UNITS = {
+    "s": "second", "sec": "second",
+    "t": "minute", "min": "minute",
+    "h": "hour",
+    "d": "day",
+}
+_AGG_OPS = {"mean": "$avg", "min": "$min", "max": "$max", "sum": "$sum"}
+METRIC_FIELDS = ("power", "voltage", "current", "energy_kWh")
+
+def parse_bucket(bucket: str):
+    """'5min' / '5T' / '1h' / '1d' -> ('minute', 5) for $dateTrunc."""
+    m = re.fullmatch(r"\s*(\d*)\s*([a-zA-Z]+)\s*", bucket)
+    unit = _BUCKET_UNITS.get(m.group(2).lower()) if m else None
+    if unit is None:
+        raise ValueError(f"Unsupported bucket size: {bucket!r}")
+    return unit, int(m.group(1) or 1)
+
+_PANDAS_UNITS = {"second": "s", "minute": "min", "hour": "h", "day": "D"}
+
+def pandas_freq(bucket: str) -> str:
+    """'5min' / '1h' / ... -> the equivalent pandas frequency string."""
+    unit, n = parse_bucket(bucket)
+    return f"{n}{_PANDAS_UNITS[unit]}"
+
+def bucket_readings(df: pd.DataFrame, bucket: str = "5min", aggs=("mean",), fields=METRIC_FIELDS,
+                    tz: str = LOCAL_TZ_NAME) -> pd.DataFrame:
+    """bucketed_docs for readings already in memory (archive files, the ring store)."""
+    if df.empty:
+        return pd.DataFrame()
+    # same bucket starts as $dateTrunc in ``tz``, returned in UTC
+    ts = pd.to_datetime(df["timestamp"], utc=True)
+    starts = ts.dt.tz_convert(tz).dt.floor(pandas_freq(bucket)).dt.tz_convert("UTC")
+    g = df.groupby(starts.rename("timestamp"))
+    out = pd.DataFrame({"count": g.size()})
+    for f in fields:
+        for a in aggs:
+            if a == "count":
+                continue
+            if a not in _AGG_OPS:
+                raise ValueError(f"Unsupported aggregate: {a!r}")
+            out[f if a == "mean" else f"{f}_{a}"] = g[f].agg(a).astype(np.float64)
+    return out.reset_index()
+
+def _merge_buckets(parts, keys=("timestamp",)) -> pd.DataFrame:
+    """Concatenate bucket frames; a bucket found in several parts (one straddling
+    the archive / MongoDB boundary) is combined, means weighted by ``count``."""
+    parts = [p for p in parts if not p.empty]
+    if not parts:
         return pd.DataFrame()
-    q = {"timestamp": {"$gte": start_dt, "$lte": end_dt}}
-    cur = coll.find(q, {"_id": 0}).sort("timestamp", ASCENDING)
-    df = pd.DataFrame(list(cur))
+    keys = list(keys)
+    df = pd.concat(parts, ignore_index=True)
+    if df.duplicated(keys).any():
+        spec, means = {}, []
+        for c in df.columns.drop(keys):
+            if c == "count" or c.endswith("_sum"):
+                spec[c] = "sum"
+            elif c.endswith(("_min", "_max")):
+                spec[c] = c[-3:]
+            else:
+                spec[c] = "sum"
+                means.append(c)
+        df[means] = df[means].mul(df["count"], axis=0)
+        df = df.groupby(keys, as_index=False).agg(spec)
+        df[means] = df[means].div(df["count"], axis=0)
+    return df.sort_values(keys, ignore_index=True)
+
+def _db_start(device_id: str, start_dt: datetime, end_dt: datetime) -> datetime:
+    """Where the range leaves the archive: the end of the last archived month in it.
+
+    Archived months are deleted from MongoDB only after their file is
+    verified, so the file is the complete copy of everything before this.
+    """
+    start = as_utc(start_dt)
+    db_start = start
+    for y, m in archived_months(device_id):
+        m_start, m_end = month_bounds(y, m)
+        if m_start <= as_utc(end_dt) and m_end > start:
+            db_start = max(db_start, m_end)
+    return db_start
+
+def bucketed_docs(device_id: str, start_dt: datetime, end_dt: datetime, bucket: str = "5min",
+                  aggs=("mean",), fields=METRIC_FIELDS, tz: str = LOCAL_TZ_NAME) -> pd.DataFrame:
+    """One row per time bucket, aggregated inside MongoDB.
+
+    Columns: ``timestamp`` (bucket start), ``count`` and, per field, ``<field>``
+    for the mean and ``<field>_<agg>`` for min / max / sum. Archived months
+    are read from their files and bucketed here. MongoDB errors propagate, as
+    in range_docs, so callers (and the cache) never take a failure for "no data".
+    """
+    db_start = _db_start(device_id, start_dt, end_dt)
+    archived = pd.DataFrame()
+    if db_start > as_utc(start_dt):
+        archived = bucket_readings(read_archive(device_id, start_dt, min(as_utc(end_dt), db_start)),
+                                   bucket, aggs, fields, tz)
+        if db_start > as_utc(end_dt):
+            return archived
+    get_coll = get_bucket_collection if READINGS_LAYOUT == "bucket" else get_collection
+    coll = get_coll(device_id, "analytics")
+    if coll is None:
+        return archived
+    unit, bin_size = parse_bucket(bucket)
+    group = {
+        "_id": {"$dateTrunc": {"date": "$timestamp", "unit": unit, "binSize": bin_size, "timezone": tz}},
+        "count": {"$sum": 1},
+    }
+    for f in fields:
+        for a in aggs:
+            if a == "count":
+                continue
+            if a not in _AGG_OPS:
+                raise ValueError(f"Unsupported aggregate: {a!r}")
+            group[f if a == "mean" else f"{f}_{a}"] = {_AGG_OPS[a]: f"${f}"}
+    _, pipeline = _reading_source(device_id, db_start, end_dt)
+    pipeline += [
+        {"$group": group},
+        {"$sort": {"_id": 1}},
+    ]
+    df = pd.DataFrame(list(coll.aggregate(pipeline, allowDiskUse=True)))
     if df.empty:
-        return df
+        return archived
+    df = df.rename(columns={"_id": "timestamp"})
     df["timestamp"] = pd.to_datetime(df["timestamp"], utc=True)
-    df["timestamp"] = df["timestamp"].dt.tz_convert("Asia/Dhaka")
+    return _merge_buckets([archived, df]) if not archived.empty else df
 
-    df = df.sort_values("timestamp")  # ascending for charts
-    
-    return df
+
+def sparkline_series(device_ids, start_dt: datetime, end_dt: datetime, bucket: str = "1h",
+                     field: str = "power", tz: str = LOCAL_TZ_NAME) -> pd.DataFrame:
+    """Bucketed ``field`` for many devices in ONE aggregation round trip.
+
+    Each device's collection is bucketed server-side and the results are
+    combined with $unionWith; archived months are bucketed from their files.
+    Returns long format: device_id, timestamp, <field>.
+    """
+    device_ids = list(device_ids)
+    client = get_client()
+    if client is None or not device_ids:
+        return pd.DataFrame()
+    unit, bin_size = parse_bucket(bucket)
+
+    archived, db_ranges = [], []
+    for did in device_ids:
+        db_start = _db_start(did, start_dt, end_dt)
+        if db_start > as_utc(start_dt):
+            part = read_archive(did, start_dt, min(as_utc(end_dt), db_start))
+            archived.append(bucket_readings(part, bucket, ("mean",), (field,), tz).assign(device_id=did))
+        if db_start <= as_utc(end_dt):
+            db_ranges.append((did, db_start))
+
+    def per_device(did, lo):
+        return _reading_source(did, lo, end_dt)[1] + [
+            {"$group": {
+                "_id": {"$dateTrunc": {"date": "$timestamp", "unit": unit, "binSize": bin_size, "timezone": tz}},
+                field: {"$avg": f"${field}"},
+                "count": {"$sum": 1},
+            }},
+            {"$project": {"_id": 0, "timestamp": "$_id", field: 1, "count": 1, "device_id": {"$literal": did}}},
+        ]
+
+    df = pd.DataFrame()
+    if db_ranges:
+        pipeline = per_device(*db_ranges[0])
+        for did, lo in db_ranges[1:]:
+            name, _ = _reading_source(did, lo, end_dt)
+            pipeline.append({"$unionWith": {"coll": name, "pipeline": per_device(did, lo)}})
+        pipeline.append({"$sort": {"device_id": 1, "timestamp": 1}})
+        try:
+            name, _ = _reading_source(db_ranges[0][0], db_ranges[0][1], end_dt)
+            coll = _get_db(client).get_collection(name, read_preference=_ANALYTICS_READ)
+            df = pd.DataFrame(list(coll.aggregate(pipeline, allowDiskUse=True)))
+        except PyMongoError:
+            return pd.DataFrame()
+    if not df.empty:
+        df["timestamp"] = pd.to_datetime(df["timestamp"], utc=True)
+    df = _merge_buckets([*archived, df], keys=("device_id", "timestamp"))
+    if df.empty:
+        return df
+    return df[["device_id", "timestamp", field]]
+
+
+# ---------- Keyset pagination ----------
+def _beyond(key, desc: bool, tie: str = "_id") -> dict:
+    """Filter for rows after ``key`` = (timestamp, <tie>) in the given sort direction.
+
+    A tie value of None means "start at this timestamp, inclusive" (jump-to-time).
+    """
+    ts, oid = key
+    op = "$lt" if desc else "$gt"
+    if oid is None:
+        return {"timestamp": {"$lte" if desc else "$gte": ts}}
+    return {"$or": [{"timestamp": {op: ts}}, {"timestamp": ts, tie: {op: oid}}]}
+
+def _key_in(key, lo: datetime, hi: datetime, desc: bool):
+    """The cursor as it applies to the segment [lo, hi]: False if the segment lies
+    wholly before it, None if wholly past it (no filter needed), else ``key``."""
+    if key is None:
+        return None
+    ts = as_utc(key[0])
+    if (ts < lo) if desc else (ts > hi):
+        return False
+    return key if lo <= ts <= hi else None
+
+def _db_page(device_id: str, lo: datetime, hi: datetime, key, desc: bool, n: int) -> list:
+    """Up to ``n`` MongoDB readings of [lo, hi] past ``key``, in query order."""
+    bucketed = READINGS_LAYOUT == "bucket"
+    # unpacked bucket readings have no _id of their own; ts_key is unique per reading there
+    tie = "ts_key" if bucketed else "_id"
+    coll = (get_bucket_collection if bucketed else get_collection)(device_id, "analytics")
+    if coll is None:
+        return []
+    order = DESCENDING if desc else ASCENDING
+    if bucketed:
+        pipeline = _unpacked_stages(lo, hi)
+        if key is not None:
+            pipeline.append({"$match": _beyond(key, desc, tie)})
+        pipeline += [{"$sort": {"timestamp": order, tie: order}}, {"$limit": n}]
+        docs = list(coll.aggregate(pipeline, allowDiskUse=True))
+    else:
+        q = {"timestamp": {"$gte": lo, "$lte": hi}}
+        if key is not None:
+            q = {"$and": [q, _beyond(key, desc)]}
+        docs = list(coll.find(q).sort([("timestamp", order), ("_id", order)]).limit(n))
+    return [((d["timestamp"], d[tie]), d) for d in docs]
+
+def _archive_page(device_id: str, lo: datetime, hi: datetime, key, desc: bool, n: int) -> list:
+    """Up to ``n`` archived readings of [lo, hi] past ``key``, in query order, one month file at a time."""
+    if key is not None:
+        ts = as_utc(key[0])
+        lo, hi = (lo, min(hi, ts)) if desc else (max(lo, ts), hi)
+    months = [(y, m) for y, m in archived_months(device_id)
+              if month_bounds(y, m)[0] <= hi and month_bounds(y, m)[1] > lo]
+    out = []
+    for y, m in (reversed(months) if desc else months):
+        m_start, m_end = month_bounds(y, m)
+        df = read_archive(device_id, max(lo, m_start), min(hi, m_end - timedelta(milliseconds=1)))
+        if df.empty:
+            continue
+        if key is not None:
+            ts = pd.Timestamp(as_utc(key[0]))
+            past = (df["timestamp"] < ts) if desc else (df["timestamp"] > ts)
+            if key[1] is None:
+                past |= df["timestamp"] == ts
+            else:
+                past |= (df["timestamp"] == ts) & ((df["ts_key"] < key[1]) if desc else (df["ts_key"] > key[1]))
+            df = df[past]
+        df = df.sort_values(["timestamp", "ts_key"], ascending=not desc).head(n - len(out))
+        out += [((d["timestamp"].to_pydatetime(), int(d["ts_key"])), d) for d in df.to_dict("records")]
+        if len(out) >= n:
+            break
+    return out
+
+def page_docs(device_id: str, start_dt: datetime, end_dt: datetime, limit: int = 200,
+              after=None, before=None, descending: bool = True) -> dict:
+    """One page of raw readings using keyset pagination on (timestamp, _id)
+    (on (timestamp, ts_key) for the bucket layout and archived months).
+
+    Pass ``after`` = the previous page's ``last`` key for the next page, or
+    ``before`` = the current page's ``first`` key for the previous one. Only
+    ``limit`` + 1 documents are read from MongoDB per call, however deep the
+    page is; archived months are read from their files, one month at a time.
+    Returns {"rows": DataFrame, "first": key, "last": key, "has_next": bool, "has_prev": bool}.
+    """
+    empty = {"rows": pd.DataFrame(), "first": None, "last": None, "has_next": False, "has_prev": False}
+    # walking backwards = querying in the opposite order, then flipping the page
+    backwards = before is not None
+    desc = descending != backwards
+    key = before if backwards else after
+
+    start, end = as_utc(start_dt), as_utc(end_dt)
+    db_start = _db_start(device_id, start, end)
+    segments = []
+    if db_start <= end:
+        segments.append((_db_page, db_start, end))
+    if db_start > start:
+        segments.append((_archive_page, start, min(end, db_start - timedelta(milliseconds=1))))
+    if not desc:
+        segments.reverse()
+    docs = []
+    try:
+        for fetch, lo, hi in segments:
+            seg_key = _key_in(key, lo, hi, desc)
+            if seg_key is not False:
+                docs += fetch(device_id, lo, hi, seg_key, desc, limit + 1 - len(docs))
+            if len(docs) > limit:
+                break
+    except PyMongoError:
+        return empty
+    more = len(docs) > limit
+    docs = docs[:limit]
+    if backwards:
+        docs.reverse()
+    if not docs:
+        return {**empty, "has_prev": after is not None, "has_next": backwards}
+    df = pd.DataFrame([d for _, d in docs]).drop(columns=["_id"], errors="ignore")
+    df["timestamp"] = pd.to_datetime([as_utc(t) for t in df["timestamp"]], utc=True)
+    return {
+        "rows": df,
+        "first": docs[0][0],
+        "last": docs[-1][0],
+        "has_next": True if backwards else more,
+        "has_prev": more if backwards else key is not None,
+    }